@@ -38,6 +38,15 @@ class LightCurve:
     :type mags: numpy.ndarray
     :param magerrs: magnitude errors array
     :type magerrs: numpy.ndarray
+    .. note:: getjds() and getmags() keep the microlensing and fluxshift contributions in cache. The cache follows any
+        change of the shifts, of the microlensing parameters, and of the content of jds and mags (including item
+        assignments like ``l.mags[i] = x``), as it is keyed on a copy of these arrays.
+
+    .. note:: A light copy (``l.copy(light=True)``) shares the jds, magerrs and properties with its original. The arrays
+        of the copy are read-only views : to change them, assign new arrays (``l.jds = l.jds + 1.0``), which is what
+        all methods of this class do. The original is not affected. The properties are duplicated on the first access
+        to them.
+
     :param mask: A boolean mask, allows to "switch off" some points. True means "included", False means "skip this one".
     :type mask: numpy.ndarray
     :param properties:  This is a list of dicts (exactly one per data point) in which you can put whatever you want to. You can use them to carry image names, airmasses, sky levels, telescope names etc. Of course this slows down a bit things like merging, etc.
@@ -67,6 +76,12 @@ class LightCurve:
         By default the constructor, is creating a small default lightcurve with 5 points, labels, and a mask to play with.
         """
 
+        # Cache of the fluxshift and microlensing contributions to getmags, see getmags()
+        self.fluxshiftcache = None
+        self.mlcache = None
+        # True if the properties are shared with a light copy, see copy()
+        self.sharedproperties = False
+
         # Some various simple attributes :
         self.telescopename = telescopename
         self.object = object
@@ -97,6 +112,66 @@ class LightCurve:
         self.labels = [""] * len(self)
         self.showlabels = False
 
+    @property
+    def jds(self):
+        return self._jds
+
+    @jds.setter
+    def jds(self, jds):
+        self._jds = jds
+        self.datachanged()
+
+    @property
+    def mags(self):
+        return self._mags
+
+    @mags.setter
+    def mags(self, mags):
+        self._mags = mags
+        self.datachanged()
+
+    @property
+    def properties(self):
+        if self.sharedproperties:
+            self._properties = pythoncopy.deepcopy(self._properties)
+            self.sharedproperties = False
+        return self._properties
+
+    @properties.setter
+    def properties(self, properties):
+        self._properties = properties
+        self.sharedproperties = False
+
+    def datachanged(self):
+        """
+        Invalidates the cache of getmags(). Assignments to jds and mags call me automatically. Item assignments are
+        detected anyway, as the cache compares the content of these arrays.
+        """
+        self.fluxshiftcache = None
+        self.mlcache = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["fluxshiftcache"] = None
+        state["mlcache"] = None
+        state["sharedproperties"] = False  # the state is pickled or deep-copied, so it is not shared anymore
+        return state
+
+    def __setstate__(self, state):
+        # Lightcurves pickled before the cache was introduced store jds and mags as plain attributes.
+        for key in ["jds", "mags", "properties"]:
+            if key in state:
+                state["_" + key] = state.pop(key)
+        state.pop("dataversion", None)  # the cache used to be keyed on a version number
+        state.setdefault("fluxshiftcache", None)
+        state.setdefault("mlcache", None)
+        state.setdefault("sharedproperties", False)
+        # Arrays that were shared with a light copy come back read-only from a pickle, they are not shared anymore.
+        for key in ["_jds", "magerrs"]:
+            if isinstance(state.get(key), np.ndarray) and not state[key].flags.writeable:
+                state[key] = state[key].copy()
+        self.__dict__.update(state)
+
     # I explicitly define how str(mylightcurve) will look. This allows a nice "print(mylightcurve)" for instance !
     def __str__(self):
         """
@@ -266,12 +341,14 @@ class LightCurve:
         else:
             self.fluxshift = float(flux)
 
-    def getjds(self):
+    def getjds(self, out=None):
         """
         A getter method returning the jds + timeshift. This one does the actual shift.
         Because of the addition, we return a copy.
+
+        :param out: optional preallocated array of length len(self), in which I write the result instead of allocating a new one.
         """
-        return self.jds + self.timeshift
+        return np.add(self.jds, self.timeshift, out=out)
 
     def getminfluxshift(self):
         """
@@ -314,6 +391,32 @@ class LightCurve:
         else:
             return np.zeros(len(self))
 
+    def getfluxshiftmags(self):
+        """
+        Cached version of calcfluxshiftmags(), used by getmags(). Do not modify the returned array.
+        The cache is keyed on the fluxshift and on a copy of the mags, so that it also follows item assignments to mags.
+        """
+        cache = getattr(self, "fluxshiftcache", None)
+        if cache is None or cache[0] != self.fluxshift or not np.array_equal(cache[1], self.mags):
+            self.fluxshiftcache = cache = (self.fluxshift, self.mags.copy(), self.calcfluxshiftmags())
+        return cache[2]
+
+    def getmlmags(self):
+        """
+        Cached version of self.ml.calcmlmags(self), used by getmags(). Do not modify the returned array.
+        The cache is kept as long as the microlensing object and its parameters (see its cachekey() method) and the jds
+        (on which the polynomial microlensing depends) do not change.
+        """
+        key = self.ml.cachekey() if hasattr(self.ml, "cachekey") else None
+        cache = getattr(self, "mlcache", None)
+        if key is None or cache is None or cache[0] is not self.ml or cache[1] != key or \
+                not np.array_equal(cache[2], self.jds):
+            mlmags = self.ml.calcmlmags(self)
+            if key is None:  # pragma: no cover
+                return mlmags
+            self.mlcache = cache = (self.ml, key, self.jds.copy(), mlmags)
+        return cache[3]
+
     def addfluxes(self, fluxes):
         """
         Give me fluxes as a numpy array as long as self.mags, and I'll add those to self.mags.
@@ -328,7 +431,7 @@ class LightCurve:
         self.mags = -2.5 * np.log10(newfluxes)
         self.commentlist.append("Added some fluxes")
 
-    def getmags(self, noml=False):
+    def getmags(self, noml=False, out=None):
         """
         A getter method returning magnitudes. Now this is non trivial, as magnitudes are influenced by :
             - fluxshift
@@ -341,18 +444,20 @@ class LightCurve:
         lc.mags "+" fluxshift + magshift + microlensings if ml is present,
         and just lc.mags "+" fluxshift + magshift if not.
         You can overwrite this : if noml = True, I don't include the ml even if a microlensing is present !
+
+        The fluxshift and microlensing contributions are cached, see :meth:`getfluxshiftmags` and :meth:`getmlmags`.
+
+        :param out: optional preallocated array of length len(self), in which I write the result instead of allocating a new one.
         """
 
         if self.fluxshift != 0.0:
-            if (self.ml is not None) and (noml is False):
-                return self.mags + self.calcfluxshiftmags() + self.magshift + self.ml.calcmlmags(self)
-            else:
-                return self.mags + self.calcfluxshiftmags() + self.magshift
+            out = np.add(self.mags, self.getfluxshiftmags(), out=out)
+            out += self.magshift
         else:
-            if (self.ml is not None) and (noml is False):
-                return self.mags + self.magshift + self.ml.calcmlmags(self)
-            else:
-                return self.mags + self.magshift
+            out = np.add(self.mags, self.magshift, out=out)
+        if (self.ml is not None) and (noml is False):
+            out += self.getmlmags()
+        return out
 
     def getmagerrs(self):
         """
@@ -446,7 +551,7 @@ class LightCurve:
         you will probably need to refit the microlensing after shifting the curves
         """
 
-        self.jds += self.timeshift
+        self.jds = self.jds + self.timeshift  # no in-place operation, jds might be shared with a light copy
         self.commentlist.append("CAUTION : timeshift of %f APPLIED" % self.timeshift)
         self.timeshift = 0.0  # as this is now applied.
 
@@ -584,17 +689,50 @@ class LightCurve:
 
         self.properties = [{} for i in range(len(self))]
 
-    def copy(self):
+    def copy(self, light=False):
         """
         Returns a "deep copy" of the lightcurve object. Try to avoid this within loops etc ... it is slow !
         Typically if you want to optmize time and mag shifts, think about using local backups of lc.getmags() and lc.getjds() etc ...
 
         We use the copy module, imported as "pythoncopy" to avoid confusion with this method.
 
+        With light=True, I return a much faster copy that shares the jds, magerrs and properties with the original curve,
+        as these are rarely modified. The copy gets read-only views of the jds and magerrs, so that an in-place
+        modification of the copy raises an error instead of silently affecting the original. The original curve is left
+        as it is : if you modify its jds or magerrs in place, the light copy sees it. So use light copies for short-lived
+        temporaries only. The properties get duplicated as soon as one of the two curves accesses them.
+        Everything else (mags, mask, shifts, microlensing, labels, comments) is copied.
+
+        :param light: if True, make a light copy sharing the data that is not modified in place.
+        :type light: bool
+
         :return: A copy of the lightcurve.
 
         """
-        return pythoncopy.deepcopy(self)
+        if not light:
+            return pythoncopy.deepcopy(self)
+
+        self.sharedproperties = True
+
+        new = LightCurve.__new__(LightCurve)
+        for (key, value) in self.__dict__.items():
+            if key in ["_jds", "magerrs"]:
+                # Read-only views for the copy only, the arrays of the original stay writable.
+                new.__dict__[key] = value.view()
+                new.__dict__[key].flags.writeable = False
+            elif key == "_properties":
+                new.__dict__[key] = value
+            elif isinstance(value, np.ndarray):
+                new.__dict__[key] = value.copy()
+            elif key in ["labels", "commentlist"]:
+                new.__dict__[key] = list(value)
+            elif key in ["fluxshiftcache", "mlcache"]:
+                new.__dict__[key] = None
+            elif key == "ml":
+                new.__dict__[key] = None if value is None else value.copy()
+            else:
+                new.__dict__[key] = pythoncopy.deepcopy(value)
+        return new
 
     def cutmask(self):
         """
@@ -736,7 +874,7 @@ class LightCurve:
 
         self.commentlist.append("Monte Carlo on jds !")  # to avoid confusions.
         rs = np.random.RandomState(seed)  # we create a random state object, to control the seed.
-        self.jds += (rs.uniform(low=0.0, high=2.0 * amplitude, size=self.jds.shape) - amplitude)
+        self.jds = self.jds + (rs.uniform(low=0.0, high=2.0 * amplitude, size=self.jds.shape) - amplitude)
         # uniform distribution. Yes, this is a bit strange, but low cannot be negative.
 
         # And now everything is fine but the curve might not be sorted, so :
@@ -2,7 +2,6 @@
 Module containing the function related to LightCurve operation
 It contains light curves plotting routine, and all function that operate on a *list* of LightCurve
 """
-import copy
 import logging
 import operator
 import os
@@ -1192,22 +1191,60 @@ def interpolate(x1, x2, interpolate='nearest'):
     :return: interpolated LightCurve
     """
 
-    if interpolate == 'nearest':
-        new = x1.copy()
-        new_mags = []
-        for i, d in enumerate(x1.jds):
-            distance, ind = find_closest(d, x2.jds)
-            new_mags.append(x2.mags[ind])
+    new = x1.copy()
+    new.mags = resample(x1.jds, x2.jds, x2.mags, interpolate=interpolate)
+    return new
 
-        new.jds = x1.jds.copy()
-        new.mags = np.asarray(new_mags)
 
-        return new
+def resample(x, xp, fp, interpolate='nearest'):
+    """
+    Resample the values fp, given at the times xp, at the times x. This costs O((n+m) log m) with searchsorted, instead
+    of comparing each of the n times x to the m times xp.
+    fp can also be a 2-D array, a stack of curves sampled at the same times xp (e.g. noise realisations), that I
+    resample all at once.
+
+    :param x: 1-D array, times where to resample
+    :param xp: 1-D array, times of the values
+    :param fp: 1-D array of the same length as xp, or 2-D array with one curve per row
+    :param interpolate: string, choose between 'nearest' (same choice as :py:func:`find_closest`) and 'linear' (the
+        values outside of xp are set to 0)
+
+    :return: array of shape (len(x),) or (len(fp), len(x))
+    """
+    x = np.asarray(x, dtype=float)
+    xp = np.asarray(xp, dtype=float)
+    fp = np.asarray(fp)
+    order = np.arange(len(xp))
+    if np.any(np.diff(xp) < 0):
+        order = np.argsort(xp, kind='stable')
+        xp = xp[order]
+        fp = fp[..., order]
+
+    if interpolate == 'nearest':
+        # The two neighbours of each x, taking the first of several points at the same time :
+        idx = np.searchsorted(xp, x)
+        left = np.searchsorted(xp, xp[np.clip(idx - 1, 0, len(xp) - 1)])
+        right = np.searchsorted(xp, xp[np.clip(idx, 0, len(xp) - 1)])
+        (dleft, dright) = (np.abs(xp[left] - x), np.abs(xp[right] - x))
+        # On a tie, the first one in the original order wins, as with np.argmin :
+        useleft = np.logical_or(dleft < dright, np.logical_and(dleft == dright, order[left] <= order[right]))
+        return fp[..., np.where(useleft, left, right)]
 
     elif interpolate == 'linear':
-        new = x1.copy()
-        new.mags = np.interp(new.jds, x2.jds, x2.mags, left=0., right=0.)
-        return new
+        if fp.ndim == 1:
+            return np.interp(x, xp, fp, left=0., right=0.)
+        if len(xp) < 2:  # pragma: no cover
+            return np.array([np.interp(x, xp, f, left=0., right=0.) for f in fp])
+        j = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, len(xp) - 2)
+        dx = xp[j + 1] - xp[j]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = np.where(dx > 0, (x - xp[j]) / dx, 1.0)
+        out = fp[:, j] * (1.0 - w) + fp[:, j + 1] * w
+        out[:, np.logical_or(x < xp[0], x > xp[-1])] = 0.
+        return out
+
+    else:  # pragma: no cover
+        raise RuntimeError("I don't know the interpolation %s, choose between 'nearest' and 'linear'." % interpolate)
 
 
 def find_closest(a, x):
@@ -1232,7 +1269,7 @@ def cut_lcs(lc_in, min_date, max_date):
     :return:
     """
 
-    lc_out = copy.deepcopy(lc_in)
+    lc_out = lc_in.copy(light=True)
     lc_out.mags = lc_out.mags[np.logical_and(lc_out.jds < max_date, min_date < lc_out.jds)]
     lc_out.magerrs = lc_out.magerrs[np.logical_and(lc_out.jds < max_date, min_date < lc_out.jds)]
     lc_out.mask= lc_out.mask[np.logical_and(lc_out.jds < max_date, min_date < lc_out.jds)]
@@ -1252,7 +1289,7 @@ def select_epochs(lc_in, array_index):
     :return:
     """
 
-    lc_out = copy.deepcopy(lc_in)
+    lc_out = lc_in.copy(light=True)
     lc_out.mags = lc_out.mags[array_index]
     lc_out.magerrs = lc_out.magerrs[array_index]
     lc_out.mask= lc_out.mask[array_index]
@@ -76,7 +76,7 @@ def matchtels(lcsref, lcsmatch, dispersionmethod, fluxshifts=True):
         p[0] = magshift, the same for all curves, ini = 0.1
         """
 
-        lcsmod = [l.copy() for l in lcsmatch]
+        lcsmod = [l.copy(light=True) for l in lcsmatch]
 
         setp(p, lcsmod)
 
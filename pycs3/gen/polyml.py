@@ -111,6 +111,8 @@ class SeasonFct:
         @ivar: How many free parameters
         """
 
+        self.fitcache = None
+
     def copy(self):
         """
         Return a copy of itself
@@ -193,6 +195,37 @@ class SeasonFct:
         """
         self.season.checkcompatibility(lightcurve)
 
+    def fitmatrix(self, lightcurve):
+        """
+        Returns the matrix M so that M.dot(mags) gives the polynom coeffs fitted on the mags of my season, in the same way
+        as :py:func:`polyfit` does (weighted linear least squares on the "centered" jds).
+        M is the pseudo-inverse of the weighted Vandermonde matrix, times the weights. As the jds and magerrs of a season
+        do not change during an optimisation, I keep it in cache, so that each refit is just a matrix-vector product.
+
+        :param lightcurve: the LightCurve object I belong to
+        :return: array of shape (number of params, number of points of the season)
+        """
+        jds = lightcurve.jds[self.season.indices]
+        magerrs = lightcurve.magerrs[self.season.indices]
+        cache = getattr(self, "fitcache", None)  # older pickles do not have this attribute
+        if cache is not None and np.array_equal(cache[0], jds) and np.array_equal(cache[1], magerrs):
+            return cache[2]
+
+        a = np.vander(jds - np.mean(jds), len(self.params)) / magerrs[:, np.newaxis]
+        fitmat = np.linalg.pinv(a, rcond=np.finfo(float).eps * max(a.shape)) / magerrs  # the same cutoff as lstsq
+        self.fitcache = (jds, magerrs, fitmat)
+        return fitmat
+
+    def fit(self, lightcurve, mags):
+        """
+        Sets my params to the weighted least squares fit of mags, see :py:meth:`fitmatrix`.
+        As in :py:func:`pycs3.spl.multiopt.opt_ml`, all my params have to be free.
+
+        :param lightcurve: the LightCurve object I belong to
+        :param mags: array of the mags to fit, one per point of my season
+        """
+        self.setparams(self.fitmatrix(lightcurve).dot(mags))
+
     def calcmlmags(self, lightcurve):
         """
         Returns a "lc.mags"-like array made using the ml-parameters.
@@ -339,18 +372,41 @@ class Microlensing:
         for sfct in self.mllist:
             sfct.checkcompatibility(lightcurve)
 
+    def cachekey(self):
+        """
+        Returns a snapshot of the parameters of all seasonfct objects, so that the LightCurve can keep the ML mags in cache.
+        """
+        return tuple(np.asarray(sfct.params, dtype=float).tobytes() for sfct in self.mllist)
+
     def calcmlmags(self, lightcurve):
         """
         Returns one a "lc.mags"-like array made using the parameters of all seasonfct objects.
         This array has the same size as lc.mags, and contains the microlensing to be added to lc.mags.
 
-        Idea : perhaps we can make this faster by not calling calcmags of the seasonfct objects ?
+        I evaluate all the seasons at once (Horner scheme on the stacked "centered" jds of all seasons), the seasons may
+        overlap and have different numbers of params.
         """
 
-        allmags = np.zeros(len(lightcurve.jds))
-        for microlensing in self.mllist:
-            allmags += microlensing.calcmlmags(lightcurve)
-        return allmags
+        indices = np.concatenate([sfct.season.indices for sfct in self.mllist])
+        lengths = np.array([len(sfct.season.indices) for sfct in self.mllist])
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        seasonid = np.repeat(np.arange(len(self.mllist)), lengths)
+
+        jds = lightcurve.jds[indices]
+        jds -= (np.add.reduceat(jds, starts) / lengths)[seasonid]
+
+        # The params, padded with leading zeros to the largest degree :
+        maxn = max(len(sfct.params) for sfct in self.mllist)
+        params = np.zeros((len(self.mllist), maxn))
+        for (i, sfct) in enumerate(self.mllist):
+            params[i, maxn - len(sfct.params):] = sfct.params
+        params = params[seasonid]
+
+        mags = params[:, 0].copy()
+        for j in range(1, maxn):
+            mags = mags * jds + params[:, j]
+
+        return np.bincount(indices, weights=mags, minlength=len(lightcurve.jds))
 
     def stats(self, lightcurve):
         """
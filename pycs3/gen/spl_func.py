@@ -39,7 +39,7 @@ def merge(lcs, olddp=None, splitup=True, deltat=0.000001, sort=True, stab=False,
 
 def fit(lcs, knotstep=20.0, n=None, knots=None, stab=True,
         stabext=300.0, stabgap=20.0, stabstep=5.0, stabmagerr=-2.0, stabrampsize=0, stabrampfact=1.0,
-        bokit=1, bokeps=2.0, boktests=5, bokwindow=None, bokmethod = 'BF', k=3, verbose=True):
+        bokit=1, bokeps=2.0, boktests=5, bokwindow=None, bokmethod = 'BF', k=3, verbose=True, bandedlsq=False):
     """
     The highlevel function to make a spline fit.
     Specify either knotstep (spacing of knots) or n (how many knots to place) or knots (give me actual initial knot locations, for instance prepared by seasonknots.)
@@ -68,12 +68,14 @@ def fit(lcs, knotstep=20.0, n=None, knots=None, stab=True,
     :type bokeps: float
     :param boktests: number of test positions for each knot
     :type boktests: int
-    :param bokmethod: string, choose from "BF", "MCBF", "fmin", "fminind". Recommanded default : "BF"
+    :param bokmethod: string, choose from "BF", "MCBF", "fmin", "fminind", "BFbatch", "MCBFbatch". Recommanded default : "BF". The batch versions give the same results as BF and MCBF, faster.
     :type bokmethod: str
     :param k: degree of the splines, default = cubic splines k=3, 3 means that you can differentiate twice at the knots.
     :type k: int
     :param verbose: verbosity
     :type verbose: bool
+    :param bandedlsq: use the incremental :py:class:`pycs3.gen.spl.BandedLSQ` engine instead of splrep for the fits
+    :type bandedlsq: bool
 
     :return: An optimised Spline object
 
@@ -81,7 +83,7 @@ def fit(lcs, knotstep=20.0, n=None, knots=None, stab=True,
     dp = merge(lcs, stab=stab, stabext=stabext, stabgap=stabgap, stabstep=stabstep, stabmagerr=stabmagerr,
                stabrampsize=stabrampsize, stabrampfact=stabrampfact)
 
-    s = Spline(dp, k=k, bokeps=bokeps, boktests=boktests, bokwindow=bokwindow)
+    s = Spline(dp, k=k, bokeps=bokeps, boktests=boktests, bokwindow=bokwindow, bandedlsq=bandedlsq)
 
     if knots is None:
         if n is None:
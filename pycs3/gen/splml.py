@@ -117,6 +117,13 @@ class SplineML:
         """
         self.spline.reset()
 
+    def cachekey(self):
+        """
+        Returns a snapshot of what calcmlmags depends on, so that the LightCurve can keep the ML mags in cache.
+        """
+        dp = self.spline.datapoints
+        return id(self.spline), self.spline.t.tobytes(), self.spline.c.tobytes(), dp.jds.tobytes(), dp.mask.tobytes()
+
     def calcmlmags(self, lightcurve):
         """
         Required by lc (for getmags, applyml, etc...)
@@ -154,6 +161,78 @@ class SplineML:
 
         return {"n": n, "jds": smoothtime, "ml": smoothml, "refmag": refmag, "knotjds": knotjds, "knotmags": knotmags}
 
+class NoiseSplineML(SplineML):
+    """
+    A SplineML with some extra noise, as built by the tweakml functions of :py:mod:`pycs3.sim.twk`.
+    Instead of an interpolating spline with a knot per noise sample, I keep the untweaked ML spline, and the noise on
+    its regular grid, that I interpolate linearly. This is much faster to build, copy and evaluate.
+
+    The noise arrays are read-only, build a new object to change them.
+    """
+
+    def __init__(self, spline, noisejds, noisemags):
+        """
+        :param spline: Spline object, the microlensing without the noise
+        :param noisejds: 1-D array, regular grid of the noise, in the same (relative) jds as the spline datapoints
+        :param noisemags: 1-D array, noise to add to the spline on this grid
+        """
+        SplineML.__init__(self, spline)
+        self.noisejds = np.array(noisejds, dtype=float)
+        self.noisemags = np.array(noisemags, dtype=float)
+        self.noisejds.setflags(write=False)
+        self.noisemags.setflags(write=False)
+
+    def evalnoise(self, jds):
+        """
+        Linear interpolation of the noise at the given (relative) jds.
+        """
+        if self.noisemags is None:
+            return np.zeros(np.shape(jds))
+        return np.interp(jds, self.noisejds, self.noisemags)
+
+    def settargetmags(self, lightcurve, sourcespline):
+        """
+        Same as :py:meth:`SplineML.settargetmags`, but the spline only has to fit what the noise does not give.
+        The stab points are not touched, as in SplineML.settargetmags.
+        """
+        SplineML.settargetmags(self, lightcurve, sourcespline)
+        dp = self.spline.datapoints
+        dp.mags[dp.mask] -= self.evalnoise(dp.jds[dp.mask])
+
+    def replacespline(self, newspline):
+        """
+        Replace the whole microlensing by newspline, I then forget about the noise.
+        """
+        SplineML.replacespline(self, newspline)
+        self.noisejds = None
+        self.noisemags = None
+
+    def cachekey(self):
+        """
+        Returns a snapshot of what calcmlmags depends on, so that the LightCurve can keep the ML mags in cache.
+        """
+        return SplineML.cachekey(self) + (None if self.noisemags is None else self.noisemags.tobytes(),)
+
+    def calcmlmags(self, lightcurve):
+        """
+        Required by lc (for getmags, applyml, etc...)
+        Returns a mags-like vector containing the mags to be added to the lightcurve.
+        :param lightcurve: lightCurve object, not used, this is to match the polyml.Microlensing.calcmlmags()
+        """
+        jds = self.spline.datapoints.jds[self.spline.datapoints.mask]
+        return self.spline.eval(nostab=True) + self.evalnoise(jds)
+
+    def smooth(self, lightcurve, n=1000):
+        """
+        Same as :py:meth:`SplineML.smooth`, with the noise.
+        """
+        out = SplineML.smooth(self, lightcurve, n=n)
+        jdref = lightcurve.getjds()[0]
+        out["ml"] = out["ml"] + self.evalnoise(out["jds"] - jdref)
+        out["knotmags"] = out["knotmags"] + self.evalnoise(out["knotjds"] - jdref)
+        return out
+
+
 def addtolc(lc, n=5, knotstep=None, stab=True, stabgap=30.0, stabstep=3.0, stabmagerr=1.0,
             bokeps=10.0, boktests=10, bokwindow=None):
     """
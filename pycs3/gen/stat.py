@@ -7,6 +7,7 @@ import math
 import os
 
 import matplotlib.pyplot as plt
+import multiprocess
 import numpy as np
 import pycs3.gen.util as ut
 
@@ -20,6 +21,8 @@ def sf(l, binsize=200, ssf=False):
     :param l: LightCurve object
     :param binsize: float, binsize if ssf is False
     :param ssf: boolean,  ssf gives a 2D density plot, otherwise binned.
+
+    This builds and sorts all the n^2 pairs of points, see :py:func:`sfbinned` for long curves.
     """
 
     mags = l.getmags()
@@ -75,6 +78,165 @@ def sf(l, binsize=200, ssf=False):
         plt.show()
 
 
+def sfbinned(l, bins=50, quantiles=None, magbins=1000, chunksize=256, plot=False, filename=None):
+    """
+    Binned structure function of a lightcurve, in bins of time difference, without building the n^2 pairs of points.
+
+    The points are sorted in time, so that for each point the partners falling in each bin of delta t form a contiguous
+    range, found with searchsorted. The counts, the sums of delta t and the sums of delta m^2 in these ranges come from
+    cumulative sums. This costs O(n nbins log n) operations and O(n) memory.
+    The quantiles of abs(delta m) need the pairs themselves : I then go through blocks of chunksize points and accumulate
+    a histogram of abs(delta m) in each bin, in O(n^2) operations but with bounded O(chunksize n + nbins magbins) memory.
+
+    :param l: LightCurve object
+    :param bins: integer, number of bins between 0 and the time span of the curve, or array of bin edges, in days. Pairs at the same date are never counted.
+    :param quantiles: list of floats between 0 and 1, quantiles of abs(delta m) to compute in each bin, or None
+    :param magbins: integer, number of bins of the abs(delta m) histograms used for the quantiles. These are precise to the width of these bins.
+    :param chunksize: integer, number of points processed at once
+    :param plot: boolean, if True I plot the structure function
+    :param filename: string, if not None I save the plot there instead of showing it
+
+    :return: dictionary with the bin edges "edges", and per bin the number of pairs "counts", the mean delta t "dt", the structure function "sf" (square root of the mean delta m^2, nan for empty bins) and, if asked, "quantiles" (array of shape (len(quantiles), nbins))
+    """
+    order = np.argsort(l.getjds(), kind='stable')
+    jds = l.getjds()[order]
+    mags = l.getmags()[order]
+    mags = mags - np.mean(mags)  # for the precision of the cumulative sums
+    n = len(jds)
+
+    if np.ndim(bins) == 0:
+        edges = np.linspace(0.0, (jds[-1] - jds[0]) * (1.0 + 1e-10), int(bins) + 1)  # the longest pair is in the last bin
+    else:
+        edges = np.asarray(bins, dtype=float)
+    nbins = len(edges) - 1
+
+    cumjds = np.concatenate([[0.0], np.cumsum(jds)])
+    cummags = np.concatenate([[0.0], np.cumsum(mags)])
+    cummags2 = np.concatenate([[0.0], np.cumsum(mags ** 2)])
+
+    counts = np.zeros(nbins, dtype=np.int64)
+    sumdt = np.zeros(nbins)
+    sumdm2 = np.zeros(nbins)
+    for a in range(0, n, chunksize):
+        b = min(a + chunksize, n)
+        j, m = jds[a:b, np.newaxis], mags[a:b, np.newaxis]
+        # partners of each point, per bin, in [lo, hi) :
+        bounds = np.searchsorted(jds, j + edges)
+        bounds = np.maximum(bounds, np.searchsorted(jds, j, side='right'))  # only the later dates
+        lo, hi = bounds[:, :-1], bounds[:, 1:]
+        cnt = hi - lo
+        counts += np.sum(cnt, axis=0)
+        sumdt += np.sum(cumjds[hi] - cumjds[lo] - cnt * j, axis=0)
+        sumdm2 += np.sum(cummags2[hi] - cummags2[lo] - 2.0 * m * (cummags[hi] - cummags[lo]) + cnt * m ** 2, axis=0)
+
+    out = {"edges": edges, "counts": counts}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out["dt"] = sumdt / counts
+        out["sf"] = np.sqrt(np.maximum(sumdm2, 0.0) / counts)
+
+    if quantiles is not None:
+        magedges = np.linspace(0.0, np.ptp(mags), magbins + 1)
+        hist = np.zeros(nbins * magbins, dtype=np.int64)
+        for a in range(0, n, chunksize):
+            b = min(a + chunksize, n)
+            bounds = np.searchsorted(jds, jds[a:b, np.newaxis] + edges)
+            bounds = np.maximum(bounds, np.searchsorted(jds, jds[a:b, np.newaxis], side='right'))
+            lo, cnt = bounds[:, :-1].ravel(), (bounds[:, 1:] - bounds[:, :-1]).ravel()
+            # all the pairs of the block, as ranges of partners per point and per bin :
+            segments = np.repeat(np.arange(len(cnt)), cnt)
+            partners = np.arange(np.sum(cnt)) - np.repeat(np.cumsum(cnt) - cnt, cnt) + lo[segments]
+            dm = np.abs(mags[partners] - mags[a + segments // nbins])
+            imag = np.minimum(np.searchsorted(magedges, dm, side='right') - 1, magbins - 1)
+            hist += np.bincount((segments % nbins) * magbins + imag, minlength=nbins * magbins)
+        cumhist = np.cumsum(hist.reshape((nbins, magbins)), axis=1)
+        out["quantiles"] = np.full((len(quantiles), nbins), np.nan)
+        for k in np.flatnonzero(counts):
+            # linear interpolation of the cumulative distribution, within the histogram bins :
+            cdf = np.concatenate([[0.0], cumhist[k] / float(cumhist[k][-1])])
+            out["quantiles"][:, k] = np.interp(quantiles, cdf, magedges)
+
+    if plot:
+        plt.figure()
+        plt.scatter(out["dt"], out["sf"])
+        plt.xlabel("Delta t")
+        plt.ylabel("SF")
+        if filename:
+            plt.savefig(filename)
+        else:
+            plt.show()
+
+    return out
+
+
+def _sfbinned_aux(args):
+    """
+    Auxiliary function for multiprocessing, see :py:func:`sfbinned_multi`.
+    """
+    (l, kwargs) = args
+    return sfbinned(l, **kwargs)
+
+
+def sfbinned_multi(lcs, ncpu=None, **kwargs):
+    """
+    Binned structure functions of many lightcurves, computed in parallel with :py:func:`sfbinned`.
+
+    :param lcs: list of LightCurve
+    :param ncpu: number of processes to use. 1 runs serially, None uses all the available CPUs, -1 all but one.
+    :param kwargs: dictionnary of kwargs to be transmitted to sfbinned (plot is not allowed)
+
+    :return: list of the dictionaries returned by sfbinned, in the order of lcs
+    """
+    if kwargs.get("plot", False):
+        raise RuntimeError("I cannot plot from parallel processes, call sfbinned on each curve instead.")
+
+    ncpuava = multiprocess.cpu_count()
+    if ncpu is None:
+        ncpu = ncpuava
+    elif ncpu == -1:
+        ncpu = max(ncpuava - 1, 1)
+
+    job_args = [(l, kwargs) for l in lcs]
+    if ncpu <= 1:
+        return [_sfbinned_aux(job_arg) for job_arg in job_args]
+
+    pool = multiprocess.Pool(ncpu)
+    results = pool.map(_sfbinned_aux, job_args)  # order is conserved with map
+    pool.close()
+    pool.join()
+    return results
+
+
+def weightedmedian(values, weights, groups=None):
+    """
+    Weighted median, i.e. the x minimising sum(weights * abs(values - x)). If the cumulative weight reaches exactly
+    half of the total weight at some value, all the points between this one and the next are solutions, I return the
+    middle of this interval (as the median does).
+
+    :param values: 1-D array
+    :param weights: 1-D array of positive weights, same length as values
+    :param groups: 1-D array of integers from 0 to ngroups - 1, same length as values. If given, I compute the
+        weighted median of each group separately, all at once.
+
+    :return: float, or array of length ngroups if groups is given
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    if groups is None:
+        return weightedmedian(values, weights, np.zeros(len(values), dtype=int))[0]
+
+    groups = np.asarray(groups)
+    order = np.lexsort((values, groups))  # sorted by group, then by value
+    values, weights, groups = values[order], weights[order], groups[order]
+    ngroups = np.max(groups) + 1
+    totals = np.bincount(groups, weights=weights, minlength=ngroups)
+    cumweights = np.cumsum(weights)
+    targets = np.concatenate([[0.0], np.cumsum(totals)[:-1]]) + 0.5 * totals
+    ind = np.minimum(np.searchsorted(cumweights, targets * (1.0 - 1e-12)), len(values) - 1)
+    ends = np.cumsum(np.bincount(groups, minlength=ngroups)) - 1  # last point of each group
+    tie = np.logical_and(np.isclose(cumweights[ind], targets, rtol=1e-12, atol=0.0), ind < ends)
+    return np.where(tie, 0.5 * (values[ind] + values[np.minimum(ind + 1, len(values) - 1)]), values[ind])
+
+
 def mad(data, axis=None):
     """
     Median absolute deviation
@@ -232,7 +394,7 @@ def subtract(lcs, model):
         if l.hasmask():
             print("WARNING : I do not take into account the mask !")
 
-        lp = l.copy()  # To avoid border effects
+        lp = l.copy()  # To avoid border effects, and we return it
 
         lp.applyfluxshift()
         lp.applymagshift()
@@ -20,6 +20,24 @@ import pycs3.spl.topopt
 
 logger = logging.getLogger(__name__)
 
+# The optimiser received once by each worker of the pool, see Optimiser.start_pool()
+_worker_optimiser = None
+
+
+def _init_worker(optimiser):  # pragma: no cover
+    global _worker_optimiser
+    _worker_optimiser = optimiser
+
+
+def _fct_para_worker(job):  # pragma: no cover
+    """
+    Job run by the workers of the pool : only theta, the A correction and a seed are sent.
+    """
+    (theta, A_correction, seed) = job
+    np.random.seed(seed)
+    _worker_optimiser.A_correction = A_correction
+    return _worker_optimiser.fct_para(theta, seed=seed)
+
 
 class Optimiser(object):
     """
@@ -31,7 +49,8 @@ class Optimiser(object):
     def __init__(self, lcs, fit_vector, spline, attachml_function, attachml_param, knotstep=None,
                  savedirectory="./", recompute_spline=True, max_core=None, theta_init=None,
                  n_curve_stat=32, shotnoise=None, tweakml_type='PS_from_residuals', display=False, verbose=False,
-                 tweakml_name='', correction_PS_residuals=True, tolerance=0.75, debug=False):
+                 tweakml_name='', correction_PS_residuals=True, tolerance=0.75, debug=False, mock_bank_seed=None,
+                 sequential=False, sequential_batch=4, sequential_zscore=3.0):
 
         """
 
@@ -54,6 +73,10 @@ class Optimiser(object):
         :param correction_PS_residuals: boolean, to add an additionnal correction for the scaling of the Power Spectrum,should be set to True
         :param tolerance: float, tolerance in unit of sigma. I stop the optimisation if I found a set of parameters matching the data within the tolerance limit.
         :param debug: boolean, debug mode, not using multithreading
+        :param mock_bank_seed: integer, if not None I use common random numbers : I draw once a bank of n_curve_stat seeds from it, and the i-th mock curve always gets the same noise phases and shotnoise, whatever the parameters and the A correction. The differences between two parameters then come from the parameters only and not from the Monte Carlo noise, so that fewer mock curves are needed.
+        :param sequential: boolean, if True compute_chi2() draws the mock curves by batches and stops before n_curve_stat mock curves as soon as the dichotomy step is statistically settled, see make_mocks_sequential()
+        :param sequential_batch: integer, number of mock curves per batch in sequential mode
+        :param sequential_zscore: float, number of standard errors on the mean zruns and sigma required to take a decision in sequential mode
         """
 
         if len(fit_vector) != len(lcs):  # pragma: no cover
@@ -118,13 +141,51 @@ class Optimiser(object):
         self.tolerance = tolerance  # tolerance in unit of sigma for the fit
         self.timeshifts = [l.timeshift for l in self.lcs]
         self.magshifts = [l.magshift for l in self.lcs]
+        if mock_bank_seed is not None:
+            self.mock_seeds = np.random.RandomState(mock_bank_seed).randint(0, 2 ** 31 - 1, size=n_curve_stat)
+        else:
+            self.mock_seeds = None
+        self.tweak_context = twk.TweakContext()  # periodograms of the data, shared by all the mocks
+        self.pool = None
+        self.sequential = sequential
+        self.sequential_batch = sequential_batch
+        self.sequential_zscore = sequential_zscore
+        self.time_mocks = 0.0  # total time spent computing the mocks
+        self.ncall_mocks = 0
+        self.nmocks_total = 0
+        self.nmocks_last = None  # number of mock curves used in the last call to compute_chi2
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["pool"] = None  # a pool cannot be pickled, and the workers don't need it
+        return state
 
-    def make_mocks_para(self, theta): # pragma: no cover #parralel computing, cannot be covered
+    def start_pool(self):  # pragma: no cover
+        """
+        Start the pool of workers used by make_mocks_para(), if not already running. The curves, the spline and the rest
+        of the optimiser are sent only once to each worker, the jobs then only contain the parameters and a seed.
+        The pool lives until :py:meth:`close_pool` is called (optimise() does it when it is done).
+        """
+        if self.pool is None:
+            self.pool = multiprocess.Pool(processes=self.max_core, initializer=_init_worker, initargs=(self,))
+
+    def close_pool(self):
+        """
+        Shut down the pool of workers, if any.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def make_mocks_para(self, theta, n_curve=None, first=0): # pragma: no cover #parralel computing, cannot be covered
         """
         Draw mock curves, optimise them, and compute the zrun and sigma statistics.  This is used in debug mode.
         It does the same than make_mocks but using multithreading.
 
         :param theta: list, containing the parameter of the generative noise model.
+        :param n_curve: integer, number of mock curves to draw, n_curve_stat by default
+        :param first: integer, index of the first mock curve in the mock bank, if any
         :return: tuple (mean_zruns, mean_sigmas, std_zruns, std_sigmas, zruns, sigmas)
         """
         stat = []
@@ -132,20 +193,24 @@ class Optimiser(object):
         sigmas = []
         nruns = []
 
-        pool = multiprocess.Pool(processes=self.max_core)
-
-        job_args = [theta for j in range(self.n_curve_stat)]
+        self.start_pool()
+        # Each job gets its own seed, the workers would otherwise draw the same mocks
+        if n_curve is None:
+            n_curve = self.n_curve_stat
+        if self.mock_seeds is not None:
+            seeds = self.mock_seeds[first:first + n_curve]
+        else:
+            seeds = np.random.randint(0, 2 ** 31 - 1, size=n_curve)
+        job_args = [(theta, self.A_correction, seed) for seed in seeds]
 
-        out = pool.map(self.fct_para, job_args)
-        pool.close()
-        pool.join()
+        out = self.pool.map(_fct_para_worker, job_args)
 
         stat_out = np.asarray([x['stat'] for x in out if x['stat'] is not None])  # clean failed optimisation
         message_out = np.asarray([x['error'] for x in out if x['error'] is not None])  # clean failed optimisation
         self.error_message.append(message_out)
-        zruns = np.asarray([[stat_out[i, j]['zruns'] for j in range(self.ncurve)] for i in range(len(stat_out))])
-        sigmas = np.asarray([[stat_out[i, j]['std'] for j in range(self.ncurve)] for i in range(len(stat_out))])
-        nruns = np.asarray([[stat_out[i, j]['nruns'] for j in range(self.ncurve)] for i in range(len(stat_out))])
+        zruns = np.asarray([[stat_out[i, j]['zruns'] for j in range(self.ncurve)] for i in range(len(stat_out))]).reshape(-1, self.ncurve)
+        sigmas = np.asarray([[stat_out[i, j]['std'] for j in range(self.ncurve)] for i in range(len(stat_out))]).reshape(-1, self.ncurve)
+        nruns = np.asarray([[stat_out[i, j]['nruns'] for j in range(self.ncurve)] for i in range(len(stat_out))]).reshape(-1, self.ncurve)
 
         mean_zruns = []
         std_zruns = []
@@ -178,10 +243,17 @@ class Optimiser(object):
         if self.n_curve_stat == 1:  # pragma: no cover
             raise RuntimeError(" I cannot compute statistics with one single curves !! Increase n_curve_stat.")
 
-        if self.para:
-            mean_zruns, mean_sigmas, std_zruns, std_sigmas, _, _ = self.make_mocks_para(theta)
+        start = time.time()
+        if self.sequential:
+            mean_zruns, mean_sigmas, std_zruns, std_sigmas, zruns, _ = self.make_mocks_sequential(theta)
+        elif self.para:
+            mean_zruns, mean_sigmas, std_zruns, std_sigmas, zruns, _ = self.make_mocks_para(theta)
         else:  # pragma: no cover #Used in debug mode
-            mean_zruns, mean_sigmas, std_zruns, std_sigmas, _, _ = self.make_mocks(theta)
+            mean_zruns, mean_sigmas, std_zruns, std_sigmas, zruns, _ = self.make_mocks(theta)
+        self.time_mocks += time.time() - start
+        self.ncall_mocks += 1
+        self.nmocks_last = len(zruns)
+        self.nmocks_total += len(zruns)
 
         for i in range(self.ncurve):
             chi2 += (self.fit_vector[i][0] - mean_zruns[i]) ** 2 / std_zruns[i] ** 2
@@ -191,16 +263,17 @@ class Optimiser(object):
         chi2 = chi2 / count
         return chi2, np.asarray(mean_zruns), np.asarray(mean_sigmas), np.asarray(std_zruns), np.asarray(std_sigmas)
 
-    def fct_para(self, theta): # pragma: no cover
+    def fct_para(self, theta, seed=None): # pragma: no cover
         """
         Auxilliary function to optimise the mock curves in parallel. See make_mocks_para().
 
         :param theta: list, containing the parameter of the generative noise model.
+        :param seed: integer, seed of the noise phases, see get_tweakml_list()
 
         :return: dcitionnary containing the stats and eventual error message
         """
 
-        tweak_list = self.get_tweakml_list(theta)
+        tweak_list = self.get_tweakml_list(theta, seed=seed)
         mocklc = pycs3.sim.draw.draw(self.lcs, self.spline,
                                      tweakml=tweak_list, shotnoise=self.shotnoise, scaletweakresi=False,
                                      shotnoisefrac=self.shotnoisefrac, keeptweakedml=False, keepshifts=False,
@@ -230,22 +303,26 @@ class Optimiser(object):
             stat = pycs3.gen.stat.mapresistats(mockrls)
             return {'stat': stat, 'error': None}
 
-    def get_tweakml_list(self, theta):
+    def get_tweakml_list(self, theta, seed=None):
         """
         Define the tweakml function for the corresponding fit vector
 
         :param theta: list, containing the parameter of the generative noise model.
+        :param seed: integer, if not None the phases of the noise of each curve are drawn from this seed
         :return:
         """
         tweak_list = []
 
         if self.tweakml_type == 'PS_from_residuals':
-            def tweakml_PS(lcs, spline, B, A_correction):
+            def tweakml_PS(lcs, spline, B, A_correction, seed):
                 return twk.tweakml_PS(lcs, spline, B, f_min=1 / 300.0, psplot=False, save_figure_folder=None,
-                                      verbose=self.verbose, interpolation='linear', A_correction=A_correction)
+                                      verbose=self.verbose, interpolation='linear', A_correction=A_correction,
+                                      seed=seed, context=self.tweak_context)
 
             for i in range(self.ncurve):
-                tweak_list.append(partial(tweakml_PS, B=theta[i][0], A_correction=self.A_correction[i]))
+                curve_seed = None if seed is None else [seed, i]
+                tweak_list.append(partial(tweakml_PS, B=theta[i][0], A_correction=self.A_correction[i],
+                                          seed=curve_seed))
         else:  # pragma: no cover
             raise NotImplementedError('Other Tweakml_type than PS_from_residuals are not yet implemented.')
 
@@ -261,11 +338,13 @@ class Optimiser(object):
         args = args[0:-1]
         return self.fct_para(*args, **kwargs)
 
-    def make_mocks(self, theta):
+    def make_mocks(self, theta, n_curve=None, first=0):
         """
         Draw mock curves, optimise them, and compute the zrun and sigma statistics.  This is used in debug mode.
         It does the same than make_mocks_para but serially.
         :param theta: list, containing the parameter of the generative noise model.
+        :param n_curve: integer, number of mock curves to draw, n_curve_stat by default
+        :param first: integer, index of the first mock curve in the mock bank, if any
 
         :return: tuple (mean_zruns, mean_sigmas, std_zruns, std_sigmas, zruns, sigmas)
         """
@@ -279,8 +358,14 @@ class Optimiser(object):
         lcscopies = [l.copy() for l in self.lcs]
         spline_copy = self.spline.copy()
 
-        for i in range(self.n_curve_stat):
-            tweak_list = self.get_tweakml_list(theta)
+        if n_curve is None:
+            n_curve = self.n_curve_stat
+        for i in range(n_curve):
+            if self.mock_seeds is not None:
+                np.random.seed(self.mock_seeds[first + i])  # for the shotnoise
+                tweak_list = self.get_tweakml_list(theta, seed=self.mock_seeds[first + i])
+            else:
+                tweak_list = self.get_tweakml_list(theta)
             mocklc.append(pycs3.sim.draw.draw(lcscopies, spline_copy,
                                               tweakml=tweak_list, shotnoise=self.shotnoise,
                                               shotnoisefrac=self.shotnoisefrac,
@@ -331,6 +416,58 @@ class Optimiser(object):
 
         return mean_zruns, mean_sigmas, std_zruns, std_sigmas, zruns, sigmas
 
+    def make_mocks_sequential(self, theta):
+        """
+        Draw the mock curves by batches of sequential_batch, and stop as soon as the dichotomy step is statistically
+        settled : the side of the target zruns is known for every curve (the mean zruns is more than sequential_zscore
+        standard errors away from it), and at least one curve is clearly out of the tolerance, so that these parameters
+        cannot be accepted. Otherwise, I draw the n_curve_stat mock curves.
+
+        :param theta: list, containing the parameter of the generative noise model.
+        :return: tuple (mean_zruns, mean_sigmas, std_zruns, std_sigmas, zruns, sigmas)
+        """
+        zruns = np.zeros((0, self.ncurve))
+        sigmas = np.zeros((0, self.ncurve))
+        ndrawn = 0
+        while ndrawn < self.n_curve_stat:
+            n_curve = min(self.sequential_batch, self.n_curve_stat - ndrawn)
+            if self.para:
+                out = self.make_mocks_para(theta, n_curve=n_curve, first=ndrawn)
+            else:  # pragma: no cover #Used in debug mode
+                out = self.make_mocks(theta, n_curve=n_curve, first=ndrawn)
+            zruns = np.concatenate([zruns, out[4]])
+            sigmas = np.concatenate([sigmas, out[5]])
+            ndrawn += n_curve
+            if len(zruns) > 1 and self.is_settled(zruns, sigmas):
+                logger.info("Sequential mode : I stop after %i mock curves." % len(zruns))
+                break
+
+        mean_zruns = np.mean(zruns, axis=0)
+        mean_sigmas = np.mean(sigmas, axis=0)
+        std_zruns = np.std(zruns, axis=0)
+        std_sigmas = np.std(sigmas, axis=0)
+        return mean_zruns, mean_sigmas, std_zruns, std_sigmas, zruns, sigmas
+
+    def is_settled(self, zruns, sigmas):
+        """
+        Tell if the mock curves drawn so far are enough to take the decision of the dichotomy step, see
+        make_mocks_sequential().
+
+        :param zruns: array of shape (number of mock curves, ncurve)
+        :param sigmas: array of shape (number of mock curves, ncurve)
+        :return: boolean
+        """
+        n = len(zruns)
+        dist_zruns = np.abs(np.mean(zruns, axis=0) - self.fit_vector[:, 0])
+        dist_sigmas = np.abs(np.mean(sigmas, axis=0) - self.fit_vector[:, 1])
+        err_zruns = self.sequential_zscore * np.std(zruns, axis=0) / np.sqrt(n)
+        err_sigmas = self.sequential_zscore * np.std(sigmas, axis=0) / np.sqrt(n)
+
+        side_known = dist_zruns > err_zruns
+        out_of_tolerance = np.logical_or(dist_zruns - err_zruns > self.tolerance * np.std(zruns, axis=0),
+                                         dist_sigmas - err_sigmas > self.tolerance * np.std(sigmas, axis=0))
+        return bool(np.all(side_known) and np.any(out_of_tolerance))
+
     def check_success(self):
         """
         Check if the optimiser found a set of parameter within the tolerance.
@@ -381,7 +518,14 @@ class Optimiser(object):
             f.write("For minimum Chi2, we are standing at " + str(self.rel_error_sigmas_mini[i]) + " sigma [sigma] \n")
             f.write('------------------------------------------------\n')
             f.write('\n')
-        f.write('Optimisation done in %4.4f seconds on %i cores' % ((self.time_stop - self.time_start), self.max_core))
+        f.write('Optimisation done in %4.4f seconds on %i cores \n' % ((self.time_stop - self.time_start), self.max_core))
+        if self.ncall_mocks > 0:
+            f.write('%i sets of mock curves (%i mock curves in total) computed in %4.4f seconds (%4.4f seconds per set), %s \n' % (
+                self.ncall_mocks, self.nmocks_total, self.time_mocks, self.time_mocks / self.ncall_mocks,
+                'with a persistent pool of workers' if self.para else 'serially'))
+        if self.sequential:
+            f.write('Sequential mode, number of mock curves used at each iteration (out of %i) : %s \n' % (
+                self.n_curve_stat, str(self.chain_list[6])))
         f.close()
 
         # Write the error report :
@@ -409,10 +553,14 @@ class Optimiser(object):
         """
         self.A_correction = [1.0 for i in range(self.ncurve)]  # reset the A correction
 
+        start = time.time()
         if self.para:
-            mean_zruns, mean_sigmas, std_zruns, std_sigmas, _, _ = self.make_mocks_para(eval_pts)
+            mean_zruns, mean_sigmas, std_zruns, std_sigmas, zruns, _ = self.make_mocks_para(eval_pts)
         else:  # pragma: no cover #Used in debug mode
-            mean_zruns, mean_sigmas, std_zruns, std_sigmas, _, _ = self.make_mocks(eval_pts)
+            mean_zruns, mean_sigmas, std_zruns, std_sigmas, zruns, _ = self.make_mocks(eval_pts)
+        self.time_mocks += time.time() - start
+        self.ncall_mocks += 1
+        self.nmocks_total += len(zruns)
 
         self.A_correction = self.fit_vector[:, 1] / mean_sigmas  # set the A correction
         return self.A_correction, mean_zruns, mean_sigmas, std_zruns, std_sigmas
@@ -428,14 +576,16 @@ class DicOptimiser(Optimiser):
                  savedirectory="./", recompute_spline=True, max_core=None, theta_init=None,
                  n_curve_stat=32, shotnoise=None, tweakml_type='PS_from_residuals', tweakml_name='',
                  display=False, verbose=False, step=0.1, correction_PS_residuals=True, max_iter=10, tolerance=0.75
-                 , debug=False):
+                 , debug=False, mock_bank_seed=None, sequential=False, sequential_batch=4, sequential_zscore=3.0):
 
         Optimiser.__init__(self, lcs, fit_vector, spline, attachml_function, attachml_param,
                            knotstep=knotstep, savedirectory=savedirectory, recompute_spline=recompute_spline,
                            max_core=max_core, n_curve_stat=n_curve_stat, shotnoise=shotnoise, theta_init=theta_init,
                            tweakml_type=tweakml_type, tweakml_name=tweakml_name,
                            correction_PS_residuals=correction_PS_residuals,
-                           verbose=verbose, display=display, tolerance=tolerance, debug=debug)
+                           verbose=verbose, display=display, tolerance=tolerance, debug=debug,
+                           mock_bank_seed=mock_bank_seed, sequential=sequential,
+                           sequential_batch=sequential_batch, sequential_zscore=sequential_zscore)
 
         self.chain_list = None
         self.step = [step for i in range(self.ncurve)]
@@ -446,16 +596,23 @@ class DicOptimiser(Optimiser):
 
     def optimise(self):
         """
-        High-level function. Run the optimisation.
+        High-level function. Run the optimisation. The pool of workers is shut down at the end, even if the optimisation
+        fails.
 
         """
+        try:
+            return self._optimise()
+        finally:
+            self.close_pool()
 
+    def _optimise(self):
         self.time_start = time.time()
         sigma = []
         zruns = []
         sigma_std = []
         zruns_std = []
         chi2 = []
+        nmocks = []
         zruns_target = self.fit_vector[:, 0]
         sigma_target = self.fit_vector[:, 1]
         B = copy.deepcopy(self.theta_init)
@@ -474,6 +631,7 @@ class DicOptimiser(Optimiser):
             zruns.append(zruns_c)
             sigma_std.append(sigma_std_c)
             zruns_std.append(zruns_std_c)
+            nmocks.append(self.nmocks_last)
             self.explored_param.append(copy.deepcopy(B))
 
             self.rel_error_zruns_mini = np.abs(
@@ -520,7 +678,7 @@ class DicOptimiser(Optimiser):
                 logger.info(f"I will slightly correct the amplitude of the Power Spectrum by a factor : {np.array2string(np.asarray(self.A_correction))}")
 
         self.chain_list = [self.explored_param, chi2, zruns, sigma, zruns_std,
-                           sigma_std]  # explored param has dimension(n_iter,ncurve,1)
+                           sigma_std, nmocks]  # explored param has dimension(n_iter,ncurve,1)
         self.chi2_mini, self.best_param = chi2[-1], self.explored_param[
             -1]  # take the last iteration as the best estimate
         self.mean_zruns_mini = zruns[-1]
@@ -2,4 +2,4 @@
 Regression difference curve shifting technique, using gaussian process regression.
 """
 
-__all__ = ["rslc", "multiopt", "scikitgp"]
+__all__ = ["rslc", "multiopt", "scikitgp", "kalmangp"]
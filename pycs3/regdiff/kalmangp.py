@@ -0,0 +1,248 @@
+"""
+Linear-time Gaussian process regression for Matern kernels, an alternative backend to :py:mod:`pycs3.regdiff.scikitgp`.
+
+The Matern covariances with nu = 1.5 and nu = 2.5 are exactly the covariances of linear stochastic differential
+equations. I fit the same model as scikitgp (a constant, plus amp * Matern, plus a white noise, on the normalised
+magnitudes), but I compute its marginal likelihood with a Kalman filter and the predictions with a Rauch-Tung-Striebel
+smoother. This costs O(n + m) for n data points and m predictions, instead of O(n^3 + n m).
+"""
+import logging
+
+import numpy as np
+import scipy.optimize as spopt
+
+logger = logging.getLogger(__name__)
+
+# Same bounds as the default ones of the scikit-learn kernels
+LOGBOUNDS = (np.log(1e-5), np.log(1e5))
+
+
+def statespace(pow, scale, amp, const):
+    """
+    State space form of the kernel const + amp * Matern(scale, nu=pow). The state is (offset, f, f', [f'']).
+    The transition matrix over a time dt is exp(-lambda dt) * (I + dt N + dt^2 N^2 / 2), as F + lambda I = N is nilpotent
+    (the offset is constant, its block of the transition is 1).
+
+    :return: tuple (lam, N, Pinf) : decay rate, nilpotent part of the feedback matrix, stationary covariance.
+    """
+    if pow == 1.5:
+        lam = np.sqrt(3.0) / scale
+        F = np.array([[0.0, 1.0], [-lam ** 2, -2.0 * lam]])
+        Pinf = amp * np.diag([1.0, lam ** 2])
+    elif pow == 2.5:
+        lam = np.sqrt(5.0) / scale
+        kappa = lam ** 2 / 3.0
+        F = np.array([[0.0, 1.0, 0.0], [0.0, 0.0, 1.0], [-lam ** 3, -3.0 * lam ** 2, -3.0 * lam]])
+        Pinf = amp * np.array([[1.0, 0.0, -kappa], [0.0, kappa, 0.0], [-kappa, 0.0, lam ** 4]])
+    else:  # pragma: no cover
+        raise RuntimeError("The Kalman backend only works with Matern kernels of pow 1.5 or 2.5, not %s." % pow)
+
+    d = F.shape[0] + 1
+    N = np.zeros((d, d))
+    N[1:, 1:] = F + lam * np.eye(d - 1)
+    P0 = np.zeros((d, d))
+    P0[0, 0] = const
+    P0[1:, 1:] = Pinf
+    return lam, N, P0
+
+
+def transitions(dts, lam, N, P0):
+    """
+    Vectorised transition matrices A and process noise covariances Q for an array of time steps dts.
+    The parameters lam, N, P0 can also be stacked along a first axis, see :py:func:`kalmanfilter`.
+
+    :return: tuple of arrays (A, Q), each of shape (len(dts), d, d), or (len(lam), len(dts), d, d) if stacked
+    """
+    dts = np.asarray(dts, dtype=float)[:, np.newaxis, np.newaxis]
+    lam = np.asarray(lam, dtype=float)[..., np.newaxis, np.newaxis, np.newaxis]
+    N = N[..., np.newaxis, :, :]
+    P0 = P0[..., np.newaxis, :, :]
+    A = np.eye(N.shape[-1]) + dts * N + 0.5 * dts ** 2 * (N @ N)
+    A[..., 1:, :] *= np.exp(-lam * dts)
+    Q = P0 - A @ P0 @ np.swapaxes(A, -1, -2)
+    return A, Q
+
+
+def kalmanfilter(x, y, r, lam, N, P0, store=False):
+    """
+    Kalman filter over sorted data points x, with observations y of the offset plus f, with noise variances r.
+    The parameters lam, N, P0 and r can also be stacked along a first axis, to run the filter for several sets of
+    hyperparameters at once (as for the finite difference gradient), for the same price.
+
+    :return: the log marginal likelihood (an array if the parameters are stacked), and if store is True also the arrays of
+        the predicted and filtered means and covariances (mp, Pp, mf, Pf), and the transitions A.
+    """
+    batch = np.ndim(lam) > 0
+    (lam, N, P0, r) = (np.atleast_1d(lam), np.reshape(N, (-1,) + N.shape[-2:]), np.reshape(P0, (-1,) + P0.shape[-2:]),
+                       np.atleast_2d(r))
+    n = len(x)
+    A, Q = transitions(np.diff(x, prepend=x[0]), lam, N, P0)
+    (b, d) = N.shape[:2]
+    m = np.zeros((b, d, 1))
+    P = P0.copy()
+    AT = np.swapaxes(A, 2, 3)
+    logs = np.zeros((n, b))
+    resis = np.zeros((n, b))
+    if store:
+        mp = np.empty((n, d))
+        Pp = np.empty((n, d, d))
+        mf = np.empty((n, d))
+        Pf = np.empty((n, d, d))
+
+    for k in range(n):
+        if k > 0:
+            m = A[:, k] @ m
+            P = A[:, k] @ P @ AT[:, k] + Q[:, k]
+        if store:
+            mp[k] = m[0, :, 0]
+            Pp[k] = P[0]
+        ph = P[:, :, 0:1] + P[:, :, 1:2]  # P H^T, with H = (1, 1, 0, ...)
+        s = ph[:, 0, 0] + ph[:, 1, 0] + r[:, k]
+        v = y[k] - m[:, 0, 0] - m[:, 1, 0]
+        gain = ph / s[:, np.newaxis, np.newaxis]
+        m = m + gain * v[:, np.newaxis, np.newaxis]
+        P = P - gain @ np.swapaxes(ph, 1, 2)
+        logs[k] = s
+        resis[k] = v * v / s
+        if store:
+            mf[k] = m[0, :, 0]
+            Pf[k] = P[0]
+
+    loglik = -0.5 * (n * np.log(2.0 * np.pi) + np.sum(np.log(logs), axis=0) + np.sum(resis, axis=0))
+    if not batch:
+        loglik = loglik[0]
+    if store:
+        return loglik, (mp, Pp, mf, Pf, A[0])
+    return loglik
+
+
+def rtssmoother(mp, Pp, mf, Pf, A):
+    """
+    Rauch-Tung-Striebel smoother, from the output of :py:func:`kalmanfilter`.
+
+    :return: tuple (ms, Ps) of smoothed means and covariances at the data points
+    """
+    ms = mf.copy()
+    Ps = Pf.copy()
+    for k in range(len(mf) - 2, -1, -1):
+        gain = np.linalg.solve(Pp[k + 1], A[k + 1] @ Pf[k]).T
+        ms[k] = mf[k] + gain @ (ms[k + 1] - mp[k + 1])
+        Ps[k] = Pf[k] + gain @ (Ps[k + 1] - Pp[k + 1]) @ gain.T
+    return ms, Ps
+
+
+def predict(t, x, filtered, ms, Ps, lam, N, P0):
+    """
+    Posterior mean and variance of offset + f at the times t, from the filtered and smoothed states at the data points x.
+    Between two data points, the state at t only depends on the smoothed state of the next data point and on the filtered
+    state of the previous one, so that I can compute all the predictions at once.
+    """
+    (mp, Pp, mf, Pf, A) = filtered
+    n = len(x)
+    prev = np.searchsorted(x, t, side="right") - 1
+    after = prev == n - 1  # after the last data point, a simple prediction
+    before = prev == -1  # before the first data point, we start from the prior
+    iprev = np.clip(prev, 0, n - 1)
+    inext = np.clip(prev + 1, 0, n - 1)
+
+    A1, Q1 = transitions(np.where(before, 0.0, t - x[iprev]), lam, N, P0)
+    mt = np.einsum("kij,kj->ki", A1, np.where(after[:, np.newaxis], ms[iprev], mf[iprev]))
+    mt[before] = 0.0
+    Pt = A1 @ np.where(after[:, np.newaxis, np.newaxis], Ps[iprev], Pf[iprev]) @ np.swapaxes(A1, 1, 2) + Q1
+    Pt[before] = P0
+
+    # Smoothing step from the next data point, for the others :
+    A2, _ = transitions(np.where(after, 0.0, x[inext] - t), lam, N, P0)
+    gain = np.swapaxes(np.linalg.solve(Pp[inext], A2 @ Pt), 1, 2)
+    smoothed = np.logical_not(after)
+    mt[smoothed] += np.einsum("kij,kj->ki", gain, ms[inext] - mp[inext])[smoothed]
+    Pt[smoothed] += (gain @ (Ps[inext] - Pp[inext]) @ np.swapaxes(gain, 1, 2))[smoothed]
+
+    return mt[:, 0] + mt[:, 1], Pt[:, 0, 0] + 2.0 * Pt[:, 0, 1] + Pt[:, 1, 1]
+
+
+def regression(x, y, yerr, covkernel='matern', pow=1.5, amp=1.0, scale=200.0, errscale=1.0, verbose=False):
+    """
+    Give me data points and error. ``yerr`` is the 1sigma error of each ``y``
+    I return a function : you pass an array of new x, the func returns (newy, newyerr).
+    Same model and same interface as :py:func:`pycs3.regdiff.scikitgp.regression`, but only for Matern kernels.
+
+    :param x: array containing the time data
+    :param y: array containing the magnitude data
+    :param yerr: array containing the magnitude errors
+    :param covkernel: only "matern" is available
+    :type covkernel: str
+    :param pow: exponent coefficient of the covariance function, 1.5 or 2.5
+    :type pow: float
+    :param amp: amplitude coefficient of the covariance function (initial value)
+    :type amp: float
+    :param scale: characteristic time scale (initial value)
+    :type scale: float
+    :param errscale: additional scaling of the photometric errors
+    :type errscale: float
+    :param verbose: verbosity
+    :type verbose: bool
+
+    :return: A python function to make the prediction
+
+    """
+    if covkernel != "matern" or pow not in [1.5, 2.5]:  # pragma: no cover
+        raise RuntimeError("The Kalman backend only works with Matern kernels of pow 1.5 or 2.5, not %s %s."
+                           % (covkernel, pow))
+
+    order = np.argsort(x, kind="stable")
+    x = np.asarray(x, dtype=float)[order]
+    y = np.asarray(y, dtype=float)[order]
+    obs_v = np.asarray(yerr, dtype=float)[order] ** 2 * errscale  # same noise as in scikitgp
+
+    # Normalisation of the magnitudes, as GaussianProcessRegressor(normalize_y=True) :
+    ymean = np.mean(y)
+    ystd = np.std(y)
+    if ystd == 0.0:  # pragma: no cover
+        ystd = 1.0
+    ny = (y - ymean) / ystd
+
+    def loglik(thetas, store=False):
+        # thetas has shape (number of sets of hyperparameters, 4)
+        params = np.exp(thetas)
+        statespaces = [statespace(pow, l, a, const) for (const, a, l, white) in params]
+        lam = np.array([ss[0] for ss in statespaces])
+        N = np.array([ss[1] for ss in statespaces])
+        P0 = np.array([ss[2] for ss in statespaces])
+        return kalmanfilter(x, ny, obs_v + params[:, 3:4], lam, N, P0, store=store)
+
+    eps = 1e-6
+
+    def errorfct(theta):
+        # Minus the log likelihood and its gradient, by finite differences computed in the same filter pass.
+        thetas = theta + np.vstack([np.zeros(4), eps * np.eye(4)])
+        with np.errstate(all="ignore"):
+            out = -loglik(thetas)
+        if not np.all(np.isfinite(out)):  # pragma: no cover
+            return np.inf, np.zeros(4)
+        return out[0], (out[1:] - out[0]) / eps
+
+    if verbose:
+        logger.info("Computing Kalman GPR with params covkernel=%s, pow=%.1f, errscale=%.1f" % (covkernel, pow, errscale))
+
+    # Initial values and bounds like the scikitgp kernel : ConstantKernel() + amp*Matern(scale) + WhiteKernel()
+    initheta = np.log([1.0, amp, scale, 1.0])
+    res = spopt.minimize(errorfct, initheta, jac=True, method="L-BFGS-B", bounds=[LOGBOUNDS] * 4)
+    theta = res.x
+    (const, a, l, white) = np.exp(theta)
+    if verbose:
+        logger.info("Kernel after optimisation : %.3g + %.3g * Matern(length_scale=%.3g, nu=%.1f) + White(%.3g)"
+                    % (const, a, l, pow, white))
+
+    lam, N, P0 = statespace(pow, l, a, const)
+    _, filtered = kalmanfilter(x, ny, obs_v + white, lam, N, P0, store=True)
+    ms, Ps = rtssmoother(*filtered)
+
+    def outfct(jds):
+        mean, var = predict(np.asarray(jds, dtype=float), x, filtered, ms, Ps, lam, N, P0)
+        newy = mean * ystd + ymean
+        newyerr = np.sqrt(np.maximum(var + white, 0.0)) * ystd
+        return newy, newyerr
+
+    outfct.theta = theta
+    return outfct
@@ -11,7 +11,8 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-def opt_ts(lcs, method="weights", pd=2., covkernel="matern", pow=1.5, amp=1.0, scale=200.0, errscale=1.0, verbose=True):
+def opt_ts(lcs, method="weights", pd=2., covkernel="matern", pow=1.5, amp=1.0, scale=200.0, errscale=1.0, verbose=True,
+           cache=True, backend="sklearn"):
     """
     Give me lightcurves (with more or less good initial time shifts)
     I run a regression on them, optimize regdiff, and set their delays to the optimal values.
@@ -30,6 +31,11 @@ def opt_ts(lcs, method="weights", pd=2., covkernel="matern", pow=1.5, amp=1.0, s
     :type scale: amp
     :param errscale: additional scaling of the photometric error
     :type errscale: float
+    :param cache: True to reuse the regressions of identical curves (as in the "copies" simulations), False to always
+        run them, or a :py:class:`pycs3.regdiff.rslc.RegressionCache` (e.g. with a cachedir shared by several processes)
+    :type cache: bool or RegressionCache
+    :param backend: regression backend, "sklearn" or "kalman" (linear-time, for Matern kernels with pow 1.5 or 2.5 only)
+    :type backend: str
 
     The parameters pow, amp, scale, errscale are passed to the GPR, see its doc (or explore their effect on the GPR before runnign this...)
     """
@@ -38,8 +44,8 @@ def opt_ts(lcs, method="weights", pd=2., covkernel="matern", pow=1.5, amp=1.0, s
         logger.info("Starting regdiff opt_ts, initial time delays :")
         logger.info("%s" % (pycs3.gen.lc_func.getnicetimedelays(lcs, separator=" | ")))
 
-    rss = [pycs3.regdiff.rslc.factory(l, pd=pd, covkernel=covkernel, pow=pow, amp=amp, scale=scale, errscale=errscale)
-           for l in lcs]
+    rss = [pycs3.regdiff.rslc.factory(l, pd=pd, covkernel=covkernel, pow=pow, amp=amp, scale=scale, errscale=errscale,
+                                      cache=cache, backend=backend) for l in lcs]
     # The time shifts are transfered to these rss, any microlensing is disregarded
 
     if verbose:
@@ -3,9 +3,13 @@ Defines a class that represents a regularly sampled lightcurve
 
 """
 import copy as pythoncopy
+import hashlib
 import logging
+import os
+from collections import OrderedDict
 
 import numpy as np
+import pycs3.regdiff.kalmangp as kalmangp
 import pycs3.regdiff.scikitgp as scikitgp
 import scipy.interpolate as si
 import scipy.optimize as spopt
@@ -121,7 +125,97 @@ class Rslc:
         return f(jds)
 
 
-def factory(l, pad=300., pd=2., plotcolour=None, covkernel="matern", pow=1.5, amp=1.0, scale=200.0, errscale=1.0):
+class RegressionCache:
+    """
+    Content-addressed cache of the regressions done by :py:func:`factory`.
+    The key is a hash of the data (jds, mags, magerrs) and of the regression parameters. It does not depend on the time
+    shifts : the copies of a "copies" simulation set, that only differ by their initial shifts, are regressed once.
+
+    I keep the last maxsize regressions in memory. If cachedir is given, I also save every regression there as a npz
+    file, written atomically, so that several processes (e.g. the workers of :py:func:`pycs3.sim.run.multirun`) can
+    share the same cachedir.
+    """
+
+    def __init__(self, maxsize=64, cachedir=None):
+        """
+        :param maxsize: maximum number of regressions kept in memory
+        :type maxsize: int
+        :param cachedir: path to a directory to also store the regressions on disk. None to keep them only in memory.
+        :type cachedir: str
+        """
+        self.maxsize = maxsize
+        self.cachedir = cachedir
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return "RegressionCache(%i entries, %i hits, %i misses)" % (len(self.entries), self.hits, self.misses)
+
+    @staticmethod
+    def key(jds, mags, magerrs, **params):
+        """
+        Returns the hexadecimal hash of the data and of the regression parameters.
+        """
+        h = hashlib.sha1()
+        for array in [jds, mags, magerrs]:
+            h.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+        h.update(repr(sorted(params.items())).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached (rsjds, rsmags, rsmagerrs) of key, or None if I do not know this regression.
+        Do not modify the returned arrays.
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.cachedir is not None:
+            filepath = os.path.join(self.cachedir, "%s.npz" % key)
+            if os.path.exists(filepath):
+                with np.load(filepath) as data:
+                    value = (data["jds"], data["mags"], data["magerrs"])
+                self.hits += 1
+                self.put(key, value, todisk=False)
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value, todisk=True):
+        """
+        Stores the (rsjds, rsmags, rsmagerrs) of a regression.
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+        if todisk and self.cachedir is not None:
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir, exist_ok=True)
+            filepath = os.path.join(self.cachedir, "%s.npz" % key)
+            tmpfilepath = "%s.%i.tmp" % (filepath, os.getpid())
+            with open(tmpfilepath, "wb") as f:
+                np.savez(f, jds=value[0], mags=value[1], magerrs=value[2])
+            os.replace(tmpfilepath, filepath)  # atomic, other processes never see a partial file
+
+    def clear(self):
+        """
+        Empties the memory cache. I do not touch the files of the cachedir.
+        """
+        self.entries.clear()
+
+
+# The cache used by default by factory()
+regressioncache = RegressionCache()
+
+
+def factory(l, pad=300., pd=2., plotcolour=None, covkernel="matern", pow=1.5, amp=1.0, scale=200.0, errscale=1.0,
+            cache=True, backend="sklearn"):
     """
     Give me a lightcurve, I return a regularly sampled light curve, by performing some regression.
     Amp and scale parameters are now fitted, it is just the starting point,
@@ -144,6 +238,13 @@ def factory(l, pad=300., pd=2., plotcolour=None, covkernel="matern", pow=1.5, am
     :type scale: float
     :param errscale: additional scaling of the photometric errors
     :type errscale: float
+    :param cache: True to use the module cache pycs3.regdiff.rslc.regressioncache, False to always run the regression,
+        or a :py:class:`RegressionCache` instance.
+    :type cache: bool or RegressionCache
+    :param backend: "sklearn" for the dense GP regression of :py:mod:`pycs3.regdiff.scikitgp`, or "kalman" for the
+        linear-time state space regression of :py:mod:`pycs3.regdiff.kalmangp` (Matern kernels with pow=1.5 or 2.5 only),
+        much faster for curves with thousands of points.
+    :type backend: str
 
     :return: Rslc object
 
@@ -163,6 +264,18 @@ def factory(l, pad=300., pd=2., plotcolour=None, covkernel="matern", pow=1.5, am
     mags = l.getmags(noml=True)
     magerrs = l.getmagerrs()
 
+    if cache is True:
+        cache = regressioncache
+    if cache:
+        key = RegressionCache.key(jds, mags, magerrs, pad=float(pad), pd=float(pd), covkernel=covkernel,
+                                  pow=float(pow), amp=float(amp), scale=float(scale), errscale=float(errscale),
+                                  backend=backend)
+        cached = cache.get(key)
+        if cached is not None:
+            (rsjds, rsmags, rsmagerrs) = cached
+            return Rslc(rsjds.copy(), rsmags.copy(), rsmagerrs.copy(), pad, pd, timeshift=timeshift, name=name,
+                        plotcolour=plotcolour)
+
     minjd = np.round(jds[0] - pad)
     maxjd = np.round(jds[-1] + pad)
 
@@ -171,8 +284,14 @@ def factory(l, pad=300., pd=2., plotcolour=None, covkernel="matern", pow=1.5, am
     rsjds = np.linspace(minjd, maxjd, npts)  # rs for regularly sampled
 
     # The regression itself
-    regfct = scikitgp.regression(jds, mags, magerrs, covkernel=covkernel, pow=pow, amp=amp, scale=scale,
-                               errscale=errscale)
+    if backend == "sklearn":
+        regfct = scikitgp.regression(jds, mags, magerrs, covkernel=covkernel, pow=pow, amp=amp, scale=scale,
+                                     errscale=errscale)
+    elif backend == "kalman":
+        regfct = kalmangp.regression(jds, mags, magerrs, covkernel=covkernel, pow=pow, amp=amp, scale=scale,
+                                     errscale=errscale)
+    else:  # pragma: no cover
+        raise RuntimeError("I do not know the regression backend %s, choose sklearn or kalman." % backend)
 
     """
     Alternative implementation using pymc3
@@ -181,6 +300,8 @@ def factory(l, pad=300., pd=2., plotcolour=None, covkernel="matern", pow=1.5, am
     """
 
     (rsmags, rsmagerrs) = regfct(rsjds)
+    if cache:
+        cache.put(key, (rsjds.copy(), rsmags.copy(), rsmagerrs.copy()))
 
     return Rslc(rsjds, rsmags, rsmagerrs, pad, pd, timeshift=timeshift, name=name, plotcolour=plotcolour)
 
@@ -237,6 +358,97 @@ def wtvdiff(rs1, rs2, method):
     return float(out)
 
 
+def wtvdiffs(rs1, rs2, timeshifts1, timeshifts2, method):
+    """
+    Vectorised version of wtvdiff, for whole arrays of time shifts of rs1 and rs2 at once (the timeshift attributes
+    of rs1 and rs2 are ignored). As the rslcs are regularly sampled, I locate the points of rs1 on the grid of rs2 by
+    an index offset plus linear weights, instead of building new Rslc objects.
+
+    :param rs1: Rslc Object
+    :param rs2: Rslc Object
+    :param timeshifts1: array of time shifts of rs1
+    :param timeshifts2: array of time shifts of rs2, same length as timeshifts1
+    :param method: string. Choose between "weights" and "simple"
+
+    :return: array of wtvs, one for each couple of time shifts
+    """
+    timeshifts1 = np.atleast_1d(np.asarray(timeshifts1, dtype=float))[:, np.newaxis]
+    timeshifts2 = np.atleast_1d(np.asarray(timeshifts2, dtype=float))[:, np.newaxis]
+    n2 = len(rs2.jds)
+    step = (rs2.jds[-1] - rs2.jds[0]) / (n2 - 1)
+    if not np.allclose(np.diff(rs2.jds), step, rtol=1e-6, atol=0.0):  # pragma: no cover
+        raise RuntimeError("%s is not regularly sampled !" % rs2)
+
+    # Same operations as in subtract(), so that the points np.interp would set to NaN are exactly the same
+    jds1 = rs1.jds + timeshifts1  # shape (number of shifts, len(rs1))
+    firstjd2 = rs2.jds[0] + timeshifts2
+    valid = np.logical_and(jds1 >= firstjd2, jds1 <= rs2.jds[-1] + timeshifts2)
+
+    pos = np.clip((jds1 - firstjd2) / step, 0.0, n2 - 1)  # position on the grid of rs2, in steps
+    index = np.minimum(pos.astype(int), n2 - 2)
+    frac = pos - index
+
+    diffmags = rs1.mags - (rs2.mags[index] * (1.0 - frac) + rs2.mags[index + 1] * frac)
+    dys = np.fabs(diffmags[:, 1:] - diffmags[:, :-1])
+    validpairs = np.logical_and(valid[:, 1:], valid[:, :-1])  # the valid points are contiguous
+
+    if method == "weights":
+        rs2magerrs = rs2.magerrs[index] * (1.0 - frac) + rs2.magerrs[index + 1] * frac
+        diffmagerrs = np.sqrt(rs1.magerrs * rs1.magerrs + rs2magerrs * rs2magerrs)
+        dyws = 1.0 / (0.5 * (diffmagerrs[:, 1:] + diffmagerrs[:, :-1]))
+        dyws[validpairs == False] = 0.0
+        return np.sum(dys * dyws, axis=1) / np.sum(dyws, axis=1)
+
+    elif method == "simple":
+        dys[validpairs == False] = 0.0
+        return np.sum(dys, axis=1)
+
+    else:
+        raise NotImplementedError("Method for the regression should be 'weights' or 'simple', not %s." % method)
+
+
+def wtvgrid(rslcs, shiftsgrid, method):
+    """
+    Evaluates the error function of :py:func:`opt_rslcs` (the sum of the wtvdiffs of all couples of curves) for many
+    sets of time shifts at once. Each couple of curves only needs the wtvdiffs of the distinct couples of shifts that
+    appear in the grid (7 or 49 instead of 343 for a brute force cube of a quad), and these are vectorised.
+
+    :param rslcs: a list of rslc objects. I do not modify them.
+    :param shiftsgrid: array of shape (number of sets, len(rslcs) - 1), time shifts of all curves but the first one.
+    :param method: string. Choose between "weights" and "simple"
+
+    :return: array of errorfct values, one for each set of time shifts
+    """
+    shiftsgrid = np.atleast_2d(shiftsgrid)
+    timeshifts = np.hstack([np.full((shiftsgrid.shape[0], 1), rslcs[0].timeshift), shiftsgrid])
+
+    out = np.zeros(shiftsgrid.shape[0])
+    for i1 in range(len(rslcs)):
+        for i2 in range(i1 + 1, len(rslcs)):
+            couples, inverse = np.unique(timeshifts[:, [i1, i2]], axis=0, return_inverse=True)
+            out += wtvdiffs(rslcs[i1], rslcs[i2], couples[:, 0], couples[:, 1], method)[inverse.ravel()]
+    return out
+
+
+def brute_rslcs(rslcs, ranges, method):
+    """
+    Brute force exploration of the time shifts, equivalent to scipy.optimize.brute(errorfct, ranges, finish=None)
+    with the errorfct of :py:func:`opt_rslcs`, on the same grid, but evaluated by :py:func:`wtvgrid`.
+
+    :param rslcs: a list of rslc objects
+    :param ranges: list of (low, up, step) tuples, one for each curve but the first one, see :py:func:`bruteranges`
+    :param method: string. Choose between "weights" and "simple"
+
+    :return: the optimal time shifts (a float if there is only one shift, like brute)
+    """
+    grid = np.mgrid[tuple([slice(*r) for r in ranges])]
+    shiftsgrid = np.reshape(grid, (len(ranges), -1)).T
+    xmin = shiftsgrid[np.argmin(wtvgrid(rslcs, shiftsgrid, method))]
+    if len(ranges) == 1:
+        return xmin[0]
+    return xmin
+
+
 def bruteranges(step, radius, center):
     """
     Auxiliary function for brute force exploration.
@@ -258,7 +470,7 @@ def bruteranges(step, radius, center):
         return [((c + low), (c + up), step) for c in center]
 
 
-def opt_rslcs(rslcs, method="weights", verbose=True):
+def opt_rslcs(rslcs, method="weights", verbose=True, vectorised=True):
     """
     I optimize the timeshifts between the rslcs to minimize the wtv between them.
     Note that even if the wtvdiff is only about two curves, we cannot split this into optimizing
@@ -267,6 +479,8 @@ def opt_rslcs(rslcs, method="weights", verbose=True):
     :param method: string. Choose between "weights" and "simple"
     :param verbose: boolean. Verbosity.
     :param rslcs: a list of rslc objects
+    :param vectorised: boolean. If True, I evaluate the brute force grids at once with :py:func:`wtvgrid`, and the
+        errorfct without building difference curves. Set it to False to use the original (slow) implementation.
 
     """
     rslcsc = [rs.copy() for rs in rslcs]  # We'll work on copies.
@@ -287,33 +501,41 @@ def opt_rslcs(rslcs, method="weights", verbose=True):
         for (rs, timeshift) in zip(rslcsc[1:], timeshifts):
             rs.timeshift = timeshift
 
+        if vectorised:
+            return float(wtvgrid(rslcsc, timeshifts, method)[0])
+
         tvs = np.array([wtvdiff(rs1, rs2, method=method) for (rs1, rs2) in couplelist])
         ret = np.sum(tvs)
         return ret
 
+    def brute(ranges):
+        if vectorised:
+            return brute_rslcs(rslcsc, ranges, method)
+        # This would finish by default with fmin ... we do not want that.
+        return spopt.brute(errorfct, ranges, full_output=False, finish=None)
+
     if verbose:
         logger.info("Starting time shift optimization ...")
         logger.info("Initial pars (shifts, not delays) : " + np.array2string(inishifts))
 
     # Some brute force exploration, like for the dispersion techniques ...
 
-    res = spopt.brute(errorfct, bruteranges(5, 3, inishifts), full_output=False, finish=None)
-    # This would finish by default with fmin ... we do not want that.
+    res = brute(bruteranges(5, 3, inishifts))
     if verbose:
         logger.info("Brute 1 shifts : %s" % np.array2string(res, precision=2))
         logger.info("Brute 1 errorfct : %f" % errorfct(res))
 
-    res = spopt.brute(errorfct, bruteranges(2.5, 3, res), full_output=False, finish=None)
+    res = brute(bruteranges(2.5, 3, res))
     if verbose:
         logger.info("Brute 2 shifts : %s" % np.array2string(res, precision=2))
         logger.info("Brute 2 errorfct : %f" % errorfct(res))
 
-    res = spopt.brute(errorfct, bruteranges(1.25, 3, res), full_output=False, finish=None)
+    res = brute(bruteranges(1.25, 3, res))
     if verbose:
         logger.info("Brute 3 shifts : %s" % np.array2string(res, precision=2))
         logger.info("Brute 3 errorfct : %f" % errorfct(res))
 
-    res = spopt.brute(errorfct, bruteranges(0.5, 3, res), full_output=False, finish=None)
+    res = brute(bruteranges(0.5, 3, res))
     if verbose:
         logger.info("Brute 4 shifts : %s" % np.array2string(res, precision=2))
         logger.info("Brute 4 errorfct : %f" % errorfct(res))
@@ -3,4 +3,4 @@ Simulating "real" light curves, started from scratch in summer 2011
 
 """
 
-__all__ = ["src", "twk", "draw", "run", "plot","power_spec"]
\ No newline at end of file
+__all__ = ["src", "twk", "draw", "run", "plot", "power_spec", "workqueue", "simset"]
\ No newline at end of file
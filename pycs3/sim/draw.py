@@ -9,6 +9,7 @@ import numpy as np
 import pycs3.gen.lc
 import pycs3.gen.lc_func
 import pycs3.gen.util
+import pycs3.sim.simset
 import pycs3.sim.src
 import scipy.ndimage.filters
 import logging
@@ -70,7 +71,7 @@ def saveresiduals(lcs, spline):
 
     for l in lcs:
         rawmags = l.mags.copy()
-        samplelc = l.copy()
+        samplelc = l.copy(light=True)
         sample(samplelc, spline)
         l.residuals = rawmags - samplelc.mags
 
@@ -177,7 +178,7 @@ def draw(lcs, spline, shotnoise=None, shotnoisefrac=1.0, tweakml=None, scaletwea
 
     # For the lcs, I'll not modify them in place, but return new ones.
     # Nevertheless, I work on a copy, as I'll call sample().
-    copylcs = [l.copy() for l in lcs]
+    copylcs = [l.copy(light=True) for l in lcs]
     fakelcs = []
 
     for i, l in enumerate(copylcs):
@@ -220,7 +221,7 @@ def draw(lcs, spline, shotnoise=None, shotnoisefrac=1.0, tweakml=None, scaletwea
         if (scaletweakresi == True) and (l.ml is not None):  # Otherwise no need to do anything
 
             # We sample from the same spline, but without tweaked ml :
-            lorigml = l.copy()
+            lorigml = l.copy(light=True)
             lorigml.ml = origml
             # Sampling :
             sample(lorigml, tweakedspline)
@@ -312,9 +313,92 @@ def draw(lcs, spline, shotnoise=None, shotnoisefrac=1.0, tweakml=None, scaletwea
     return fakelcs
 
 
+def draw_batch(lcs, spline, n=20, shotnoise=None, shotnoisefrac=1.0, truetsr=8.0, truetimeshifts=None):
+    """
+    Draws n sets of fake lightcurves at once, without building any LightCurve object.
+    This is the vectorised equivalent of n calls to :py:func:`pycs3.sim.draw.draw` without tweakml nor tweakspl :
+    the source spline is evaluated once for all the (n, npts) shifted epochs of each curve, the ML and the shifts of
+    your lcs are applied as in :py:func:`pycs3.sim.draw.sample`, and the shotnoise is drawn as one random array.
+
+    .. note:: I do NOT modify lcs or spline !
+
+    :param lcs: reference lightcurves to "immitate". I will use their epochs, their time/mag/flux shifts, their microlensing, their errorbars.
+    :param spline: reference spline from which I will draw my magnitudes.
+    :param n: number of sets of curves to draw
+    :param shotnoise: Select among [None, "magerrs", "res", "mcres", "sigma"], see :py:func:`pycs3.sim.draw.draw`.
+    :param shotnoisefrac: a multiplier of the shotnoise added to the curve.
+    :param truetsr: the true time shifts are drawn uniformly within truetsr around the time shifts of your lcs.
+    :param truetimeshifts: array of shape (n, len(lcs)). If given, I use these true time shifts instead of drawing them.
+
+    :return: list of arrays of mags, one array of shape (n, len(l)) for each curve l of lcs, and the array of true time shifts, of shape (n, len(lcs)).
+    """
+
+    if truetimeshifts is None:
+        origshifts = np.array([l.timeshift for l in lcs])
+        truetimeshifts = np.random.uniform(low=-truetsr, high=truetsr, size=(n, len(lcs))) + origshifts
+    else:
+        truetimeshifts = np.asarray(truetimeshifts)
+        if truetimeshifts.shape != (n, len(lcs)): # pragma: no cover
+            raise RuntimeError("truetimeshifts should have a shape (%i, %i)." % (n, len(lcs)))
+
+    magslist = []
+    for j, l in enumerate(lcs):
+        # The ML and the magshift do not depend on the timeshift, we compute them once.
+        mags = spline.eval(l.jds[np.newaxis, :] + truetimeshifts[:, j][:, np.newaxis]) - l.magshift
+        if l.ml is not None:
+            mags -= l.ml.calcmlmags(l)
+        if l.fluxshift != 0.0:
+            # Same as lc.calcfluxshiftmags(inverse=True), for all the simulations at once
+            mags -= 2.5 * np.log10((-l.fluxshift / (10.0 ** (mags / -2.5))) + 1.0)
+
+        if shotnoise == "magerrs":
+            mags += np.random.standard_normal(mags.shape) * shotnoisefrac * l.magerrs
+        elif shotnoise == "none" or shotnoise is None:
+            pass
+        elif shotnoise in ["res", "mcres", "sigma"]:
+            if not hasattr(l, 'residuals'): # pragma: no cover
+                raise RuntimeError("Save the residuals first !")
+            if shotnoise == "res":
+                mags += shotnoisefrac * l.residuals
+            elif shotnoise == "mcres":
+                mags += l.residuals * shotnoisefrac * np.random.randn(*mags.shape)
+            else:
+                mags += np.std(l.residuals) * shotnoisefrac * np.random.randn(*mags.shape)
+        else: # pragma: no cover
+            raise RuntimeError("Couldn't understand your shotnoise.")
+
+        magslist.append(mags)
+
+    return magslist, truetimeshifts
+
+
+def batch_to_lcs(lcs, magslist, truetimeshifts):
+    """
+    Builds the lists of fake LightCurves corresponding to the output of :py:func:`pycs3.sim.draw.draw_batch`, in the
+    same way as :py:func:`pycs3.sim.draw.draw` does : the curves are "as observed", with no shifts and no ML.
+
+    :param lcs: the reference lightcurves given to draw_batch
+    :param magslist: list of arrays of mags returned by draw_batch
+    :param truetimeshifts: array of true time shifts returned by draw_batch
+
+    :return: list of lists of LightCurves
+    """
+    simlcslist = []
+    for i in range(truetimeshifts.shape[0]):
+        simlcs = []
+        for j, l in enumerate(lcs):
+            fakel = pycs3.gen.lc_func.factory(l.jds.copy(), magslist[j][i].copy(), l.magerrs.copy(),
+                                              telescopename=l.telescopename + "sim", object=l.object, verbose=False)
+            fakel.plotcolour = l.plotcolour
+            fakel.truetimeshift = truetimeshifts[i, j]
+            simlcs.append(fakel)
+        simlcslist.append(simlcs)
+    return simlcslist
+
+
 def multidraw(lcs, spline=None, optfctnots=None, onlycopy=False, n=20, npkl=5, simset="draw", simdir=None,
               shotnoise=None, shotnoisefrac=1.0, truetsr=8.0, tweakml=None, scaletweakresi=True, tweakspl=None,
-              shuffle=True, verbose=True, trace=False, destpath='./'):
+              shuffle=True, verbose=True, trace=False, destpath='./', fmt="pkl"):
     """
     Even higher wrapper to produce mock + tweaked lightcurves, and save them into a directory (as pickle files),
     in preparation for analysing them with :py:func:`pycs3.sim.run.multirun`
@@ -367,6 +451,9 @@ def multidraw(lcs, spline=None, optfctnots=None, onlycopy=False, n=20, npkl=5, s
     :param verbose: boolean. Verbosity
     :param trace: boolean. If you want to save a trace of all the modification applied to the LightCurves
     :param destpath: string. Path to save the simulated curves.
+    :param fmt: string. "pkl" to save the simulations as pickled lists of LightCurves, "npz" for the columnar format of
+        :py:mod:`pycs3.sim.simset`, much lighter on disk and faster to read. The copies and the drawn curves have no
+        shifts and no ML, so nothing is lost for :py:func:`pycs3.sim.run.multirun`.
 
 
     .. note:: I will tweak the ML only of those curves that have spline ML. You probably want me to tweak the ML of all your curves !
@@ -408,24 +495,42 @@ def multidraw(lcs, spline=None, optfctnots=None, onlycopy=False, n=20, npkl=5, s
             splist = [spline]
         pycs3.gen.util.trace(lclist=lcs, splist=splist, tracedir="trace_sims_%s_tweak" % simset)
 
-        rawlcs = [l.copy() for l in lcs]
+        rawlcs = [l.copy(light=True) for l in lcs]
         for l in rawlcs:  # to get the unshifted curve :
             l.resetshifts()
         pycs3.gen.util.trace(lclist=rawlcs, splist=[], tracedir="trace_sims_%s_draw" % simset)
 
+    if fmt not in ["pkl", "npz"]:  # pragma: no cover
+        raise RuntimeError("I don't know the format %s, choose pkl or npz." % fmt)
+
     for i in range(npkl):
 
-        pklfilepath = os.path.join(destdir, "%i_%.5f.pkl" % (i + 1, float(time.time())))
+        pklfilepath = os.path.join(destdir, "%i_%.5f.%s" % (i + 1, float(time.time()), fmt))
 
         if onlycopy:
             if verbose:
                 logger.info("Preparing %i identical copies for pkl %i/%i ..." % (n, (i + 1), npkl))
-            simlcslist = [[l.copy() for l in lcs] for ni in range(n)]
+            simlcslist = [[l.copy(light=True) for l in lcs] for ni in range(n)]
             # We remove any microlensing or shifts :
             for simlcs in simlcslist:
                 for l in simlcs:
                     l.resetshifts()
 
+        elif optfctnots is None and tweakml is None and tweakspl is None and not trace:
+            # Nothing to tweak nor to optimise for each simulation, we draw all of them at once.
+            if verbose:
+                logger.info("Drawing %i simulations for pkl %i/%i at once ..." % (n, (i + 1), npkl))
+
+            magslist, truetimeshifts = draw_batch(lcs, spline, n=n, shotnoise=shotnoise, shotnoisefrac=shotnoisefrac,
+                                                  truetsr=truetsr)
+            if fmt == "npz":
+                # No need to build any LightCurve, but we name and mask the curves as batch_to_lcs does.
+                pycs3.sim.simset.writesimarrays(lcs, magslist, truetimeshifts, pklfilepath,
+                                                telescopenames=[l.telescopename + "sim" for l in lcs],
+                                                masks=[np.ones(len(l), dtype=bool) for l in lcs], verbose=verbose)
+                continue
+            simlcslist = batch_to_lcs(lcs, magslist, truetimeshifts)
+
         else:
             if verbose:
                 logger.info("Drawing %i simulations for pkl %i/%i ..." % (n, (i + 1), npkl))
@@ -440,7 +545,7 @@ def multidraw(lcs, spline=None, optfctnots=None, onlycopy=False, n=20, npkl=5, s
 
                 # So this loop is run for every simulated data set.
                 # We work on copies of lcs, as we will change them !
-                lcscopies = [l.copy() for l in lcs]
+                lcscopies = [l.copy(light=True) for l in lcs]
                 spline_copy = spline.copy()
 
                 if optfctnots is None:  # Then we just call draw on these time-shifted curves, using the provided spline and ML etc.
@@ -476,7 +581,10 @@ def multidraw(lcs, spline=None, optfctnots=None, onlycopy=False, n=20, npkl=5, s
                 simlcslist.append(simlcs)
 
         # We save the simlcslist into the pkl file
-        pycs3.gen.util.writepickle(simlcslist, pklfilepath, verbose=verbose)
+        if fmt == "npz":
+            pycs3.sim.simset.writesimset(simlcslist, pklfilepath, verbose=verbose)
+        else:
+            pycs3.gen.util.writepickle(simlcslist, pklfilepath, verbose=verbose)
 
         # The trace with tweak is already done by multidraw. We add a trace of the drawn curves :
         if trace:
@@ -6,34 +6,60 @@ import copy as pythoncopy
 import logging
 import os
 import time
+import zlib
 from glob import glob
 
+import multiprocess
 import numpy as np
 import pycs3.gen.lc
 import pycs3.gen.lc_func
 import pycs3.gen.util
 import pycs3.sim.draw
+import pycs3.sim.simset
+import pycs3.sim.workqueue
 
 logger = logging.getLogger(__name__)
 
 
 def optfct_aux(argument):
     """
-    Auxiliary function for multithreading
+    Auxiliary function for multiprocessing. I run the optfct on a single set of curves and give back the optimised
+    curves along with the output, as the worker only holds a copy of them.
+
+    :param argument: tuple (lcs, id, kwargs, optfct, seed). If seed is not None, I reseed numpy before the optimisation.
+    :return: tuple (optfct output, optimised lcs, success dictionary)
     """
-    arg, id, kwargs, optfct = argument
+    arg, id, kwargs, optfct, seed = argument
+    if seed is not None:
+        np.random.seed(seed)
     try:
         out = optfct(arg, **kwargs)
     except Exception as e:
-        # logger.warning("I have a problem with the curve number %i. Details : %s" % (i, e))
+        logger.warning("I have a problem with the curve number %i. Details : %s" % (id, e))
         dic = {'success': False, 'failed_id': [id], 'error_list': [e]}
         out = None
     else:
         dic = {'success': True, 'failed_id': [], 'error_list': []}
 
-    return out, dic
+    return out, arg, dic
+
 
-def applyopt(optfct, lcslist, **kwargs):
+def _getncpu(ncpu):
+    """
+    Translates the ncpu argument of :py:func:`pycs3.sim.run.applyopt` into a number of processes.
+
+    :param ncpu: number of processes. None means all the available CPUs, -1 all but one.
+    :return: tuple with the number of processes to use and the number of available CPUs
+    """
+    ncpuava = multiprocess.cpu_count()
+    if ncpu is None:
+        ncpu = ncpuava
+    elif ncpu == -1:
+        ncpu = max(ncpuava - 1, 1)
+    return ncpu, ncpuava
+
+
+def applyopt(optfct, lcslist, ncpu=1, executor=None, seed=None, **kwargs):
     """
     Applies optfct (an optimizing function that takes a list of lightcurves as single argument)
     to all the elements (list of lightcurves)
@@ -42,71 +68,59 @@ def applyopt(optfct, lcslist, **kwargs):
     Optimizes the lightcurves themselves, in place, and returns a list of the outputs of the optimizers, corresponding to the lcslist.
     For instance, if the optfct output is a spline, it also contains the final r2s, that I will later save into the pkls !
 
+    When running on several CPUs, each set of curves (with its microlensing) is shipped to a worker, and the optimised
+    curves are copied back into the lcslist, so that the in-place behaviour is the same as on a single CPU.
+    If one job is failing, this does not impact the others, but the optfct_outs won't have the same length as the lcslist.
+    Call clean_simlist if you want to remove the failed attempts from the lcslist.
+
     :param optfct: function to apply to the LightCurves
     :param lcslist: list of LightCurves
+    :param ncpu: number of processes to use. 1 runs serially, None uses all the available CPUs, -1 all but one.
+        Consider using ncpu=1 if you use a higher level of parallelisation.
+    :param executor: object with a ``map`` method (e.g. a `multiprocess.Pool` or a `concurrent.futures` executor). If given, I use it instead of creating my own pool and ignore ncpu.
+    :param seed: integer. If not None, job i is run after seeding numpy with seed + i, so that the results do not depend on the number of processes.
+        When running in parallel without a seed, I draw one from the current numpy random state.
     :param kwargs: dictionnary of kwargs to be transmitted to the optfct
 
     :return: optfct_outs: a list of the optimised LightCurves and a dictionnary containing the failed attempt to shift the curves.
     """
 
-    # ncpuava = multiprocess.cpu_count()
-
-    # if ncpu > 1 :
-    #     #todo : there is a very nasty bug here : the microlensing is not optimised in multiprocessing. I can't find why this is happening so do not use multiprocessing until this is solve. The bug is quiet it will just provide a very bad fit to the data !!! This must have to do with object that are not deepcopied...
-    #     logger.warning('Multi-processing is not supported on this verison ! You can still use a higher level of parallelisation. I will run on a single core for the moment.')
-    #     ncpu = 1
+    ncpu, ncpuava = _getncpu(ncpu)
 
-    # if ncpu == 1:
-    # curves are optimised one after the other :
-    # This now works with multi-threading. Consider using ncpu=1 if you use higher level of parallelisation.
-    # If one thread is failing, this should not impact the others, but the optfct_outs won't have the same length as the lcslist.
-    # Call clean_simlist if you want to remove the failed attempts from the lcslist.
+    parallel = executor is not None or ncpu > 1
+    if seed is None and parallel:
+        # forked workers would otherwise all share the same random state
+        seed = np.random.randint(0, 2 ** 31 - 1 - len(lcslist))
+    job_args = [(lcs, i, kwargs, optfct, None if seed is None else seed + i) for i, lcs in enumerate(lcslist)]
 
-    logger.info("Starting the curve shifting on a single CPU, no multiprocessing...")
     start = time.time()
-    kwargs_vec = [kwargs for k in lcslist]
+    if not parallel:
+        logger.info("Starting the curve shifting on a single CPU, no multiprocessing...")
+        results = [optfct_aux(job_arg) for job_arg in job_args]
+    elif executor is not None:
+        logger.info("Starting the curve shifting with the provided executor.")
+        results = list(executor.map(optfct_aux, job_args))
+    else:
+        logger.info("Starting the curve shifting on %i/%i CPUs." % (ncpu, ncpuava))
+        pool = multiprocess.Pool(ncpu)
+        results = pool.map(optfct_aux, job_args)  # order is conserved with map
+        pool.close()
+        pool.join()
+
     optfct_outs = []
     sucess_dic = {'success': True, 'failed_id': [], 'error_list': []}
-    for i, lcs in enumerate(lcslist):
-        try:
-            optout = optfct(lcs, **kwargs_vec[i])
-        except Exception as e: # pragma: no cover
-            logger.warning("I have a problem with the curve number %i. Details : %s" %(i,e))
-            sucess_dic['failed_id'].append(i)
+    for lcs, (optout, optlcs, dic) in zip(lcslist, results):
+        if optlcs is not lcs:
+            # The worker optimised a copy, we put the optimised shifts and ML back into the original curves
+            for (l, optl) in zip(lcs, optlcs):
+                l.__dict__ = optl.__dict__
+        if dic['success'] is False:
             sucess_dic['success'] = False
-            sucess_dic['error_list'].append(e)
+            sucess_dic['failed_id'] = sucess_dic['failed_id'] + dic['failed_id']
+            sucess_dic['error_list'] = sucess_dic['error_list'] + dic['error_list']
         else:
             optfct_outs.append(optout)
 
-
-    # else: # pragma: no cover # Multithreading version. Cannot be tested on CI server
-    #
-    #     if ncpu == None:
-    #         ncpu = ncpuava
-    #     if ncpu == -1:
-    #         ncpu = ncpuava - 1
-    #
-    #     logger.info("Starting the curve shifting on %i/%i CPUs." % (ncpu, ncpuava))
-    #     start = time.time()
-    #
-    #     job_args = [(copy.deepcopy(k), id, copy.deepcopy(kwargs), copy.deepcopy(optfct)) for id, k in enumerate(lcslist)]
-    #     sucess_dic = {'success': True, 'failed_id': [], 'error_list': []}
-    #
-    #     pool = multiprocess.Pool(ncpu)
-    #     results = pool.map(optfct_aux, job_args)  # order should be conserved with map_async
-    #     pool.close()
-    #     pool.join()
-    #
-    #     optfct_outs = []
-    #     for output in results:
-    #         if output[0] is not None:
-    #             optfct_outs.append(output[0])
-    #         if output[1]['success'] is False:
-    #             sucess_dic['success'] = False
-    #             sucess_dic['failed_id'] = sucess_dic['failed_id'] + output[1]['failed_id']
-    #             sucess_dic['error_list'] = sucess_dic['error_list'] + output[1]['error_list']
-
-
     if len(optfct_outs) == 0:
         logger.warning(" It seems that your optfct does not return anything ! ")
     else:
@@ -321,7 +335,7 @@ def collect(directory="./test", plotcolour="#008800", name=None):
 
 
 def multirun(simset, lcs, optfct, kwargs_optim, optset="multirun", tsrand=10.0, shuffle=True,
-             keepopt=False, trace=False, verbose=True, destpath="./", use_test_seed=False):
+             keepopt=False, trace=False, verbose=True, destpath="./", use_test_seed=False, ncpu=1, executor=None):
     """
     Top level wrapper to get delay "histograms" : I will apply the optfct to optimize the shifts
     between curves that you got from :py:func:`pycs3.sim.draw.multidraw`, and save the results in
@@ -359,6 +373,14 @@ def multirun(simset, lcs, optfct, kwargs_optim, optset="multirun", tsrand=10.0,
     :param verbose: boolean. Verbosity.
     :param destpath: string. Path to write the optimised curves and results.
     :param use_test_seed: boolean. Used for testing purposes. If you want to impose the random seed.
+        The random initial time shifts of each pkl are drawn after seeding numpy with 1, and the optimisation of the i-th
+        set of curves of each pkl is run after seeding numpy with 1+i (see the seed of :py:func:`pycs3.sim.run.applyopt`).
+        Note that this differs from older versions, which seeded numpy only once per pkl, before drawing the initial time shifts, and then optimised all the curves in a row :
+        the results obtained with use_test_seed=True are therefore not identical to those of older versions,
+        but they now do not depend on ncpu. The shuffling of the curves (see shuffle) is not seeded.
+    :param ncpu: integer. Number of processes used to optimise the curves of each pkl, see :py:func:`pycs3.sim.run.applyopt`.
+        If no executor is given and ncpu is not 1, I create a single pool of processes, used for all the pkls.
+    :param executor: object with a ``map`` method to run the optimisations, see :py:func:`pycs3.sim.run.applyopt`.
     :return: dictionary containing information about which curves optimisation failed.
     """
 
@@ -367,7 +389,7 @@ def multirun(simset, lcs, optfct, kwargs_optim, optset="multirun", tsrand=10.0,
     if not os.path.isdir(simdir):
         raise RuntimeError("Sorry, I cannot find the directory %s" % simset)
 
-    simpkls = sorted(glob(os.path.join(simdir, "*.pkl")))
+    simpkls = pycs3.sim.simset.findsims(simdir)
     if verbose:
         logger.info("I have found %i simulation pickles in %s." % (len(simpkls), simdir))
 
@@ -389,98 +411,305 @@ def multirun(simset, lcs, optfct, kwargs_optim, optset="multirun", tsrand=10.0,
             logger.info(l)
 
     success_dic = {'success': True, 'failed_id': [], 'error_list': []}
-    for simpkl in simpkls:
 
-        # First we test if this simpkl is already processed (or if another multirun is working on it).
-        simpklfilebase = os.path.splitext(os.path.basename(simpkl))[0]
+    # We create the pool once for all the pkls, instead of letting applyopt start a new one for each of them.
+    pool = None
+    if executor is None:
+        ncpu, ncpuava = _getncpu(ncpu)
+        if ncpu > 1:
+            logger.info("Starting a pool of %i/%i CPUs for the curve shifting." % (ncpu, ncpuava))
+            pool = multiprocess.Pool(ncpu)
+            executor = pool
 
-        workingonfilepath = os.path.join(destdir, simpklfilebase + ".workingon")
-        resultsfilepath = os.path.join(destdir, simpklfilebase + "_runresults.pkl")
-        optfilepath = os.path.join(destdir, simpklfilebase + "_opt.pkl")
+    try:
+        for simpkl in simpkls:
 
-        if os.path.exists(workingonfilepath) or os.path.exists(resultsfilepath):
-            continue
+            # First we test if this simpkl is already processed (or if another multirun is working on it).
+            simpklfilebase = os.path.splitext(os.path.basename(simpkl))[0]
 
-        # Ok, we start, hence we want to avoid other instances to work on the same pkl ...
-        os.system("date > %s" % workingonfilepath)
+            workingonfilepath = os.path.join(destdir, simpklfilebase + ".workingon")
+            resultsfilepath = os.path.join(destdir, simpklfilebase + "_runresults.pkl")
+            optfilepath = os.path.join(destdir, simpklfilebase + "_opt.pkl")
 
-        logger.info("--- Casino running on simset %s, optset %s ---" % (simset, optset))
-        simlcslist = pycs3.gen.util.readpickle(simpkl)
-        logger.info("Working for %s, %i simulations." % (resultsfilepath, len(simlcslist)))
+            if os.path.exists(resultsfilepath):
+                continue
 
-        # We set the initial conditions for the curves to analyse, based on the lcs argument as reference.
+            # Ok, we start, hence we want to avoid other instances to work on the same pkl ...
+            # The creation of the file is atomic : only one instance can get it.
+            try:
+                fd = os.open(workingonfilepath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            os.write(fd, (time.ctime() + "\n").encode())
+            os.close(fd)
 
-        for simlcs in simlcslist:
-            pycs3.sim.draw.transfershifts(simlcs, lcs)
+            logger.info("--- Casino running on simset %s, optset %s ---" % (simset, optset))
+            simlcslist = list(pycs3.sim.simset.readsims(simpkl))
+            logger.info("Working for %s, %i simulations." % (resultsfilepath, len(simlcslist)))
+
+            # We set the initial conditions for the curves to analyse, based on the lcs argument as reference.
 
-        # Now we add uniform noise to the initial time shifts
-        if tsrand != 0.0:
-            if use_test_seed:
-                np.random.seed(1)
-            for simlcs in simlcslist:
-                for simlc in simlcs:
-                    simlc.shifttime(float(np.random.uniform(low=-tsrand, high=tsrand, size=1)))
-        else:
-            if verbose:
-                logger.info("I do NOT randomize initial contidions for the time shifts !")
-
-        # And to the actual shifting, that will take most of the time
-        optfctouts = [None] * len(simlcslist)  # reset variabl eof the loop to avoid weird error.
-        clean_simlcslist = []
-        sucess_dic = {'success': True, 'failed_id': [], 'error_list': []}
-        if shuffle:
-            for simlcs in simlcslist:
-                pycs3.gen.lc_func.shuffle(simlcs)
-        optfctouts, success_dic = applyopt(optfct, simlcslist, **kwargs_optim)
-        if shuffle:  # We sort them, as they will be passed the constructor of runresuts.
             for simlcs in simlcslist:
-                pycs3.gen.lc_func.objsort(simlcs, verbose=False)
+                pycs3.sim.draw.transfershifts(simlcs, lcs)
+
+            # Now we add uniform noise to the initial time shifts
+            if tsrand != 0.0:
+                if use_test_seed:
+                    np.random.seed(1)
+                for simlcs in simlcslist:
+                    for simlc in simlcs:
+                        simlc.shifttime(float(np.random.uniform(low=-tsrand, high=tsrand, size=1)))
+            else:
+                if verbose:
+                    logger.info("I do NOT randomize initial contidions for the time shifts !")
+
+            # And to the actual shifting, that will take most of the time
+            optfctouts = [None] * len(simlcslist)  # reset variabl eof the loop to avoid weird error.
+            clean_simlcslist = []
+            sucess_dic = {'success': True, 'failed_id': [], 'error_list': []}
+            if shuffle:
+                for simlcs in simlcslist:
+                    pycs3.gen.lc_func.shuffle(simlcs)
+            optfctouts, success_dic = applyopt(optfct, simlcslist, ncpu=ncpu, executor=executor,
+                                               seed=1 if use_test_seed else None, **kwargs_optim)
+            if shuffle:  # We sort them, as they will be passed the constructor of runresuts.
+                for simlcs in simlcslist:
+                    pycs3.gen.lc_func.objsort(simlcs, verbose=False)
+
+            qs = getqs(optfctouts)
+            if isinstance(optfctouts[0], pycs3.gen.spl.Spline):
+                tracesplinelists = [[optfctout] for optfctout in optfctouts]  # just for the trace
+            else:
+                tracesplinelists = [[]] * len(simlcslist)  # just for the trace
+
+            # Trace after shifting
+            if trace:
+                logger.info("Saving trace of optimized curves ...")
+                tracedir = "trace_sims_%s_opt_%s" % (simset, optset)
+                for (simlcs, tracesplinelist) in zip(simlcslist, tracesplinelists):
+                    pycs3.gen.util.trace(lclist=simlcs, splist=tracesplinelist, tracedir=tracedir)
+
+            clean_simlcslist = clean_simlist(simlcslist, success_dic)
+            if keepopt:
+                # A bit similar to trace, we save the optimized lcs in a pickle file.
+                outopt = {"optfctoutlist": optfctouts, "optlcslist": clean_simlcslist}
+                pycs3.gen.util.writepickle(outopt, optfilepath)
+
+            # Saving the results
+            rr = RunResults(clean_simlcslist, qs=qs, name="sims_%s_opt_%s" % (simset, optset), success_dic=success_dic)
+            pycs3.gen.util.writepickle(rr, resultsfilepath)
+
+            # We remove the lock for this pkl file.
+            # If the files does not exist we stop !
+            if not os.path.exists(workingonfilepath):
+                logger.warning("WORKINGON FILE : %s REMOVED !"%workingonfilepath)
+                # raise RuntimeError('Workingon file has been removed during the optimisation.')
+            else:
+                logger.info("REMOVING : %s !" %workingonfilepath)
+                os.remove(workingonfilepath)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
-        # If the optfct was a spline optmization, this optfctouts is a list of splines.
-        # Else it might be something different, we deal with this now.
-        # todo : rewrite that properly with instance comparison Rslc for regdiff and Spline for the spl
+    return success_dic
 
-        if isinstance(optfctouts[0],
-                      pycs3.gen.spl.Spline):  # then it's a spline, and we will collect these lastr2nostab values.
-            tracesplinelists = [[optfctout] for optfctout in optfctouts]  # just for the trace
-            qs = np.array([s.lastr2nostab for s in optfctouts])
-            if np.all(qs < 1.0):
-                logger.warning("### qs values are very small, did you fit that spline ? ###")
 
-        elif isinstance(optfctouts[0], tuple):
-            qs = np.array([s[1] for s in optfctouts])  # then it's regdiff which returns a tuple, I'll take the second element which corresponds to minwtv
-            tracesplinelists = [[]] * len(simlcslist)  # just for the trace
+def getqs(optfctouts):
+    """
+    Returns the quality of the fits from the outputs of the optimisers, to be stored in the RunResults.
 
+    :param optfctouts: list of outputs of the optfct, splines or tuples returned by regdiff
+    :return: numpy array of r2 (for splines) or minwtv (for regdiff)
+    """
+    # If the optfct was a spline optmization, this optfctouts is a list of splines.
+    # Else it might be something different, we deal with this now.
+    if isinstance(optfctouts[0],
+                  pycs3.gen.spl.Spline):  # then it's a spline, and we will collect these lastr2nostab values.
+        qs = np.array([s.lastr2nostab for s in optfctouts])
+        if np.all(qs < 1.0):
+            logger.warning("### qs values are very small, did you fit that spline ? ###")
+
+    elif isinstance(optfctouts[0], tuple):
+        qs = np.array([s[1] for s in optfctouts])  # then it's regdiff which returns a tuple, I'll take the second element which corresponds to minwtv
+
+    else:
+        logger.error("Object : %s is unknown." % type(optfctouts[0]))
+        raise RuntimeError("Invalid instance, please optimise your curves with regdiff or spline.")
+
+    return qs
+
+
+def queuerun(simset, lcs, optfct, kwargs_optim, optset="multirun", tsrand=10.0, shuffle=True,
+             keepopt=False, trace=False, verbose=True, destpath="./", use_test_seed=False, nworkers=1, lease=900.0,
+             batchsize=1):
+    """
+    Same as :py:func:`pycs3.sim.run.multirun`, but the simulations are handed out one by one to the workers
+    through a :py:class:`pycs3.sim.workqueue.WorkQueue`, instead of locking whole pickles with ".workingon" files.
+
+    The claims are atomic and the workers renew them while they are working. If a worker dies, its simulations are
+    handed out again once the lease has expired. You can launch me several times on the same simset (or set nworkers),
+    no staggering is needed. The results are written in the same format as multirun, so that you can use
+    :py:func:`pycs3.sim.run.collect` on them.
+
+    :param simset: The name of the simulations to run on. Those are in a directory called ``sims_name``.
+    :param lcs: Lightcurves that define the initial shifts and microlensings you want to use.
+    :param optfct: The optimizing function that takes lcs as single argument, fully optimizes the curves,
+        and returns a spline, or a d2 value.
+    :param kwargs_optim: dictionary. Containing the keyword argument for the optimisation function
+    :param optset: A new name for the optimisation.
+    :param tsrand: I will randomly shift the simulated curves before running the optfct (uniform distrib from -tsrand to tsrand)
+    :param shuffle: if True, I will shuffle the curves before running optc on them, and then sort them immediatly afterwards.
+    :param keepopt: we write the optimized lightcurves as well as the output of the optimizers into one pickle file per input pickle file.
+    :param trace: boolean. To keep trace of the optimised LightCurves, as multirun does. Each worker writes the trace of
+        the simulations it optimises, in the order it finishes them, in its own subdirectory of
+        ``trace_sims_<simset>_opt_<optset>``.
+    :param verbose: boolean. Verbosity.
+    :param destpath: string. Path to write the optimised curves and results.
+    :param use_test_seed: boolean. Used for testing purposes. If you want to impose the random seed. Each simulation
+        is seeded from the name of its pickle and its index, so that the result does not depend on which worker runs it.
+    :param nworkers: integer. Number of local worker processes that I start.
+    :param lease: float. Duration of a claim in seconds, renewed every lease/3 while the worker is alive.
+    :param batchsize: integer. Number of simulations claimed at once by a worker.
+    :return: list of the success dictionaries of the pickles that were completed during this call.
+    """
+
+    simdir = os.path.join(destpath, "sims_%s" % simset)
+    if not os.path.isdir(simdir):
+        raise RuntimeError("Sorry, I cannot find the directory %s" % simset)
+
+    destdir = os.path.join(destpath, "sims_%s_opt_%s" % (simset, optset))
+    os.makedirs(os.path.join(destdir, "queue"), exist_ok=True)
+
+    simpkls = pycs3.sim.simset.findsims(simdir)
+    simpkls = [simpkl for simpkl in simpkls if not os.path.exists(
+        os.path.join(destdir, os.path.splitext(os.path.basename(simpkl))[0] + "_runresults.pkl"))]
+    if verbose:
+        logger.info("I have found %i simulation pickles to optimise in %s." % (len(simpkls), simdir))
+
+    queue = pycs3.sim.workqueue.WorkQueue(os.path.join(destdir, "queue.sqlite"), lease=lease)
+    queue.populate(simpkls)
+
+    job_args = [(simset, lcs, optfct, kwargs_optim, optset, tsrand, shuffle, keepopt, trace, destdir, use_test_seed,
+                 queue, batchsize)] * nworkers
+    if nworkers == 1:
+        results = [_queueworker(job_args[0])]
+    else:
+        pool = multiprocess.Pool(nworkers)
+        results = pool.map(_queueworker, job_args)
+        pool.close()
+        pool.join()
+
+    return [dic for result in results for dic in result]
+
+
+def _queueworker(argument):
+    """
+    Worker of :py:func:`pycs3.sim.run.queuerun` : claims simulations until the queue is empty, and gathers the results
+    of the pickles it finishes last.
+    """
+    (simset, lcs, optfct, kwargs_optim, optset, tsrand, shuffle, keepopt, trace, destdir, use_test_seed, queue,
+     batchsize) = argument
+    owner = pycs3.sim.workqueue.workername()
+    success_dics = []
+    cache = {}  # we keep the last simulation pickle in memory
+
+    with pycs3.sim.workqueue.Heartbeat(queue, owner):
+        while True:
+            tasks = queue.claim(owner, n=batchsize)
+            if len(tasks) == 0:
+                # Pickles whose finalisation was never done, or whose finaliser died :
+                for simpkl in queue.unfinalised():
+                    if queue.claimfinalise(simpkl, owner):
+                        success_dics.append(_queuefinalise(queue, simpkl, destdir, simset, optset, keepopt))
+                if queue.remaining() == 0:
+                    break
+                # Other workers are busy, we wait in case one of their leases expires.
+                time.sleep(min(queue.lease / 10.0, 10.0))
+                continue
+
+            for (simpkl, idx) in tasks:
+                if simpkl not in cache:
+                    cache = {simpkl: pycs3.sim.simset.readsims(simpkl, verbose=False)}
+                simlcs = [l.copy(light=True) for l in cache[simpkl][idx]]
+
+                pycs3.sim.draw.transfershifts(simlcs, lcs)
+                if tsrand != 0.0:
+                    if use_test_seed:
+                        np.random.seed(_queueseed(simpkl, idx))
+                    for simlc in simlcs:
+                        simlc.shifttime(float(np.random.uniform(low=-tsrand, high=tsrand, size=1)))
+                if shuffle:
+                    pycs3.gen.lc_func.shuffle(simlcs)
+                optout, simlcs, dic = optfct_aux((simlcs, idx, kwargs_optim, optfct, None))
+                if shuffle:
+                    pycs3.gen.lc_func.objsort(simlcs, verbose=False)
+                if trace:
+                    # One trace directory per worker, as the trace files are numbered by each process
+                    tracedir = os.path.join("trace_sims_%s_opt_%s" % (simset, optset), owner.replace(":", "_"))
+                    os.makedirs(tracedir, exist_ok=True)
+                    tracesplinelist = [optout] if isinstance(optout, pycs3.gen.spl.Spline) else []
+                    pycs3.gen.util.trace(lclist=simlcs, splist=tracesplinelist, tracedir=tracedir)
+
+                # written under a temporary name first, so that a partial file is never collected
+                simoptfilepath = _queuesimpath(destdir, simpkl, idx)
+                tmppath = "%s.%s.tmp" % (simoptfilepath, owner.replace(":", "_"))
+                pycs3.gen.util.writepickle((simlcs, optout, dic), tmppath, verbose=False)
+                if not queue.complete(simpkl, idx, owner, onsuccess=lambda: os.replace(tmppath, simoptfilepath)):
+                    # Our lease expired and another worker took the task over, it writes the result itself.
+                    logger.warning("I lost the lease of simulation %i of %s, I drop my result." % (idx, simpkl))
+                    os.remove(tmppath)
+                    continue
+
+                if queue.claimfinalise(simpkl, owner):
+                    success_dics.append(_queuefinalise(queue, simpkl, destdir, simset, optset, keepopt))
+
+    return success_dics
+
+
+def _queueseed(simpkl, idx):
+    """
+    Test seed of the simulation idx of simpkl : the indices restart at 0 in each pickle, so I also use its name.
+    (crc32 rather than hash(), which changes from one python process to the next.)
+    """
+    return zlib.crc32(("%s_%i" % (os.path.basename(simpkl), idx)).encode())
+
+
+def _queuesimpath(destdir, simpkl, idx):
+    return os.path.join(destdir, "queue", "%s_%05i.pkl" % (os.path.splitext(os.path.basename(simpkl))[0], idx))
+
+
+def _queuefinalise(queue, simpkl, destdir, simset, optset, keepopt):
+    """
+    Gathers the optimised simulations of a pickle into the runresults (and opt) pickles written by multirun.
+    """
+    simpklfilebase = os.path.splitext(os.path.basename(simpkl))[0]
+    simlcslist = []
+    optfctouts = []
+    success_dic = {'success': True, 'failed_id': [], 'error_list': []}
+    simoptfilepaths = [_queuesimpath(destdir, simpkl, idx) for idx in range(queue.nsims(simpkl))]
+    for simoptfilepath in simoptfilepaths:
+        simlcs, optout, dic = pycs3.gen.util.readpickle(simoptfilepath, verbose=False)
+        simlcslist.append(simlcs)
+        if dic['success'] is False:
+            success_dic['success'] = False
+            success_dic['failed_id'] = success_dic['failed_id'] + dic['failed_id']
+            success_dic['error_list'] = success_dic['error_list'] + dic['error_list']
         else:
-            logger.error("Object : ", type(optfctouts[0]), "is unknown.")
-            raise RuntimeError("Invalid instance, please optimise your curves with regdiff or spline.")
-
-        # Trace after shifting
-        if trace:
-            logger.info("Saving trace of optimized curves ...")
-            tracedir = "trace_sims_%s_opt_%s" % (simset, optset)
-            for (simlcs, tracesplinelist) in zip(simlcslist, tracesplinelists):
-                pycs3.gen.util.trace(lclist=simlcs, splist=tracesplinelist, tracedir=tracedir)
-
-        clean_simlcslist = clean_simlist(simlcslist, success_dic)
-        if keepopt:
-            # A bit similar to trace, we save the optimized lcs in a pickle file.
-            outopt = {"optfctoutlist": optfctouts, "optlcslist": clean_simlcslist}
-            pycs3.gen.util.writepickle(outopt, optfilepath)
-
-        # Saving the results
-        rr = RunResults(clean_simlcslist, qs=qs, name="sims_%s_opt_%s" % (simset, optset), success_dic=success_dic)
-        pycs3.gen.util.writepickle(rr, resultsfilepath)
-
-        # We remove the lock for this pkl file.
-        # If the files does not exist we stop !
-        if not os.path.exists(workingonfilepath):
-            logger.warning("WORKINGON FILE : %s REMOVED !"%workingonfilepath)
-            # raise RuntimeError('Workingon file has been removed during the optimisation.')
-        else:
-            logger.info("REMOVING : %s !" %workingonfilepath)
-            os.remove(workingonfilepath)
+            optfctouts.append(optout)
+
+    clean_simlcslist = clean_simlist(simlcslist, success_dic)
+    if keepopt:
+        outopt = {"optfctoutlist": optfctouts, "optlcslist": clean_simlcslist}
+        pycs3.gen.util.writepickle(outopt, os.path.join(destdir, simpklfilebase + "_opt.pkl"))
+
+    rr = RunResults(clean_simlcslist, qs=getqs(optfctouts), name="sims_%s_opt_%s" % (simset, optset),
+                    success_dic=success_dic)
+    pycs3.gen.util.writepickle(rr, os.path.join(destdir, simpklfilebase + "_runresults.pkl"))
+    queue.finalised(simpkl)  # only now, if we die before another worker will take over
 
+    for simoptfilepath in simoptfilepaths:
+        os.remove(simoptfilepath)
     return success_dic
 
 
@@ -0,0 +1,177 @@
+"""
+Columnar storage of simulation sets, as an alternative to the pickled lists of LightCurves written by
+:py:func:`pycs3.sim.draw.multidraw`.
+
+The simulations of a set share their epochs : I store the jds (and magerrs, mask) of each curve only once, and the mags
+of all the simulations as a single 2D array, shape (number of simulations, total number of points), along with the true
+time shifts. The npz file is not compressed, and I read it in one go, without keeping it open.
+The LightCurves are rebuilt on demand. Only the datapoints, the names and the true shifts are kept, which is all
+that :py:func:`pycs3.sim.run.multirun` needs.
+"""
+import logging
+import os
+from glob import glob
+
+import numpy as np
+
+import pycs3.gen.lc_func
+import pycs3.gen.util
+
+logger = logging.getLogger(__name__)
+
+
+def writesimset(simlcslist, filepath, verbose=True):
+    """
+    I write a list of lists of LightCurves (the simulations) into a columnar npz file.
+    All the simulations must contain the same curves, in the same order and with the same epochs.
+    The shifts and microlensing of the curves are not saved (multidraw does not put any on its simulations).
+
+    :param simlcslist: list of lists of LightCurves
+    :param filepath: path of the npz file
+    :param verbose: verbosity
+    """
+    if len(simlcslist) == 0:  # pragma: no cover
+        raise RuntimeError("I cannot write an empty simulation set.")
+
+    reflcs = simlcslist[0]
+    objects = [l.object for l in reflcs]
+    lengths = [len(l) for l in reflcs]
+    magslist = [np.empty((len(simlcslist), len(l))) for l in reflcs]
+    magerrslist = [np.empty((len(simlcslist), len(l))) for l in reflcs]
+    truetimeshifts = np.empty((len(simlcslist), len(reflcs)))
+
+    for i, simlcs in enumerate(simlcslist):
+        if [l.object for l in simlcs] != objects or [len(l) for l in simlcs] != lengths:  # pragma: no cover
+            raise RuntimeError("The simulations do not all contain the same curves !")
+        for j, l in enumerate(simlcs):
+            if not np.array_equal(l.jds, reflcs[j].jds):  # pragma: no cover
+                raise RuntimeError("The simulations do not share the same epochs !")
+            magslist[j][i] = l.mags
+            magerrslist[j][i] = l.magerrs
+            truetimeshifts[i, j] = getattr(l, "truetimeshift", np.nan)
+
+    writesimarrays(reflcs, magslist, truetimeshifts, filepath, magerrslist=magerrslist, verbose=verbose)
+
+
+def writesimarrays(reflcs, magslist, truetimeshifts, filepath, magerrslist=None, telescopenames=None, masks=None,
+                   verbose=True):
+    """
+    I write simulations given as arrays (as returned by :py:func:`pycs3.sim.draw.draw_batch`) into a columnar npz file.
+
+    :param reflcs: list of LightCurves giving the epochs, magerrs, mask and names of the curves
+    :param magslist: list of arrays of shape (number of simulations, len(l)), one for each curve l of reflcs
+    :param truetimeshifts: array of shape (number of simulations, len(reflcs)). Use NaN if there is no true shift.
+    :param filepath: path of the npz file
+    :param magerrslist: list of arrays of magerrs, same shape as magslist. If None, I use the magerrs of reflcs.
+    :param telescopenames: list of the telescope names of the simulated curves. If None, I use those of reflcs.
+    :param masks: list of the masks of the simulated curves. If None, I use those of reflcs.
+    :param verbose: verbosity
+    """
+    if telescopenames is None:
+        telescopenames = [l.telescopename for l in reflcs]
+    if masks is None:
+        masks = [l.mask for l in reflcs]
+    offsets = np.concatenate([[0], np.cumsum([len(l) for l in reflcs])])
+    mags = np.hstack(magslist)
+    if magerrslist is None:
+        magerrs = np.concatenate([l.magerrs for l in reflcs])
+    else:
+        magerrs = np.hstack(magerrslist)
+        if np.all(magerrs == magerrs[0]):
+            magerrs = magerrs[0]  # the usual case, we save it only once
+
+    np.savez(filepath, jds=np.concatenate([l.jds for l in reflcs]), mags=mags, magerrs=magerrs, offsets=offsets,
+             mask=np.concatenate(masks), truetimeshifts=truetimeshifts,
+             objects=np.array([l.object for l in reflcs]),
+             telescopenames=np.array(telescopenames),
+             plotcolours=np.array([str(l.plotcolour) for l in reflcs]))
+    if verbose:
+        logger.info("Wrote %s" % filepath)
+
+
+class SimSet:
+    """
+    Read-only view on a columnar simulation set written by :py:func:`writesimset`.
+    It behaves like the list of lists of LightCurves that was written : simset[i] rebuilds the LightCurves of the i-th simulation.
+    """
+
+    def __init__(self, filepath):
+        """
+        :param filepath: path of the npz file
+        """
+        self.filepath = filepath
+        with np.load(filepath) as data:  # so that no file handle stays open
+            self.arrays = {key: data[key] for key in data.files}
+        self.offsets = self.arrays["offsets"]
+        self.objects = [str(o) for o in self.arrays["objects"]]
+        self.telescopenames = [str(t) for t in self.arrays["telescopenames"]]
+        self.plotcolours = [str(c) for c in self.arrays["plotcolours"]]
+        self.truetimeshifts = self.arrays["truetimeshifts"]
+
+    def __len__(self):
+        return self.truetimeshifts.shape[0]
+
+    def __getitem__(self, i):
+        return self.getlcs(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.getlcs(i)
+
+    def getarray(self, key):
+        """
+        Returns an array of the npz file.
+        """
+        return self.arrays[key]
+
+    def getmags(self):
+        """
+        Returns the 2D array of mags, shape (number of simulations, total number of points). Use self.offsets to
+        find the points of each curve.
+        """
+        return self.getarray("mags")
+
+    def getlcs(self, i):
+        """
+        Builds the LightCurves of the i-th simulation.
+        """
+        jds = self.getarray("jds")
+        mags = self.getarray("mags")[i]
+        magerrs = self.getarray("magerrs")
+        if magerrs.ndim == 2:
+            magerrs = magerrs[i]
+        mask = self.getarray("mask")
+
+        lcs = []
+        for j, object in enumerate(self.objects):
+            sl = slice(self.offsets[j], self.offsets[j + 1])
+            l = pycs3.gen.lc_func.factory(jds[sl].copy(), mags[sl].copy(), magerrs[sl].copy(),
+                                          telescopename=self.telescopenames[j], object=object, verbose=False)
+            l.mask = mask[sl].copy()
+            l.plotcolour = self.plotcolours[j]
+            if not np.isnan(self.truetimeshifts[i, j]):
+                l.truetimeshift = self.truetimeshifts[i, j]
+            lcs.append(l)
+        return lcs
+
+
+def readsims(filepath, verbose=True):
+    """
+    Reads a simulation file written by multidraw, whatever its format.
+
+    :param filepath: path to a pickle (list of lists of LightCurves) or to a columnar npz file.
+    :return: a list of lists of LightCurves for pickles, a :py:class:`SimSet` for npz files. Both can be indexed and iterated.
+    """
+    if os.path.splitext(filepath)[1] == ".npz":
+        if verbose:
+            logger.info("Read %s" % filepath)
+        return SimSet(filepath)
+    else:
+        return pycs3.gen.util.readpickle(filepath, verbose=verbose)
+
+
+def findsims(simdir):
+    """
+    Returns the sorted list of the simulation files (pickles or npz) of a simulation directory.
+    """
+    return sorted(glob(os.path.join(simdir, "*.pkl")) + glob(os.path.join(simdir, "*.npz")))
@@ -9,6 +9,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pycs3.gen.datapoints
 import pycs3.gen.spl
+import scipy.fft as spfft
 import scipy.interpolate as si
 import logging
 logger = logging.getLogger(__name__)
@@ -106,7 +107,7 @@ class Source:
         randvec = rs.standard_normal(self.imags.size) * sigma
         self.imags += np.cumsum(randvec)
 
-    def addplaw2(self, beta=-3.0, sigma=0.01, flux=False, fmin=None, fmax=None, hann=False, seed=None):
+    def addplaw2(self, beta=-3.0, sigma=0.01, flux=False, fmin=None, fmax=None, hann=False, seed=None, noise=None):
         """
         Next version, better
         Adds noise according to a power law PSD.
@@ -116,10 +117,17 @@ class Source:
 
         if hann, we soften the window (Hann window instead of tophat).
 
-        """
-        # To simplify, we will generate a symmetric curve and use only half of it. Hence this symmetric curve will be twice as long.
+        If you give me a noise (a row of :py:meth:`plawnoise`), I add it instead of drawing a new one.
 
+        """
         n = self.imags.size  # The real number of points in our curve. This is even by construction.
+        if noise is not None:
+            if len(noise) != n:
+                raise RuntimeError("Your noise has %i points, but I have %i." % (len(noise), n))
+            self.addnoise(noise, flux=flux)
+            return
+
+        # To simplify, we will generate a symmetric curve and use only half of it. Hence this symmetric curve will be twice as long.
         n2 = 2 * n  # This is even more even.
 
         # The positive FFT frequencies, in relative units :
@@ -158,14 +166,55 @@ class Source:
             bell[windowmask] = np.hanning(np.sum(windowmask))
             specs *= bell
 
+        self.addnoise(sigma * np.fft.irfft(specs)[:int(n2 / 2)], flux=flux)
+
+    def addnoise(self, noise, flux=False):
+        """
+        Add a noise, for instance made by :py:meth:`plawnoise`, to my internal magnitudes.
+        """
         # We add the points to the values
         if flux:
             logger.warning("Working with fluxes, check that sigma is scaled for fluxes and not magnitude.")
             iflux = 10.0 ** (-0.4 * self.imags)  # The fluxes
-            iflux += sigma * np.fft.irfft(specs)[:int(n2 / 2)]  # We add our "noise"
+            iflux += noise  # We add our "noise"
             self.imags = -2.5 * np.log10(iflux)  # and get back to fluxes
         else:
-            self.imags -= sigma * np.fft.irfft(specs)[:int(n2 / 2)]  # -, to make it coherent with the fluxes.
+            self.imags -= noise  # -, to make it coherent with the fluxes.
+
+    def plawnoise(self, beta=-3.0, sigma=0.01, fmin=None, fmax=None, hann=False, n=1, rng=None):
+        """
+        Vectorised version of the noise of :py:meth:`addplaw2` : I return n realisations of it, from a single 2-D irfft
+        of fast length. Give me back the rows through the noise argument of addplaw2().
+
+        :param n: integer, number of realisations
+        :param rng: numpy Generator, or seed to build one
+        :return: 2-D array of shape (n, number of points of the internal arrays)
+        """
+        size = self.imags.size
+        nfft = spfft.next_fast_len(2 * size, real=True)  # at least twice as long, as in addplaw2
+        freqs2 = np.fft.rfftfreq(nfft)
+        freqs = freqs2 / self.sampling
+
+        rng = np.random.default_rng(rng)
+        specs = rng.standard_normal((n, len(freqs2))) + 1j * rng.standard_normal((n, len(freqs2)))
+        specs[:, 1:] *= freqs2[1:] ** (beta / 2.0)
+        specs[:, 0] = 0.0  # To get 0 power for the 0 frequency.
+        if nfft % 2 == 0:
+            specs[:, -1] = specs[:, -1].real  # the Nyquist frequency term is real
+
+        if fmin is None:
+            fmin = freqs[0] - 1.0
+        if fmax is None:
+            fmax = freqs[-1] + 1.0
+        windowmask = np.logical_and(freqs <= fmax, freqs >= fmin)
+        specs[:, np.logical_not(windowmask)] = 0.0
+        if hann:
+            bell = np.zeros(freqs2.shape)
+            bell[windowmask] = np.hanning(np.sum(windowmask))
+            specs *= bell
+
+        # The normalisation keeps the same expected amplitude as addplaw2, that works on 2 * size points
+        return sigma * np.sqrt(nfft / (2.0 * size)) * spfft.irfft(specs, n=nfft, axis=-1)[:, :size]
 
     def eval(self, jds):
         """
@@ -3,14 +3,18 @@ Top level functions that use the src module to tweak microlensing and source spl
 These are the function to pass them to draw.draw or draw.multidraw.
 """
 
+import copy
+import hashlib
 import logging
 
 import matplotlib.pyplot as plt
 import numpy as np
+import scipy.fft as spfft
 import scipy.signal as sc
 
 import pycs3.gen.lc
 import pycs3.gen.lc_func
+import pycs3.gen.splml
 import pycs3.gen.stat
 import pycs3.sim.power_spec
 import pycs3.sim.src
@@ -18,14 +22,19 @@ import pycs3.sim.src
 logger = logging.getLogger(__name__)
 
 
-def tweakml(lcs, spline, beta=-2.0, sigma=0.05, fmin=1 / 500.0, fmax=None, psplot=False, sampling=0.1):
+def tweakml(lcs, spline, beta=-2.0, sigma=0.05, fmin=1 / 500.0, fmax=None, psplot=False, sampling=0.1, noise=None,
+            compactml=True):
     """
     I tweak the SplineML of your curves by adding small scale structure.
     I DO modify your lcs inplace.
 
+    :param noise: list of 1-D arrays, one per curve, precomputed noise to add instead of drawing it. These are rows of
+        :py:meth:`pycs3.sim.src.Source.plawnoise` for the source of the ML spline of each curve, at this sampling.
+    :param compactml: boolean, if True the tweaked ML is a :py:class:`pycs3.gen.splml.NoiseSplineML`, otherwise an
+        interpolating spline with one knot per noise sample.
 
     """
-    for l in lcs:
+    for i, l in enumerate(lcs):
         if l.ml is None:
             logger.warning(("Curve %s has no ML to tweak !" % (str(l))))
             continue
@@ -37,16 +46,23 @@ def tweakml(lcs, spline, beta=-2.0, sigma=0.05, fmin=1 / 500.0, fmax=None, psplo
         spline = l.ml.spline.copy()
         name = "ML(%s)" % l.object
         source = pycs3.sim.src.Source(spline, name=name, sampling=sampling)
+        previous = previousnoise(l.ml, source.ijds)
+        source.imags += previous
+        baseimags = source.imags.copy()
 
         if psplot:
             psspline = pycs3.sim.power_spec.PowerSpectrum(source, flux=False)
             psspline.plotcolour = "black"
             psspline.calcslope(fmin=1 / 1000.0, fmax=1 / 100.0)
 
-        source.addplaw2(beta=beta, sigma=sigma, fmin=fmin, fmax=fmax, flux=False, seed=None)
+        source.addplaw2(beta=beta, sigma=sigma, fmin=fmin, fmax=fmax, flux=False, seed=None,
+                        noise=None if noise is None else noise[i])
         source.name += "_twk"
-        newspline = source.generate_spline()
-        l.ml.replacespline(newspline)
+        if compactml:
+            l.ml = pycs3.gen.splml.NoiseSplineML(l.ml.spline, source.ijds, previous + source.imags - baseimags)
+        else:
+            newspline = source.generate_spline()
+            l.ml.replacespline(newspline)
 
         if psplot:
             psnewspline = pycs3.sim.power_spec.PowerSpectrum(source, flux=False)
@@ -85,40 +101,91 @@ def tweakspl(spline, beta=-2.5, sigma=0.03, fmin=1 / 30.0, fmax=1 / 5.0, hann=Fa
 
     return newspline
 
-def tweakml_PS(lcs, spline, B, f_min = 1/300.0,psplot=False, save_figure_folder = None,  verbose = False, interpolation = 'linear', A_correction = 1.0):
-    """
-    This function is equivalent to tweakml but I am using the power spectrum of the residuals to reinject noise with the same power spectrum
-    but randomised phases. I will tweak the SplineML by adding small scale structures at the same frequencies than the data.
+# Ratio between the median absolute deviation and the standard deviation of a gaussian noise
+MAD_GAUSS = 0.6744897501960817
 
-    I DO modify your lcs inplace.
 
-    :param lcs: list of LightCurve
-    :param spline: Spline object corresponding to the intrinsic signal of your lcs
-    :param B: float, high frequency cut in units of the Nymquist frequency
-    :param f_min: float, low frequency cut, in units of 1/days.
-    :param psplot: boolean, Choose if you want to plot the debugging plots
-    :param save_figure_folder: string. Path where to plot the figures
-    :param verbose: boolean. Verbosity
-    :param interpolation: string, interpolation type. Choose between 'nearest' and 'linear'
-    :param A_correction: Correction factor to the amplitude of the power spectrum. To produce the same rms standard deviation in the residuals than the data I need a some small adjustment because the automatic adjustment of the amplitude is not sufficient.
-    :return: Nothing, I modify the lcs.
+def previousnoise(ml, jds):
+    """
+    Noise already carried by a tweaked ML, so that tweaking it again adds to it.
 
+    :param ml: microlensing object
+    :param jds: 1-D array, (relative) jds at which I evaluate the noise
+    :return: 1-D array, zeros if the ML is not a NoiseSplineML
     """
-    for l in lcs:
-        # We check if the attached ml really is a spline, you should change that before calling the function if this is not the case
-        if l.ml == None:
-            raise RuntimeError("ERROR, curve %s has no ML to tweak ! I won't tweak anything." % (str(l)))
+    if isinstance(ml, pycs3.gen.splml.NoiseSplineML):
+        return ml.evalnoise(jds)
+    return np.zeros(len(jds))
 
-        elif l.ml.mltype != "spline":
-            raise RuntimeError("ERROR, I can only tweak SplineML objects, curve %s has something else !  I won't tweak anything." % (str(l)))
 
-        name = "ML(%s)" % (l.object)
-        ml_spline = l.ml.spline.copy()
-        np.random.seed() #this is to reset the seed when using multiprocessing
-        rls = pycs3.gen.stat.subtract([l], spline)[0]
-        target_std = pycs3.gen.stat.resistats(rls)['std']
-        target_zruns = pycs3.gen.stat.resistats(rls)['zruns']
+class TweakContext(object):
+    """
+    Cache of everything :py:func:`tweakml_PS` computes from the data only : the residual curve and its target stats,
+    the Lomb-Scargle periodogram and the noise spectrum interpolated on the noise frequencies, and the ML source.
+    None of this depends on the random phases, so that giving the same context to all the calls of tweakml_PS (one per
+    mock curve) leaves only the noise synthesis and the spline fit to do for each mock.
 
+    The entries are keyed by the content of the curve (shifted jds and mags, including the ML) and of the splines, so
+    that the light copies made by draw.draw() of the same data curve share their entry.
+    """
+
+    def __init__(self, maxsize=64):
+        """
+        :param maxsize: integer, maximum number of (curve, B, f_min) entries I keep in memory
+        """
+        self.maxsize = maxsize
+        self.residuals = {}
+        self.spectra = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(l, spline):
+        """
+        Key of the residual curve of l with respect to spline.
+        """
+        h = hashlib.sha1()
+        for a in [l.getjds(), l.getmags(), l.ml.spline.t, l.ml.spline.c, spline.t, spline.c]:
+            h.update(np.ascontiguousarray(a, dtype=float).tobytes())
+        return h.hexdigest()
+
+    def clear(self):
+        """
+        Empty the cache.
+        """
+        self.residuals = {}
+        self.spectra = {}
+
+    def _store(self, dic, key, value):
+        if len(dic) >= self.maxsize:
+            del dic[next(iter(dic))]  # the oldest entry
+        dic[key] = value
+
+    def getresiduals(self, l, spline, key=None):
+        """
+        :return: tuple (residual LightCurve, target std, target zruns)
+        """
+        if key is None:
+            key = self.key(l, spline)
+        if key not in self.residuals:
+            rls = pycs3.gen.stat.subtract([l], spline)[0]
+            stats = pycs3.gen.stat.resistats(rls)
+            self._store(self.residuals, key, (rls, stats['std'], stats['zruns']))
+        return self.residuals[key]
+
+    def get(self, l, spline, B, f_min):
+        """
+        Return the dictionnary of all the quantities used by tweakml_PS for the curve l, its intrinsic spline and the
+        parameters B and f_min. I compute it if it is not already in the cache.
+        """
+        key = self.key(l, spline)
+        fullkey = (key, float(B), float(f_min))
+        if fullkey in self.spectra:
+            self.hits += 1
+            return self.spectra[fullkey]
+        self.misses += 1
+
+        rls, target_std, target_zruns = self.getresiduals(l, spline, key=key)
         x = rls.jds
         y = rls.mags
         n = len(x)
@@ -139,62 +206,135 @@ def tweakml_PS(lcs, spline, B, f_min = 1/300.0,psplot=False, save_figure_folder
             samples -= 1
         samplerate = 1 # don't touch this, add more sample if you want
 
-        freqs_noise = np.abs(np.fft.fftfreq(samples, 1 / samplerate))
         freqs_data = np.linspace(f_min, B* 1 / (sampling * 2.0), 10000)
         pgram = sc.lombscargle(x, y, freqs_data)
+        amps, nfft = noise_amplitudes(freqs_data, len(freqs_data) * pgram, samples, samplerate=samplerate)
+
+        source = pycs3.sim.src.Source(l.ml.spline.copy(), name="ML(%s)" % (l.object), sampling=span/float(samples))
+        roundingerror = len(source.imags) != samples
+        if roundingerror: #weird error can happen for some curves due to round error...
+            source.sampling = float(source.jdmax - source.jdmin) / float(samples)
+            source.ijds = np.linspace(source.jdmin, source.jdmax, samples)
+            source.imags = source.inispline.eval(jds=source.ijds)
+
+        entry = {"rls": rls, "target_std": target_std, "target_zruns": target_zruns, "span": span,
+                 "sampling": sampling, "samples": samples, "freqs_data": freqs_data, "pgram": pgram, "amps": amps,
+                 "nfft": nfft, "noise_std": noise_std(amps, nfft), "x_sample": np.linspace(start, stop, samples),
+                 "source": source, "roundingerror": roundingerror}
+        self._store(self.spectra, fullkey, entry)
+        return entry
+
+    def drawnoise(self, l, spline, B, f_min=1 / 300.0, n=1, rng=None, jds=None, interpolation='linear'):
+        """
+        Draw n realisations of the noise that tweakml_PS adds to the ML of the curve l, before its rescaling, from a
+        single FFT. The rows can then be given to tweakml_PS through its noise argument.
+
+        :param n: integer, number of realisations
+        :param rng: numpy Generator, or seed to build one
+        :param jds: 1-D array, if not None I resample all the realisations at these dates instead, in one go
+        :param interpolation: string, interpolation type used for the resampling. Choose between 'nearest' and 'linear'
+        :return: 2-D array of shape (n, number of samples of the noise), or (n, len(jds))
+        """
+        ctx = self.get(l, spline, B, f_min)
+        noise = fftnoise_batch(ctx["amps"], ctx["nfft"], n=n, rng=rng)[:, :ctx["samples"]]
+        if jds is not None:
+            return pycs3.gen.lc_func.resample(jds, ctx["x_sample"], noise, interpolate=interpolation)
+        return noise
+
+
+def tweakml_PS(lcs, spline, B, f_min = 1/300.0,psplot=False, save_figure_folder = None,  verbose = False, interpolation = 'linear', A_correction = 1.0, seed = None, context = None, noise = None, compactml = True):
+    """
+    This function is equivalent to tweakml but I am using the power spectrum of the residuals to reinject noise with the same power spectrum
+    but randomised phases. I will tweak the SplineML by adding small scale structures at the same frequencies than the data.
+
+    I DO modify your lcs inplace.
+
+    :param lcs: list of LightCurve
+    :param spline: Spline object corresponding to the intrinsic signal of your lcs
+    :param B: float, high frequency cut in units of the Nymquist frequency
+    :param f_min: float, low frequency cut, in units of 1/days.
+    :param psplot: boolean, Choose if you want to plot the debugging plots
+    :param save_figure_folder: string. Path where to plot the figures
+    :param verbose: boolean. Verbosity
+    :param interpolation: string, interpolation type. Choose between 'nearest' and 'linear'
+    :param A_correction: Correction factor to the amplitude of the power spectrum. To produce the same rms standard deviation in the residuals than the data I need a some small adjustment because the automatic adjustment of the amplitude is not sufficient.
+    :param seed: integer or list of integers, if not None I draw the random phases of the noise from this seed, so that calls with different B or A_correction but the same seed give noise realisations as similar as possible (common random numbers). Otherwise I reset the numpy seed.
+    :param context: TweakContext, to reuse the periodogram and everything that does not depend on the random phases from one call to the next. Give the same context to all the calls made for the same data curves.
+    :param noise: list of 1-D arrays, one per curve, precomputed realisations of the noise to use instead of drawing them, see :py:meth:`TweakContext.drawnoise`. I rescale them myself.
+    :param compactml: boolean, if True the tweaked ML is a :py:class:`pycs3.gen.splml.NoiseSplineML` that interpolates the noise linearly, otherwise an interpolating spline with one knot per noise sample (slow to build and to evaluate).
+    :return: Nothing, I modify the lcs.
+
+    """
+    if context is None:
+        context = TweakContext()
+
+    for i, l in enumerate(lcs):
+        # We check if the attached ml really is a spline, you should change that before calling the function if this is not the case
+        if l.ml == None:
+            raise RuntimeError("ERROR, curve %s has no ML to tweak ! I won't tweak anything." % (str(l)))
+
+        elif l.ml.mltype != "spline":
+            raise RuntimeError("ERROR, I can only tweak SplineML objects, curve %s has something else !  I won't tweak anything." % (str(l)))
+
+        if seed is None:
+            np.random.seed() #this is to reset the seed when using multiprocessing
+            rng = np.random.default_rng()
+        else:
+            rng = np.random.default_rng(np.hstack([seed, i]))  # one stream per curve
+
+        ctx = context.get(l, spline, B, f_min)
+        samples = ctx["samples"]
 
         if verbose :
             logger.info("#############################################")
             logger.info(f"Light curve {str(l.object)}")
-            logger.info(f"Time Span of your lightcurve : {span} days")
-            logger.info(f"Average sampling of the curve [day] : {sampling}")
-            logger.info(f"Nymquist frequency [1/day]: {1 / (sampling * 2.0)}")
-            logger.info(f"min max, lenght frequency of noise: {np.min(freqs_noise)}, {np.max(freqs_noise)}, {len(freqs_noise)}")
-            logger.info(f"min max, lenght frequency of data: {np.min(freqs_data)}, {np.max(freqs_data)}, {len(freqs_data)}")
-            logger.info(f"Number of samples generated : {samples}")
-
-        #generate noise with not the good scaling
-        band_noise = band_limited_noise_withPS(freqs_data, len(freqs_data)*pgram, samples=samples, samplerate=samplerate) #generate the noie with a PS from the data
-        x_sample = np.linspace(start, stop, samples)
-
-        noise_lcs_band = pycs3.gen.lc.LightCurve()
-        noise_lcs_band.jds = x_sample
-        noise_lcs_band.mags = band_noise
-
-        #Use the previous to have the correct rescaling of the noise :
-        generated_std = pycs3.gen.stat.resistats(noise_lcs_band)['std']
-        Amp = target_std / generated_std
+            logger.info(f"Time Span of your lightcurve : {ctx['span']} days")
+            logger.info(f"Average sampling of the curve [day] : {ctx['sampling']}")
+            logger.info(f"Nymquist frequency [1/day]: {1 / (ctx['sampling'] * 2.0)}")
+            logger.info(f"min max, lenght frequency of data: {np.min(ctx['freqs_data'])}, {np.max(ctx['freqs_data'])}, {len(ctx['freqs_data'])}")
+            logger.info(f"Number of samples generated : {samples}, FFT length : {ctx['nfft']}")
+
+        #generate noise with not the good scaling, with a PS from the data
+        if noise is None:
+            band_noise = fftnoise_batch(ctx["amps"], ctx["nfft"], rng=rng)[0, :samples]
+        else:
+            band_noise = np.asarray(noise[i])
+            if len(band_noise) != samples:
+                raise RuntimeError("Your noise for curve %s has %i samples instead of %i." % (str(l), len(band_noise), samples))
+
+        #The std of the noise is known analytically, I rescale it to the MAD of the residuals :
+        Amp = ctx["target_std"] / (MAD_GAUSS * ctx["noise_std"])
         if verbose :
             logger.info(f"required amplification : {Amp}")
             logger.info(f"Additionnal A correction : {A_correction}")
-        band_noise_rescaled = band_limited_noise_withPS(freqs_data, len(freqs_data)* Amp * pgram * A_correction, samples=samples, samplerate=samplerate)
-        noise_lcs_rescaled = pycs3.gen.lc.LightCurve()
-        noise_lcs_rescaled.jds = x_sample
-        noise_lcs_rescaled.mags = band_noise_rescaled
-
-        #resampling of the generated noise :
-        noise_lcs_resampled = pycs3.gen.lc_func.interpolate(rls, noise_lcs_rescaled, interpolate=interpolation)
+        band_noise_rescaled = band_noise * Amp * A_correction
+
+        if verbose or psplot:
+            #resampling of the generated noise :
+            noise_lcs_rescaled = pycs3.gen.lc.LightCurve()
+            noise_lcs_rescaled.jds = ctx["x_sample"]
+            noise_lcs_rescaled.mags = band_noise_rescaled
+            noise_lcs_resampled = pycs3.gen.lc_func.interpolate(ctx["rls"], noise_lcs_rescaled, interpolate=interpolation)
         if verbose :
             logger.info(f"resampled : {pycs3.gen.stat.resistats(noise_lcs_resampled)}")
-            logger.info(f"target : {pycs3.gen.stat.resistats(rls)}")
-
-
-        source = pycs3.sim.src.Source(ml_spline, name=name, sampling=span/float(samples))
-        if len(noise_lcs_rescaled) != len(source.imags): #weird error can happen for some curves due to round error...
-            if verbose :
+            logger.info(f"target : {pycs3.gen.stat.resistats(ctx['rls'])}")
+            if ctx["roundingerror"]:
                 logger.warning("Warning : round error somewhere, I will need to change a little bit the sampling of your source, but don't worry, I can deal with that.")
-            source.sampling = float(source.jdmax - source.jdmin) / float(len(noise_lcs_rescaled))
-            source.ijds = np.linspace(source.jdmin, source.jdmax, (len(noise_lcs_rescaled)))
-            source.imags = source.inispline.eval(jds=source.ijds)
 
-        source.imags += noise_lcs_rescaled.mags
-        newspline = source.generate_spline()
-        l.ml.replacespline(newspline) # replace the previous spline with the tweaked one...
+        previous = previousnoise(l.ml, ctx["source"].ijds)
+        if compactml:
+            l.ml = pycs3.gen.splml.NoiseSplineML(l.ml.spline, ctx["source"].ijds, previous + band_noise_rescaled)
+        else:
+            source = copy.copy(ctx["source"])  # the inispline is not modified, only the imags
+            source.imags = source.imags + previous + band_noise_rescaled
+            newspline = source.generate_spline()
+            l.ml.replacespline(newspline) # replace the previous spline with the tweaked one...
 
         if psplot :
+            freqs_data = ctx["freqs_data"]
             pgram_resampled = sc.lombscargle(noise_lcs_resampled.jds, noise_lcs_resampled.mags, freqs_data)
             fig4 = plt.figure(4)
-            plt.plot(freqs_data, pgram, label='original')
+            plt.plot(freqs_data, ctx["pgram"], label='original')
             plt.plot(freqs_data, pgram_resampled, label='rescaled and resampled')
             plt.xlabel('Frequencies [1/days]')
             plt.ylabel('Power')
@@ -202,11 +342,11 @@ def tweakml_PS(lcs, spline, B, f_min = 1/300.0,psplot=False, save_figure_folder
             if save_figure_folder == None :
                 plt.show()
                 pycs3.gen.stat.plotresiduals([[noise_lcs_resampled]])
-                pycs3.gen.stat.plotresiduals([[rls]])
+                pycs3.gen.stat.plotresiduals([[ctx["rls"]]])
             else :
                 fig4.savefig(save_figure_folder + 'PS_plot_%s.png'%l.object)
                 pycs3.gen.stat.plotresiduals([[noise_lcs_resampled]], filename=save_figure_folder + 'resinoise_generated_%s.png'%l.object)
-                pycs3.gen.stat.plotresiduals([[rls]], filename=save_figure_folder + 'resinoise_original_%s.png'%l.object)
+                pycs3.gen.stat.plotresiduals([[ctx["rls"]]], filename=save_figure_folder + 'resinoise_original_%s.png'%l.object)
 
 
 
@@ -239,17 +379,20 @@ ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 POSSIBILITY OF SUCH DAMAGE.
 """
 
-def fftnoise(f):
+def fftnoise(f, rng=None):
     """
     Give me an array containing the power specrtum coefficients and I am generating noise py randomising
     the phases.
 
     :param f: 1-D array, containing the power spectrum coefficient
+    :param rng: numpy RandomState to draw the phases from, by default I use the global numpy random generator
     :return: 1-D array, containing the power spectrum coefficient with randomised phases
     """
+    if rng is None:
+        rng = np.random
     f = np.array(f, dtype='complex')
     Np = (len(f) - 1) // 2
-    phases = np.random.rand(Np) * 2 * np.pi
+    phases = rng.rand(Np) * 2 * np.pi
     phases = np.cos(phases) + 1j * np.sin(phases)
     f[1:Np + 1] *= phases
     f[-1:-1 - Np:-1] = np.conj(f[1:Np + 1])
@@ -272,7 +415,7 @@ def band_limited_noise(min_freq, max_freq, samples=1024, samplerate=1):
     f[idx] = 1
     return fftnoise(f)
 
-def band_limited_noise_withPS(freqs, PS, samples=1024, samplerate=1):
+def band_limited_noise_withPS(freqs, PS, samples=1024, samplerate=1, rng=None):
     """
     Generate noise according to a given power spectrum.
     I return a vector of size depending on the samples and sample rate.
@@ -281,10 +424,77 @@ def band_limited_noise_withPS(freqs, PS, samples=1024, samplerate=1):
     :param PS: 1-D array, power spectrum coefficients array
     :param samples: number of samples
     :param samplerate: sample rate
+    :param rng: numpy RandomState to draw the phases from, see :py:func:`fftnoise`
     :return: 1-D array containing the new power spectrum
     """
     freqs_noise = np.abs(np.fft.fftfreq(samples, 1 / samplerate))
     PS_interp = np.interp(freqs_noise, freqs, PS, left=0., right=0.)
 
     f = np.ones(samples) * PS_interp
-    return fftnoise(f)
+    return fftnoise(f, rng=rng)
+
+
+def noise_amplitudes(freqs, PS, samples, samplerate=1):
+    """
+    Amplitudes of the rfft coefficients used by :py:func:`band_limited_noise_batch`. I work on nfft >= samples points,
+    nfft being a fast FFT length, and I scale the amplitudes so that the expected standard deviation of the noise is the
+    same as for :py:func:`band_limited_noise_withPS` on samples points.
+
+    :param freqs: 1-D array, frequencies array
+    :param PS: 1-D array, power spectrum coefficients array
+    :param samples: number of samples
+    :param samplerate: sample rate
+    :return: tuple (amps, nfft)
+    """
+    nfft = spfft.next_fast_len(samples, real=True)
+    amps = np.interp(np.fft.rfftfreq(nfft, 1 / samplerate), freqs, PS, left=0., right=0.)
+    return amps * np.sqrt(nfft / samples), nfft
+
+
+def noise_std(amps, nfft):
+    """
+    Standard deviation of the signals generated by :py:func:`fftnoise_batch`. By Parseval's theorem it does not depend
+    on the random phases, so that I don't need to draw a realisation to know it.
+
+    :param amps: 1-D array, amplitudes of the rfft coefficients
+    :param nfft: integer, length of the signals
+    :return: float
+    """
+    weights = np.full(len(amps) - 1, 2.0)
+    if nfft % 2 == 0:
+        weights[-1] = 1.0  # the Nyquist frequency coefficient has no conjugate
+    return np.sqrt(np.sum(weights * np.abs(amps[1:]) ** 2)) / nfft
+
+
+def fftnoise_batch(amps, nfft, n=1, rng=None):
+    """
+    Vectorised version of :py:func:`fftnoise`. I give n sets of random phases to the rfft coefficients of amplitudes amps
+    and return the n real signals, from a single 2-D irfft.
+
+    :param amps: 1-D array, amplitudes of the rfft coefficients, of length nfft // 2 + 1
+    :param nfft: integer, length of the signals
+    :param n: integer, number of realisations
+    :param rng: numpy Generator, or seed to build one
+    :return: 2-D array of shape (n, nfft)
+    """
+    rng = np.random.default_rng(rng)
+    Np = (nfft - 1) // 2
+    specs = np.tile(np.asarray(amps, dtype=complex), (n, 1))
+    specs[:, 1:Np + 1] *= np.exp(2j * np.pi * rng.random((n, Np)))
+    return spfft.irfft(specs, n=nfft, axis=-1)
+
+
+def band_limited_noise_batch(freqs, PS, samples=1024, samplerate=1, n=1, rng=None):
+    """
+    Vectorised version of :py:func:`band_limited_noise_withPS`, I return n realisations of the noise at once.
+
+    :param freqs: 1-D array, frequencies array
+    :param PS: 1-D array, power spectrum coefficients array
+    :param samples: number of samples
+    :param samplerate: sample rate
+    :param n: integer, number of realisations
+    :param rng: numpy Generator, or seed to build one
+    :return: 2-D array of shape (n, samples)
+    """
+    amps, nfft = noise_amplitudes(freqs, PS, samples, samplerate=samplerate)
+    return fftnoise_batch(amps, nfft, n=n, rng=rng)[:, :samples]
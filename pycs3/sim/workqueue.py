@@ -0,0 +1,230 @@
+"""
+A small work queue to distribute the optimisation of simulations among several local workers.
+The queue lives in a sqlite database, so that claims are atomic, even between independent processes launched on the same simset.
+Each simulation of a simset pickle is a task. A worker claims tasks with a lease, that it has to renew (heartbeat)
+while it is working. If a worker dies, its lease expires and the task goes back to the queue.
+Gathering the results of a pickle once all its simulations are done (finalising) is leased in the same way, and the
+pickle is only marked as done once its results are written.
+"""
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import pycs3.sim.simset
+
+logger = logging.getLogger(__name__)
+
+
+class WorkQueue:
+    """
+    Queue of (simpkl, index) tasks, stored in a sqlite database.
+
+    I'm meant for workers running on the same machine : sqlite locking is not reliable on every network filesystem.
+    """
+
+    def __init__(self, dbpath, lease=900.0):
+        """
+        :param dbpath: path to the sqlite database. I create it if it does not exist.
+        :type dbpath: str
+        :param lease: duration of a claim in seconds. Without heartbeat during this time, the task is handed out again.
+        :type lease: float
+        """
+        self.dbpath = dbpath
+        self.lease = lease
+        con = self.connect()
+        con.execute("CREATE TABLE IF NOT EXISTS tasks (simpkl TEXT, idx INTEGER, status TEXT, owner TEXT, "
+                    "expires REAL, PRIMARY KEY (simpkl, idx))")
+        con.execute("CREATE TABLE IF NOT EXISTS pkls (simpkl TEXT PRIMARY KEY, nsims INTEGER, status TEXT, owner TEXT, "
+                    "expires REAL)")
+        columns = [row[1] for row in con.execute("PRAGMA table_info(pkls)")]
+        if "owner" not in columns:  # a queue created before the finalisation had a lease
+            con.execute("ALTER TABLE pkls ADD COLUMN owner TEXT")
+            con.execute("ALTER TABLE pkls ADD COLUMN expires REAL")
+        con.close()
+
+    def connect(self):
+        """
+        Returns a new connection to the database, in autocommit mode. Transactions are opened explicitly.
+        """
+        return sqlite3.connect(self.dbpath, timeout=60.0, isolation_level=None)
+
+    def populate(self, simpkls):
+        """
+        Adds one task per simulation of each pickle. Pickles already in the queue are left untouched, so that
+        you can safely call me from each worker.
+
+        :param simpkls: list of paths to the simulation files (pickles or npz)
+        :type simpkls: list
+        """
+        con = self.connect()
+        known = set(row[0] for row in con.execute("SELECT simpkl FROM pkls"))
+        for simpkl in simpkls:
+            if simpkl in known:
+                continue
+            nsims = len(pycs3.sim.simset.readsims(simpkl, verbose=False))
+            con.execute("BEGIN IMMEDIATE")
+            cur = con.execute("INSERT OR IGNORE INTO pkls VALUES (?, ?, 'todo', NULL, NULL)", (simpkl, nsims))
+            if cur.rowcount == 1:
+                con.executemany("INSERT OR IGNORE INTO tasks VALUES (?, ?, 'todo', NULL, NULL)",
+                                [(simpkl, i) for i in range(nsims)])
+            con.execute("COMMIT")
+        con.close()
+
+    def claim(self, owner, n=1):
+        """
+        Atomically claims up to n tasks, that are either waiting or whose lease has expired.
+
+        :param owner: name of the worker
+        :param n: maximum number of tasks to claim
+        :return: list of (simpkl, index) tuples, empty if nothing is left to claim.
+        """
+        con = self.connect()
+        now = time.time()
+        con.execute("BEGIN IMMEDIATE")
+        tasks = con.execute("SELECT simpkl, idx, status FROM tasks WHERE status = 'todo' OR "
+                            "(status = 'running' AND expires < ?) ORDER BY simpkl, idx LIMIT ?", (now, n)).fetchall()
+        for (simpkl, idx, status) in tasks:
+            if status == 'running':
+                logger.warning("Lease expired for simulation %i of %s, I take it over." % (idx, simpkl))
+            con.execute("UPDATE tasks SET status = 'running', owner = ?, expires = ? WHERE simpkl = ? AND idx = ?",
+                        (owner, now + self.lease, simpkl, idx))
+        con.execute("COMMIT")
+        con.close()
+        return [(simpkl, idx) for (simpkl, idx, status) in tasks]
+
+    def heartbeat(self, owner):
+        """
+        Renews the leases of all the tasks and finalisations currently held by owner.
+        """
+        con = self.connect()
+        con.execute("UPDATE tasks SET expires = ? WHERE owner = ? AND status = 'running'",
+                    (time.time() + self.lease, owner))
+        con.execute("UPDATE pkls SET expires = ? WHERE owner = ? AND status = 'finalising'",
+                    (time.time() + self.lease, owner))
+        con.close()
+
+    def complete(self, simpkl, idx, owner, onsuccess=None):
+        """
+        Marks a task as done, if owner still holds it. If its lease expired and the task was handed out to another
+        worker, I do nothing and return False : the other worker will write the result.
+
+        :param simpkl: path to the simulation file
+        :param idx: index of the simulation
+        :param owner: name of the worker
+        :param onsuccess: optional function without arguments, called only if owner still holds the task, within the same
+            transaction (so that nobody can take the task or finalise the pickle meanwhile). Typically to move the result
+            file into place.
+        :return: True if the task was marked as done.
+        """
+        con = self.connect()
+        con.execute("BEGIN IMMEDIATE")
+        held = con.execute("SELECT COUNT(*) FROM tasks WHERE simpkl = ? AND idx = ? AND owner = ? AND status = 'running'",
+                           (simpkl, idx, owner)).fetchone()[0] == 1
+        if held:
+            if onsuccess is not None:
+                try:
+                    onsuccess()
+                except Exception:
+                    con.execute("ROLLBACK")
+                    con.close()
+                    raise
+            con.execute("UPDATE tasks SET status = 'done' WHERE simpkl = ? AND idx = ?", (simpkl, idx))
+        con.execute("COMMIT")
+        con.close()
+        return held
+
+    def claimfinalise(self, simpkl, owner):
+        """
+        Claims the finalisation of simpkl with a lease, once all its tasks are done. Returns True for exactly one caller
+        (or for a new one if the lease of the previous one expired). This caller has to gather the results, and then
+        call :py:meth:`finalised`.
+
+        :param simpkl: path to the simulation file
+        :param owner: name of the worker
+        """
+        con = self.connect()
+        now = time.time()
+        con.execute("BEGIN IMMEDIATE")
+        ntodo = con.execute("SELECT COUNT(*) FROM tasks WHERE simpkl = ? AND status != 'done'", (simpkl,)).fetchone()[0]
+        claimed = False
+        if ntodo == 0:
+            cur = con.execute("UPDATE pkls SET status = 'finalising', owner = ?, expires = ? WHERE simpkl = ? AND "
+                              "(status = 'todo' OR (status = 'finalising' AND expires < ?))",
+                              (owner, now + self.lease, simpkl, now))
+            claimed = cur.rowcount == 1
+        con.execute("COMMIT")
+        con.close()
+        return claimed
+
+    def finalised(self, simpkl):
+        """
+        Marks simpkl as done, once its results are written.
+        """
+        con = self.connect()
+        con.execute("UPDATE pkls SET status = 'done' WHERE simpkl = ?", (simpkl,))
+        con.close()
+
+    def unfinalised(self):
+        """
+        Returns the list of the pickles whose tasks are all done, but that are not finalised yet.
+        """
+        con = self.connect()
+        simpkls = [row[0] for row in con.execute(
+            "SELECT simpkl FROM pkls WHERE status != 'done' AND NOT EXISTS "
+            "(SELECT 1 FROM tasks WHERE tasks.simpkl = pkls.simpkl AND tasks.status != 'done') ORDER BY simpkl")]
+        con.close()
+        return simpkls
+
+    def remaining(self):
+        """
+        Returns the number of tasks that are not done yet, plus the number of pickles that are not finalised yet.
+        """
+        con = self.connect()
+        n = con.execute("SELECT COUNT(*) FROM tasks WHERE status != 'done'").fetchone()[0]
+        n += con.execute("SELECT COUNT(*) FROM pkls WHERE status != 'done'").fetchone()[0]
+        con.close()
+        return n
+
+    def nsims(self, simpkl):
+        """
+        Returns the number of simulations in simpkl.
+        """
+        con = self.connect()
+        n = con.execute("SELECT nsims FROM pkls WHERE simpkl = ?", (simpkl,)).fetchone()[0]
+        con.close()
+        return n
+
+
+class Heartbeat:
+    """
+    Background thread renewing the leases of a worker, so that long optimisations do not lose their claim.
+    Use me as a context manager.
+    """
+
+    def __init__(self, queue, owner):
+        self.queue = queue
+        self.owner = owner
+        self.stopevent = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopevent.wait(self.queue.lease / 3.0):
+            self.queue.heartbeat(self.owner)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopevent.set()
+        self.thread.join()
+
+
+def workername():
+    """
+    Returns a name identifying the current process, for the leases.
+    """
+    return "%s:%i" % (socket.gethostname(), os.getpid())
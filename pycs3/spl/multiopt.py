@@ -20,13 +20,18 @@ opt_ml_source
 import numpy as np
 import pycs3.gen.util
 import scipy.optimize as spopt
-from pycs3.gen.polyml import polyfit
+import scipy.sparse as sps
+import scipy.sparse.linalg as spsl
+from pycs3.gen.datapoints import DataPoints
+from pycs3.gen.spl import bsplinematrix, flatmatrix
 from pycs3.gen.spl_func import r2, mltv, merge
+from pycs3.gen.splml import NoiseSplineML
+from pycs3.gen.stat import weightedmedian
 import logging
 logger = logging.getLogger(__name__)
 
 
-def opt_magshift(lcs, sourcespline=None, verbose=False, trace=False, tracedir='trace'):
+def opt_magshift(lcs, sourcespline=None, verbose=False, trace=False, tracedir='trace', method="fmin"):
     """
     If you don't give any sourcespline, this is a dirty rough magshift optimization,
     using the median mag level (without microlensing), once for all.
@@ -44,6 +49,8 @@ def opt_magshift(lcs, sourcespline=None, verbose=False, trace=False, tracedir='t
     :type sourcespline: Spline
     :param verbose: verbosity
     :type verbose: bool
+    :param method: only used with a sourcespline. "fmin" : scipy.optimize.fmin on the l1-norm of each curve. "wmedian" : the l1-optimal magshift is exactly the weighted median of the residues (with weights 1/magerrs), I compute it for all the curves at once, with a single evaluation of the spline.
+    :type method: str
     :param trace: to keep a trace of the operation
     :type trace: bool
     :param tracedir: directory to save the trace
@@ -61,7 +68,18 @@ def opt_magshift(lcs, sourcespline=None, verbose=False, trace=False, tracedir='t
         if verbose:
             logger.info("Magshift optimization done.")
 
-    else:
+    elif method == "wmedian":
+        jds = np.concatenate([l.getjds() for l in lcs])
+        residues = sourcespline.eval(jds) - np.concatenate([l.getmags() - l.magshift for l in lcs])
+        weights = 1.0 / np.concatenate([l.getmagerrs() for l in lcs])
+        groups = np.repeat(np.arange(len(lcs)), [len(l) for l in lcs])
+        magshifts = weightedmedian(residues, weights, groups)
+        for (l, magshift) in zip(lcs, magshifts):
+            l.magshift = magshift
+            if verbose:
+                logger.info("Optimal magshift of %s: %.4f" % (l, magshift))
+
+    elif method == "fmin":
 
         # for l in lcs[1:]: # We don't touch the first one.
         for l in lcs:
@@ -85,6 +103,9 @@ def opt_magshift(lcs, sourcespline=None, verbose=False, trace=False, tracedir='t
             if verbose:
                 logger.info("Magshift optimization of %s done." % l)
 
+    else:  # pragma: no cover
+        raise RuntimeError("I don't know the magshift optimisation method %s !" % method)
+
 
 def opt_source(lcs, sourcespline, dpmethod="extadj", bokit=0, bokmethod="BF", verbose=True, trace=False, tracedir = 'trace'):
     """
@@ -207,10 +228,11 @@ def opt_ml(lcs, sourcespline, bokit=0, bokmethod="BF", splflat=False, verbose=Tr
         - BF : brute force, deterministic. Call me twice
         - fminind : fminbound on one knot after the other.
         - fmin : global fminbound
+        - MCBFbatch, BFbatch : same results as MCBF and BF, but faster, all the trial positions of a knot are evaluated at once
 
     :type bokmethod: str
-    :param splflat: if you want to optimise only the border coefficient after a first optimisation
-    :type splflat: bool
+    :param splflat: if you want the spline microlensing to have flat extremas (see :py:meth:`pycs3.gen.spl.Spline.optcflat`). If True, I optimise only the border coefficients after a first optimisation (Powell). If "exact", I directly solve for all the coefficients under the flatness constraint.
+    :type splflat: bool or str
     :param verbose: verbosity
     :type verbose: bool
     :param trace: trace all the operation applied to the LightCurve
@@ -243,9 +265,11 @@ def opt_ml(lcs, sourcespline, bokit=0, bokmethod="BF", splflat=False, verbose=Tr
                 l.ml.spline.buildbounds(verbose=verbose)
                 l.ml.spline.bok(bokmethod=bokmethod, verbose=verbose)
 
-            if splflat:
+            if splflat == "exact":
+                l.ml.spline.optcflat(verbose=False, method="exact")
+            elif splflat:
                 l.ml.spline.optc()
-                l.ml.spline.optcflat(verbose=False)
+                l.ml.spline.optcflat(verbose=False, method="powell")
             else:
                 l.ml.spline.optc()
             if trace:
@@ -256,23 +280,188 @@ def opt_ml(lcs, sourcespline, bokit=0, bokmethod="BF", splflat=False, verbose=Tr
             if verbose:
                 logger.info("Working on the poly ML of %s" % l)
 
-            # We go through the curve season by season :
+            # We go through the curve season by season, each fit uses the cached design of the season :
+            residuals = sourcespline.eval(l.getjds()) - l.getmags(noml=True)
             for m in l.ml.mllist:
-                nparams = m.nfree
+                m.fit(l, residuals[m.season.indices])
+    if verbose:
+        logger.info("Done !")
 
-                mlseasjds = l.jds[m.season.indices]
-                mlseasjds -= np.mean(mlseasjds)  # Convention for polyml, jds are "centered".
-                nomlmags = l.getmags(noml=True)[m.season.indices]
-                magerrs = l.magerrs[m.season.indices]
 
-                absjds = l.getjds()[m.season.indices]
-                targetmags = sourcespline.eval(absjds)
+def stabmatrix(dp):
+    """
+    The stabilisation points of a DataPoints object are linear interpolations of the real ones (see
+    :py:meth:`pycs3.gen.datapoints.DataPoints.addgappts` and :py:meth:`pycs3.gen.datapoints.DataPoints.addextpts`).
 
-                polyparams = polyfit(mlseasjds, targetmags - nomlmags, magerrs, nparams)
+    :param dp: DataPoints object
+    :return: CSR matrix Q of shape (len(dp.jds), number of real points), so that dp.mags = Q dp.mags[dp.mask]
+    """
+    real = np.flatnonzero(dp.mask)
+    n = len(dp.jds)
+    before = np.searchsorted(real, np.arange(n), side="right") - 1  # the previous real point
+    prev = np.clip(before, 0, len(real) - 1)
+    nxt = np.clip(before + 1, 0, len(real) - 1)
+    a = dp.jds[real[prev]]
+    b = dp.jds[real[nxt]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        w = np.where(b > a, (dp.jds - a) / (b - a), 0.0)  # the extremal points just repeat the first or last one
+    rows = np.concatenate([np.arange(n), np.arange(n)])
+    return sps.csr_matrix((np.concatenate([1.0 - w, w]), (rows, np.concatenate([prev, nxt]))), shape=(n, len(real)))
+
+
+def opt_ml_source(lcs, sourcespline, dpmethod="extadj", splflat=False, verbose=True):
+    """
+    Optimises the source spline and the microlensing of all the lcs in one single sparse linear solve, at fixed time
+    shifts and fixed knots. I work with both polynomial and spline microlensing.
 
-                m.setparams(polyparams)
+    At fixed knots, the source spline and the microlensing models are linear in their coefficients, and alternating
+    :py:func:`opt_source` and :py:func:`opt_ml` converges towards the solution of a linear system. I assemble this
+    system directly : the normal equations of the source fit to the merged curves, including its stabilisation points
+    (interpolated from the data, so they follow the microlensing), and the normal equations of the fit of each
+    microlensing to the source, including the stabilisation points of the spline ML, with their weights.
+
+    .. note:: The problem is degenerate if all your curves have polynomial microlensing (a constant can go from the source to the microlensing). Leave one curve without ML.
+
+    :param lcs: list of LightCurves
+    :type lcs: list
+    :param sourcespline: source Spline object, I update its datapoints as opt_source does.
+    :type sourcespline: Spline
+    :param dpmethod: method to update the datapoints of the sourcespline, see :py:meth:`pycs3.gen.spl.Spline.updatedp`
+    :type dpmethod: str
+    :param splflat: if True, I constrain the spline microlensing to have flat extremas (see :py:meth:`pycs3.gen.spl.Spline.setcflat`), as opt_ml does.
+    :type splflat: bool
+    :param verbose: verbosity
+    :type verbose: bool
+    :return: float, final r2 of the source fit, without the stab points (as returned by opt_source).
+    """
     if verbose:
-        logger.info("Done !")
+        logger.info("Starting joint source and ML optimization ...")
+
+    # Same as merge, but I keep track of the order of the points :
+    olddp = sourcespline.datapoints
+    jds = np.concatenate([l.getjds() for l in lcs])
+    jds += olddp.deltat * np.random.randn(len(jds))
+    order = np.argsort(jds)
+    mags = np.concatenate([l.getmags() for l in lcs])
+    magerrs = np.concatenate([l.getmagerrs() for l in lcs])
+    dp = DataPoints(jds[order], mags[order], magerrs[order], splitup=False, sort=False, deltat=olddp.deltat,
+                    stab=olddp.stab, stabext=olddp.stabext, stabgap=olddp.stabgap, stabstep=olddp.stabstep,
+                    stabmagerr=olddp.stabmagerr, stabrampsize=olddp.stabrampsize, stabrampfact=olddp.stabrampfact)
+    dp.validate()
+    sourcespline.updatedp(dp, dpmethod=dpmethod)
+    (t, k) = (sourcespline.t, sourcespline.k)
+    ncs = len(t) - k - 1
+
+    # Mags of all the points of the source datapoints, from the concatenated mags of the curves :
+    n = len(jds)
+    Q = stabmatrix(dp) @ sps.csr_matrix((np.ones(n), (np.arange(n), order)), shape=(n, n))
+    A = bsplinematrix(dp.jds, t, k)
+
+    # The microlensing blocks, the rows are the concatenated points of the curves :
+    mlrows, mlcols, mlvals = [], [], []
+    stabblocks, stabmags, stabweights = [], [], []
+    srcjds = []
+    params = []  # (lightcurve, first column, number of columns, constraint matrix or None)
+    start = 0
+    ntheta = 0
+    for l in lcs:
+        B = None
+        ljds = l.getjds()
+        if (l.ml is not None) and (l.ml.mltype == "spline"):
+            l.ml.checkcompatibility(l)
+            mlspline = l.ml.spline
+            mldp = mlspline.datapoints
+            Bdp = bsplinematrix(mldp.jds, mlspline.t, mlspline.k)
+            T = None
+            if splflat:
+                T = flatmatrix(Bdp.shape[1])
+                Bdp = Bdp @ T
+            B = Bdp[np.flatnonzero(mldp.mask)]
+            stab = np.flatnonzero(np.logical_not(mldp.mask))
+            if len(stab) > 0:
+                stabblocks.append((ntheta, Bdp[stab]))
+                stabmags.append(mldp.mags[stab])
+                stabweights.append(1.0 / mldp.magerrs[stab] ** 2)
+            ljds = mldp.jds[mldp.mask] + l.getjds()[0]  # as in SplineML.settargetmags
+            params.append((l, ntheta, B.shape[1], T))
+
+        elif (l.ml is not None) and (l.ml.mltype == "poly"):
+            blocks = []
+            for m in l.ml.mllist:
+                seasjds = l.jds[m.season.indices]
+                seasjds = seasjds - np.mean(seasjds)  # Convention for polyml, jds are "centered".
+                block = np.zeros((len(l), len(m.params)))
+                block[m.season.indices] = seasjds[:, np.newaxis] ** np.arange(len(m.params))[::-1]
+                blocks.append(block)
+            B = sps.csr_matrix(np.hstack(blocks))
+            params.append((l, ntheta, B.shape[1], None))
+
+        if B is not None:
+            B = B.tocoo()
+            mlrows.append(B.row + start)
+            mlcols.append(B.col + ntheta)
+            mlvals.append(B.data)
+            ntheta += B.shape[1]
+        srcjds.append(ljds)
+        start += len(l)
+
+    Ws = sps.diags(1.0 / dp.magerrs ** 2)
+    AtW = A.T @ Ws
+    # The mags without the fitted part of the ML. The noise of a NoiseSplineML is not fitted, it stays with the data
+    # (NoiseSplineML.settargetmags subtracts it from the targets of the ML spline) :
+    nomlmags = []
+    for l in lcs:
+        lmags = l.getmags(noml=True)
+        if isinstance(l.ml, NoiseSplineML):
+            mldp = l.ml.spline.datapoints
+            lmags += l.ml.evalnoise(mldp.jds[mldp.mask])
+        nomlmags.append(lmags)
+    nomlmags = np.concatenate(nomlmags)
+
+    if ntheta == 0:
+        x = spsl.spsolve(sps.csc_matrix(AtW @ A), AtW @ (Q @ nomlmags))
+    else:
+        Bc = sps.csr_matrix((np.concatenate(mlvals), (np.concatenate(mlrows), np.concatenate(mlcols))),
+                            shape=(n, ntheta))
+        Aml = bsplinematrix(np.concatenate(srcjds), t, k)
+        BtW = Bc.T @ sps.diags(np.concatenate([1.0 / l.magerrs ** 2 for l in lcs]))
+        K22 = BtW @ Bc
+        rhs2 = -(BtW @ nomlmags)
+        for ((col, Bstab), zstab, wstab) in zip(stabblocks, stabmags, stabweights):
+            Bstab = sps.hstack([sps.csr_matrix((Bstab.shape[0], col)), Bstab,
+                                sps.csr_matrix((Bstab.shape[0], ntheta - col - Bstab.shape[1]))])
+            K22 = K22 + Bstab.T @ sps.diags(wstab) @ Bstab
+            rhs2 = rhs2 + Bstab.T @ (wstab * zstab)
+        M = sps.bmat([[AtW @ A, -(AtW @ (Q @ Bc))], [-(BtW @ Aml), K22]], format="csc")
+        x = spsl.spsolve(M, np.concatenate([AtW @ (Q @ nomlmags), rhs2]))
+
+    if not np.all(np.isfinite(x)):  # pragma: no cover
+        raise RuntimeError("The joint source and ML fit is degenerate, leave one curve without microlensing !")
+
+    sourcespline.c = np.concatenate([x[:ncs], np.zeros(k + 1)])
+    theta = x[ncs:]
+    for (l, col, ncol, T) in params:
+        p = theta[col:col + ncol]
+        if l.ml.mltype == "spline":
+            if T is not None:
+                p = T @ p
+            l.ml.spline.c = np.concatenate([p, np.zeros(l.ml.spline.k + 1)])
+        else:
+            for m in l.ml.mllist:
+                m.setparams(p[:len(m.params)].copy())
+                p = p[len(m.params):]
+
+    # The datapoints, up to date with the new microlensing :
+    sourcespline.datapoints.mags = Q @ np.concatenate([l.getmags() for l in lcs])
+    for (l, col, ncol, T) in params:
+        if l.ml.mltype == "spline":
+            l.ml.settargetmags(l, sourcespline)
+
+    sourcespline.r2(nostab=False)
+    finalr2 = sourcespline.r2(nostab=True)  # to set lastr2nostab
+    if verbose:
+        logger.info("Final r2 : %f" % finalr2)
+    return finalr2
 
 
 def redistribflux(lc1, lc2, sourcespline, verbose=True, maxfrac=0.2):
@@ -307,6 +496,8 @@ def redistribflux(lc1, lc2, sourcespline, verbose=True, maxfrac=0.2):
     def setp(flux, ind):  # flux is an absolute shift in flux for point i
         lc1.mags[ind] = -2.5 * np.log10(lc1fluxes[ind] + flux)
         lc2.mags[ind] = -2.5 * np.log10(lc2fluxes[ind] - flux)
+        lc1.datachanged()
+        lc2.datachanged()
 
     def errorfct(flux, ind):
         setp(flux, ind)
@@ -336,14 +527,14 @@ def opt_ts_indi(lcs, sourcespline, method="fmin", crit="r2", optml=False, mlsplf
     :type lcs: list
     :param sourcespline: source Spline object
     :type sourcespline: Spline
-    :param method: Choose between "fmin" for the scipy.optimize.fmin() algorithm and "brute" for brute force search.
+    :param method: Choose between "fmin" for the scipy.optimize.fmin() algorithm, "brute" for brute force search, and "gn" for the Gauss-Newton optimiser :py:func:`opt_ts_gn`, that shifts all the curves jointly.
     :type method: str
     :param crit: fitting metric
     :type crit: str
     :param optml: if you want to also optimise the microlensing
     :type optml: bool
-    :param mlsplflat: if you want to optimise only the border coefficient after a first optimisation
-    :type mlsplflat: bool
+    :param mlsplflat: if you want the spline microlensing to have flat extremas, True or "exact" (see :py:func:`opt_ml`)
+    :type mlsplflat: bool or str
     :param brutestep: step size, in days, Used if ``method`` is "brute"
     :type brutestep: float
     :param bruter: radius in number of steps
@@ -353,6 +544,12 @@ def opt_ts_indi(lcs, sourcespline, method="fmin", crit="r2", optml=False, mlsplf
 
     """
 
+    if method == "gn":
+        if crit != "r2": # pragma: no cover
+            raise RuntimeError("The Gauss-Newton optimiser only works with crit = 'r2'.")
+        opt_ts_gn(lcs, sourcespline, optml=optml, mlsplflat=mlsplflat, verbose=verbose)
+        return
+
     for l in lcs:
 
         def errorfct(timeshift):
@@ -385,3 +582,86 @@ def opt_ts_indi(lcs, sourcespline, method="fmin", crit="r2", optml=False, mlsplf
             opttimeshift = float(testvals[minindex])
 
         l.timeshift = opttimeshift
+
+
+def opt_ts_gn(lcs, sourcespline, optml=False, mlsplflat=False, maxit=30, xtol=0.01, maxstep=5.0, verbose=True):
+    """
+    Newton-like optimisation of the time shifts of all the curves at once, so that they match the spline.
+    Like :py:func:`opt_ts_indi`, I do not touch the spline.
+
+    The derivative of the r2 of a curve with respect to its time shift is given by the derivative of the spline at the
+    shifted jds (even with optml : as the microlensing is at its optimum, its own variation does not contribute).
+    So each iteration needs only one evaluation of the spline and of its derivative for all the curves, and with optml
+    a single microlensing fit per curve, instead of one for each tested shift.
+    The first step is a Gauss-Newton step. Then I estimate the curvature from the change of the derivative between
+    iterations (secant), which accounts for the microlensing absorbing part of the shift.
+    If the r2 of a curve increased, I go back halfway.
+
+    This is a local optimiser : start from shifts that are already within a few days of the optimum.
+
+    :param lcs: list of LightCurve
+    :type lcs: list
+    :param sourcespline: source Spline object
+    :type sourcespline: Spline
+    :param optml: if you want to also optimise the microlensing
+    :type optml: bool
+    :param mlsplflat: if you want the spline microlensing to have flat extremas, True or "exact" (see :py:func:`opt_ml`)
+    :type mlsplflat: bool or str
+    :param maxit: maximum number of iterations
+    :type maxit: int
+    :param xtol: I stop moving a curve once its step is smaller than this, in days
+    :type xtol: float
+    :param maxstep: maximum step, in days
+    :type maxstep: float
+    :param verbose: verbosity
+    :type verbose: bool
+
+    :return: number of iterations done
+    """
+
+    active = np.ones(len(lcs), dtype=bool)
+    prevshifts = np.full(len(lcs), np.nan)
+    prevgrads = np.full(len(lcs), np.nan)
+    prevchi2 = np.full(len(lcs), np.inf)
+    it = 0
+    for it in range(1, maxit + 1):
+        indices = np.flatnonzero(active)
+        curves = [lcs[i] for i in indices]
+        if optml:
+            opt_ml(curves, sourcespline, bokit=0, splflat=mlsplflat, verbose=False)
+
+        index = np.repeat(np.arange(len(curves)), [len(l) for l in curves])
+        weights = 1.0 / np.concatenate([l.getmagerrs() for l in curves])
+        jds = np.concatenate([l.getjds() for l in curves])
+        res = (np.concatenate([l.getmags() for l in curves]) - sourcespline.eval(jds)) * weights
+        der = sourcespline.eval(jds, der=1) * weights
+        chi2 = np.bincount(index, res * res, minlength=len(curves))
+        grads = - np.bincount(index, res * der, minlength=len(curves))
+        curvs = np.bincount(index, der * der, minlength=len(curves))  # Gauss-Newton
+        shifts = np.array([l.timeshift for l in curves])
+
+        secants = (grads - prevgrads[indices]) / (shifts - prevshifts[indices])
+        usesecant = np.isfinite(secants) & (secants > 0.0)
+        curvs[usesecant] = secants[usesecant]
+        steps = np.clip(- grads / curvs, -maxstep, maxstep)
+
+        # Where the r2 increased, we go back halfway instead :
+        worse = chi2 > prevchi2[indices]
+        steps[worse] = 0.5 * (prevshifts[indices][worse] - shifts[worse])
+        better = np.logical_not(worse)
+        prevshifts[indices[better]] = shifts[better]
+        prevgrads[indices[better]] = grads[better]
+        prevchi2[indices[better]] = chi2[better]
+
+        for (l, step) in zip(curves, steps):
+            l.timeshift += step
+        if verbose:
+            logger.info("Iteration %i : %s" % (it, " ".join(["%s %.3f" % (l.object, l.timeshift) for l in curves])))
+
+        active[indices[np.fabs(steps) < xtol]] = False
+        if not np.any(active):
+            break
+
+    if optml:
+        opt_ml(lcs, sourcespline, bokit=0, splflat=mlsplflat, verbose=False)
+    return it
@@ -11,14 +11,14 @@ The functions must return a final optimal spline. This spline object also contai
 
 from pycs3.gen.lc_func import getnicetimedelays
 from pycs3.gen.spl_func import fit
-from pycs3.spl.multiopt import opt_magshift, opt_ml, opt_source, opt_ts_indi, redistribflux
+from pycs3.spl.multiopt import opt_magshift, opt_ml, opt_ml_source, opt_source, opt_ts_indi, redistribflux
 import logging
 logger = logging.getLogger(__name__)
 
 
 def opt_rough(lcs, nit=5, shifttime=True, crit="r2",
               knotstep=100, stabext=300.0, stabgap=20.0, stabstep=4.0, stabmagerr=-2.0,
-              verbose=True):
+              method="brute", jointsolve=False, verbose=True):
     """
     Getting close to the good delays, as fast as possible : no BOK (i.e. knot positions are not free), only brute force without optml.
     Indeed with optml this tends to be unstable.
@@ -43,6 +43,10 @@ def opt_rough(lcs, nit=5, shifttime=True, crit="r2",
     :type stabstep: float
     :param stabmagerr: if negative, absolute mag err of stab points. If positive, the error bar will be stabmagerr times the median error bar of the data points.
     :type stabmagerr: float
+    :param method: time shift optimiser, "brute" (brute force, within 20 days) or "gn" (Gauss-Newton, see :py:func:`pycs3.spl.multiopt.opt_ts_gn`). "gn" is much faster but local, use it only if your initial delays are already good within a few days.
+    :type method: str
+    :param jointsolve: if True, after each time shift optimisation I fit the source and the ML at once with :py:func:`pycs3.spl.multiopt.opt_ml_source`, instead of alternating opt_source and opt_ml.
+    :type jointsolve: bool
     :param verbose: verbosity
     :type verbose: bool
 
@@ -81,10 +85,13 @@ def opt_rough(lcs, nit=5, shifttime=True, crit="r2",
 
     for it in range(nit):
         if shifttime:
-            opt_ts_indi(lcs, spline, optml=False, method="brute", crit=crit, brutestep=1.0, bruter=20, verbose=False)
-        opt_source(lcs, spline, dpmethod="extadj", bokit=0, verbose=False, trace=False)
-        opt_ml(lcs, spline, bokit=0, splflat=True, verbose=False)
-        opt_source(lcs, spline, dpmethod="extadj", bokit=0, verbose=False, trace=False)
+            opt_ts_indi(lcs, spline, optml=False, method=method, crit=crit, brutestep=1.0, bruter=20, verbose=False)
+        if jointsolve:
+            opt_ml_source(lcs, spline, dpmethod="extadj", splflat=True, verbose=False)
+        else:
+            opt_source(lcs, spline, dpmethod="extadj", bokit=0, verbose=False, trace=False)
+            opt_ml(lcs, spline, bokit=0, splflat=True, verbose=False)
+            opt_source(lcs, spline, dpmethod="extadj", bokit=0, verbose=False, trace=False)
 
         if verbose:
             logger.info("%s    (Iteration %2i, r2 = %8.1f)" % (
@@ -100,7 +107,7 @@ def opt_rough(lcs, nit=5, shifttime=True, crit="r2",
 def opt_fine(lcs, spline=None, nit=10, shifttime=True, crit="r2",
              knotstep=20, stabext=300.0, stabgap=20.0, stabstep=4.0, stabmagerr=-2.0,
              bokeps=10, boktests=10, bokwindow=None,
-             distribflux=False, splflat=True, verbose=True):
+             distribflux=False, splflat=True, method="fmin", jointsolve=False, verbose=True):
     """
     Fine approach, we assume that the timeshifts are within 10 days, and ML is optimized.
 
@@ -136,8 +143,12 @@ def opt_fine(lcs, spline=None, nit=10, shifttime=True, crit="r2",
     :type bokwindow: float
     :param distribflux: allow for flux sharing between images during the optimisation
     :type distribflux: bool
-    :param splflat: if you want to optimise only the border coefficient after a first optimisation
-    :type splflat: bool
+    :param splflat: if you want the spline microlensing to have flat extremas, True or "exact" (see :py:func:`pycs3.spl.multiopt.opt_ml`)
+    :type splflat: bool or str
+    :param method: time shift optimiser. "fmin" : brute force followed by scipy.optimize.fmin on each curve. "gn" : Gauss-Newton on all the curves at once, see :py:func:`pycs3.spl.multiopt.opt_ts_gn`. It needs much fewer microlensing fits.
+    :type method: str
+    :param jointsolve: if True, the source fits done at fixed knots after the time shift optimisations also fit the ML at once, with :py:func:`pycs3.spl.multiopt.opt_ml_source`. The BOK steps are unchanged.
+    :type jointsolve: bool
     :param verbose: verbosity
     :type verbose: bool
 
@@ -161,20 +172,27 @@ def opt_fine(lcs, spline=None, nit=10, shifttime=True, crit="r2",
         if verbose:
             logger.info("Start")
 
-        if shifttime:
+        if shifttime and method == "gn":
+            opt_ts_indi(lcs, spline, optml=True, mlsplflat=splflat, method="gn", crit=crit, verbose=False)
+            if verbose:
+                logger.info("opt_ts_indi gn done")
+
+        elif shifttime:
             opt_ts_indi(lcs, spline, optml=True, mlsplflat=splflat, method="brute", crit=crit, brutestep=0.2, bruter=10,
                         verbose=False)
             if verbose:
                 logger.info("opt_ts_indi brute done")
 
-        opt_source(lcs, spline, dpmethod="extadj", bokit=0, verbose=False, trace=False)
+            opt_source(lcs, spline, dpmethod="extadj", bokit=0, verbose=False, trace=False)
 
-        if shifttime:
             opt_ts_indi(lcs, spline, optml=True, mlsplflat=splflat, method="fmin", crit=crit, verbose=False)
             if verbose:
                 logger.info("opt_ts_indi fine done")
 
-        opt_source(lcs, spline, dpmethod="extadj", bokit=0, verbose=False, trace=False)
+        if jointsolve:
+            opt_ml_source(lcs, spline, dpmethod="extadj", splflat=splflat, verbose=False)
+        else:
+            opt_source(lcs, spline, dpmethod="extadj", bokit=0, verbose=False, trace=False)
         opt_ml(lcs, spline, bokit=1, splflat=splflat, verbose=False)
         if verbose:
             logger.info("opt_ml done")
@@ -199,9 +217,12 @@ def opt_fine(lcs, spline=None, nit=10, shifttime=True, crit="r2",
 
     for it in range(5):
         if shifttime:
-            opt_ts_indi(lcs, spline, optml=True, mlsplflat=False, method="fmin", crit=crit,
+            opt_ts_indi(lcs, spline, optml=True, mlsplflat=False, method=method, crit=crit,
                         verbose=False)
-        opt_source(lcs, spline, dpmethod="extadj", bokit=0, verbose=False, trace=False)
+        if jointsolve:
+            opt_ml_source(lcs, spline, dpmethod="extadj", splflat=False, verbose=False)
+        else:
+            opt_source(lcs, spline, dpmethod="extadj", bokit=0, verbose=False, trace=False)
         if verbose:
             logger.info("%s    (Iteration %2i, r2 = %8.1f)" % (
                 getnicetimedelays(lcs, separator=" | "), it + 1, spline.lastr2nostab))
@@ -32,7 +32,8 @@ def run_DIC(lcs, spline, fit_vector, kn, ml, optim_directory, config_file, strea
                                                 shotnoise=config.shotnoise_type, tweakml_type=config.tweakml_type,
                                                 tweakml_name=config.tweakml_name, display=config.display, verbose=False,
                                                 correction_PS_residuals=True, max_iter=config.max_iter, tolerance=tolerance,
-                                                theta_init=None)
+                                                theta_init=None, mock_bank_seed=getattr(config, 'mock_bank_seed', None),
+                                                sequential=getattr(config, 'sequential', False))
 
     chain = dic_opt.optimise()
     dic_opt.analyse_plot_results()
@@ -51,7 +52,7 @@ def run_DIC(lcs, spline, fit_vector, kn, ml, optim_directory, config_file, strea
     for k in range(len(lcs)):
         def tweakml_PS_NUMBER(lcs, spline):
             return twk.tweakml_PS(lcs, spline, B_PARAM, f_min=1 / 300.0, psplot=False, verbose=False,
-                                  interpolation='linear', A_correction=A_PARAM)
+                                  interpolation='linear', A_correction=A_PARAM, context=tweak_context)
 
         ut.write_func_append(tweakml_PS_NUMBER, stream,
                              B_PARAM=str(B_best[k][0]), NUMBER=str(k + 1), A_PARAM=str(A[k]))
@@ -147,6 +148,7 @@ def main(lensname, dataname, work_dir='./'):
                     print('If you use PS_from_residuals, the shotnoise should be set to None. I will do it for you !')
                     config.shotnoise_type = None
 
+                f.write('tweak_context = twk.TweakContext() \n')  # periodograms of the data, shared by all the mocks
                 if config.find_tweak_ml_param == True:
                     if config.optimiser == 'DIC':
                         run_DIC(lcs, spline, fit_vector, kn, ml, optim_directory, config_file, f)
@@ -158,7 +160,7 @@ def main(lensname, dataname, work_dir='./'):
                     for k in range(len(lcs)):
                         def tweakml_PS_NUMBER(lcs, spline):
                             return twk.tweakml_PS(lcs, spline, B_PARAM, f_min=1 / 300.0, psplot=False, verbose=False,
-                                                  interpolation='linear')
+                                                  interpolation='linear', context=tweak_context)
 
                         ut.write_func_append(tweakml_PS_NUMBER, f,
                                              B_PARAM=str(config.PS_param_B[k]), NUMBER=str(k + 1))
@@ -10,39 +10,29 @@ import logging
 import os
 import pickle as pkl
 import sys
-import time
 
 import numpy as np
 import pycs3.gen.lc_func
 import pycs3.gen.util
 import pycs3.sim.run
-from multiprocess import Pool, cpu_count
+from multiprocess import cpu_count
 
 loggerformat='PID %(process)06d | %(asctime)s | %(levelname)s: %(name)s(%(funcName)s): %(message)s'
 logging.basicConfig(format=loggerformat,level=logging.WARNING)
 
-def exec_worker_copie_aux(args):
-    return exec_worker_copie(*args)
+def exec_worker_copie(nworkers, simset_copy, lcs, simoptfct, kwargs_optim, optset, tsrand, destpath):
+    print("starting %i workers..." % nworkers)
+    success_list = pycs3.sim.run.queuerun(simset_copy, lcs, simoptfct, kwargs_optim=kwargs_optim,
+                                          optset=optset, tsrand=tsrand, destpath=destpath, nworkers=nworkers)
+    return success_list
 
 
-def exec_worker_copie(i, simset_copy, lcs, simoptfct, kwargs_optim, optset, tsrand, destpath):
-    print("worker %i starting..." % i)
-    time.sleep(i)
-    sucess_dic = pycs3.sim.run.multirun(simset_copy, lcs, simoptfct, kwargs_optim=kwargs_optim,
-                                       optset=optset, tsrand=tsrand, destpath=destpath)
-    return sucess_dic
-
-
-def exec_worker_mocks_aux(args):
-    return exec_worker_mocks(*args)
-
-
-def exec_worker_mocks(i, simset_mock, lcs, simoptfct, kwargs_optim, optset, tsrand, destpath):
-    print("worker %i starting..." % i)
-    time.sleep(i)
-    sucess_dic = pycs3.sim.run.multirun(simset_mock, lcs, simoptfct, kwargs_optim=kwargs_optim,
-                                       optset=optset, tsrand=tsrand, keepopt=True, destpath=destpath)
-    return sucess_dic
+def exec_worker_mocks(nworkers, simset_mock, lcs, simoptfct, kwargs_optim, optset, tsrand, destpath):
+    print("starting %i workers..." % nworkers)
+    success_list = pycs3.sim.run.queuerun(simset_mock, lcs, simoptfct, kwargs_optim=kwargs_optim,
+                                          optset=optset, tsrand=tsrand, keepopt=True, destpath=destpath,
+                                          nworkers=nworkers)
+    return success_list
 
 
 def write_report_optimisation(f, success_dic):
@@ -112,23 +102,14 @@ def main(lensname, dataname, work_dir='./'):
 
                 if config.run_on_copies:
                     print("I will run the optimiser on the copies with the parameters :", kwargs)
-                    p = Pool(nworkers)
                     if config.simoptfctkw == "spl1":
-                        job_args = [
-                            (j, config.simset_copy, lcs, config.simoptfct, kwargs, opts, config.tsrand, destpath) for j
-                            in
-                            range(nworkers)]
-                        success_list_copies = p.map(exec_worker_copie_aux, job_args)
-                        p.close()
-                        p.join()
+                        success_list_copies = exec_worker_copie(nworkers, config.simset_copy, lcs, config.simoptfct,
+                                                                kwargs, opts, config.tsrand, destpath)
 
                     elif config.simoptfctkw == "regdiff":
                         if a == 0 and b == 0:  # for copies, run on only 1 (knstp,mlknstp) as it the same for others
-                            job_args = (
-                            0, config.simset_copy, lcs, config.simoptfct, kwargs, opts, config.tsrand, destpath)
-                            success_list_copies = exec_worker_copie_aux(job_args)
-                            success_list_copies = [
-                                success_list_copies]  # we hace to turn it into a list to match spl format
+                            success_list_copies = exec_worker_copie(1, config.simset_copy, lcs, config.simoptfct,
+                                                                    kwargs, opts, config.tsrand, destpath)
                             dir_link = os.path.join(destpath, "sims_%s_opt_%s" % (config.simset_copy, opts))
                             print("Dir link :", dir_link)
                             pkl.dump(dir_link, open(
@@ -141,17 +122,9 @@ def main(lensname, dataname, work_dir='./'):
 
                 if config.run_on_sims:
                     print("I will run the optimiser on the simulated lcs with the parameters :", kwargs)
-                    p = Pool(nworkers)
-                    job_args = [(j, config.simset_mock, lcs, config.simoptfct, kwargs, opts, config.tsrand, destpath) for j in range(nworkers)]
-                    """
-                    Serial version of this code :
-                        job_args = (0, config.simset_mock, lcs, config.simoptfct, kwargs, opts, config.tsrand, destpath)
-                        success_list_simu = exec_worker_mocks_aux(job_args)  # if regdiff uses another level of parallelism.
-                        success_list_simu = [success_list_simu]# p.map(exec_worker_copie_aux, job_args)
-                    """
-                    success_list_simu = p.map(exec_worker_mocks_aux, job_args)
-                    p.close()
-                    p.join()
+                    # use nworkers = 1 if regdiff uses another level of parallelism.
+                    success_list_simu = exec_worker_mocks(nworkers, config.simset_mock, lcs, config.simoptfct, kwargs,
+                                                          opts, config.tsrand, destpath)
                     f.write('SIMULATIONS, kn%i, %s%i, optimiseur %s : \n' % (kn, string_ML, ml, kwargs['name']))
                     write_report_optimisation(f, success_list_simu)
                     f.write('################### \n')
@@ -87,6 +87,8 @@ PS_param_B = [[1.0],[1.0],[1.0]] #if you don't want the algorithm fine tune the
 optimiser = 'DIC' # dichotomic optimiser, only DIC is available for the moment
 n_curve_stat =16# Number of curve to compute the statistics on, (the larger the better but it takes longer... 16 or 32 are good, 8 is still OK) .
 max_iter = 15 # this is used in the DIC optimiser, 10 is usually enough.
+mock_bank_seed = None # set an integer to reuse the same mock noise realisations for all the tested parameters (common random numbers), you can then use a smaller n_curve_stat.
+sequential = False # set to True to stop drawing mock curves as soon as the optimiser knows in which direction to go, n_curve_stat is then a maximum.
 
 
 ###### SPLINE MARGINALISATION #########
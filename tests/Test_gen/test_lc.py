@@ -5,6 +5,7 @@ import numpy as np
 import pytest
 import unittest
 import glob
+import time
 import matplotlib.pyplot as plt
 
 from tests import TEST_PATH
@@ -175,6 +176,109 @@ class TestLightCurve(unittest.TestCase):
         lc_func.objsort(lc_copy, ret=False)
         lc_copy[0].shiftflux(0.1)
 
+    def test_getmags_cache(self):
+        lcs, spline = pycs3.gen.util.readpickle(os.path.join(self.path, 'data', "optcurves.pkl"))
+        lc = lcs[1]
+        pycs3.gen.polyml.addtolc(lcs[0], nparams=2)
+        for l in [lcs[0], lc]:
+            def ref():
+                return l.mags + l.calcfluxshiftmags() + l.magshift + l.ml.calcmlmags(l)
+            assert_array_equal(l.getmags(), ref())
+            if l.ml.mltype == "poly":
+                l.ml.setfreeparams(l.ml.getfreeparams() + 0.01)
+            else:
+                l.ml.spline.c = l.ml.spline.c + 0.01
+            assert_allclose(l.getmags(), ref())
+            l.mags += 0.1
+            l.shiftmag(0.2)
+            l.setfluxshift(100.0)
+            assert_allclose(l.getmags(), ref())
+            l.mags[0] += 1.0  # item assignments are detected
+            assert_allclose(l.getmags(), ref())
+            l.jds[0] -= 1.0
+            assert_allclose(l.getmags(), ref())
+            if l.ml.mltype == "spline":
+                l.ml.spline.shifttime(1.0)  # changes the datapoints jds in place
+                assert_allclose(l.getmags(), ref())
+            buf = np.empty(len(l))
+            l.getmags(out=buf)
+            assert_allclose(buf, ref())
+            l.getjds(out=buf)
+            assert_allclose(buf, l.jds + l.timeshift)
+            assert_allclose(l.copy().getmags(), ref())
+
+        # Microbenchmark, unchanged parameters :
+        lc.fluxshift = 0.0
+        t0 = time.time()
+        for i in range(1000):
+            lc.getmags()
+        t1 = time.time()
+        for i in range(1000):
+            lc.mags + lc.magshift + lc.ml.calcmlmags(lc)
+        print("cached getmags : %.2e s, uncached : %.2e s" % ((t1 - t0) / 1000.0, (time.time() - t1) / 1000.0))
+
+    def test_lightcopy(self):
+        lcs, spline = pycs3.gen.util.readpickle(os.path.join(self.path, 'data', "optcurves.pkl"))
+        orig = lcs[1]
+        orig.properties = [{"fwhm": float(i)} for i in range(len(orig))]
+        orig.residuals = np.zeros(len(orig))
+        ref = orig.copy()
+        copy = orig.copy(light=True)
+        assert_array_equal(copy.getmags(), orig.getmags())
+        assert_array_equal(copy.getjds(), orig.getjds())
+        assert np.shares_memory(copy.jds, orig.jds) and not copy.jds.flags.writeable
+
+        # Modify everything we can on the copy :
+        copy.shifttime(5.0)
+        copy.shiftmag(0.1)
+        copy.setfluxshift(50.0)
+        copy.mags += 0.2
+        copy.mags[3] = 0.0
+        copy.mask[5] = False
+        copy.residuals += 1.0
+        copy.properties[0]["fwhm"] = -1.0
+        copy.labels[0] = "copy"
+        copy.commentlist.append("copy")
+        copy.ml.spline.c = copy.ml.spline.c + 0.1
+        copy.ml.spline.datapoints.mags += 0.1
+        with pytest.raises(ValueError):
+            copy.jds[0] = 0.0  # shared arrays are read-only in the copy
+        copy.applytimeshift()
+        with pytest.raises(ValueError):
+            copy.magerrs *= 2.0
+        copy.magerrs = copy.magerrs * 2.0
+        copy.cutmask()
+        copy.montecarlojds(amplitude=0.1, seed=1)
+
+        for attr in ["jds", "mags", "magerrs", "mask", "residuals", "labels", "commentlist", "timeshift", "magshift",
+                     "fluxshift"]:
+            assert_array_equal(getattr(orig, attr), getattr(ref, attr))
+        assert orig.properties == ref.properties
+        assert_array_equal(orig.ml.spline.c, ref.ml.spline.c)
+        assert_array_equal(orig.ml.spline.datapoints.mags, ref.ml.spline.datapoints.mags)
+        assert_array_equal(orig.getmags(), ref.getmags())
+
+        # And the other way round, the original does not modify its copies :
+        copy = orig.copy(light=True)
+        orig.properties[1]["fwhm"] = -1.0
+        orig.mags = orig.mags + 1.0
+        assert copy.properties[1]["fwhm"] == 1.0
+        assert_array_equal(copy.mags, ref.mags)
+
+        # The original curve stays writable :
+        orig.jds[0] += 0.0
+        orig.magerrs *= 1.0
+        assert orig.jds.flags.writeable and orig.magerrs.flags.writeable
+
+        # Pickles and deep copies of light copies are independent curves :
+        pklpath = os.path.join(self.outpath, "lightcopy.pkl")
+        pycs3.gen.util.writepickle(orig.copy(light=True), pklpath)
+        for copy in [pycs3.gen.util.readpickle(pklpath), orig.copy(light=True).copy()]:
+            copy.jds[0] += 1.0
+            copy.properties[2]["fwhm"] = -1.0
+            assert copy.jds[0] != orig.jds[0]
+            assert orig.properties[2]["fwhm"] == 2.0
+
     def test_timeshifts(self):
         lc_copy = [lc.copy() for lc in self.lcs]
         lc_copy2 = [lc.copy() for lc in self.lcs]
@@ -279,6 +383,36 @@ class TestLightCurve(unittest.TestCase):
         lc_interp2.plotcolour = 'purple'
         lc_func.display([lc0,lc1,lc_interp,lc_interp2], [], filename=os.path.join(self.outpath, 'test_interp_nearest.png'))
 
+        # Same result as the brute force nearest neighbour and as np.interp :
+        ref = np.array([lc1.mags[lc_func.find_closest(jd, lc1.jds)[1]] for jd in lc0.jds])
+        assert_array_equal(lc_interp.mags, ref)
+        assert_array_equal(lc_interp2.mags, np.interp(lc0.jds, lc1.jds, lc1.mags, left=0., right=0.))
+
+        # Unsorted times with duplicates, and a stack of curves resampled at once :
+        rng = np.random.default_rng(1)
+        xp = np.round(rng.uniform(0, 10, 40), 1)
+        fp = rng.normal(size=(3, 40))
+        x = np.round(rng.uniform(-1, 11, 100), 1)
+        ref = np.array([[f[lc_func.find_closest(a, xp)[1]] for a in x] for f in fp])
+        assert_array_equal(lc_func.resample(x, xp, fp, interpolate='nearest'), ref)
+        xs = np.unique(xp)
+        fs = rng.normal(size=(3, len(xs)))
+        ref = np.array([np.interp(x, xs, f, left=0., right=0.) for f in fs])
+        assert_allclose(lc_func.resample(x, xs, fs, interpolate='linear'), ref, rtol=1e-12, atol=1e-12)
+
+        # Microbenchmark on a 15-year curve, with a noise sampled 5 times per day :
+        jds = np.sort(rng.uniform(0, 15 * 365, 1800))
+        xp = np.linspace(-10, 15 * 365 + 10, 15 * 365 * 5)
+        fp = rng.normal(size=(20, len(xp)))
+        t0 = time.time()
+        ref = np.array([fp[0][lc_func.find_closest(jd, xp)[1]] for jd in jds])
+        t1 = time.time()
+        assert_array_equal(lc_func.resample(jds, xp, fp[0]), ref)
+        t2 = time.time()
+        lc_func.resample(jds, xp, fp, interpolate='linear')
+        print("nearest resampling, loop : %.2e s, searchsorted : %.2e s, 20 linear resamplings at once : %.2e s"
+              % (t1 - t0, t2 - t1, time.time() - t2))
+
     def clean_trace(self):
         pkls = glob.glob(os.path.join(self.outpath, "??????.pkl"))
         for pkl in pkls:
@@ -2,14 +2,20 @@ import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import os
+import time
 import pytest
 import unittest
 from tests import TEST_PATH
 import pycs3.gen.lc_func as lc_func
 import pycs3.gen.mrg as mrg
 import pycs3.gen.spl_func as spl_func
+import pycs3.gen.util
+import pycs3.gen.splml
+import pycs3.spl.multiopt
+import scipy.interpolate as si
 from pycs3.gen.datapoints import DataPoints
-from numpy.testing import assert_almost_equal
+from pycs3.gen.spl import Spline
+from numpy.testing import assert_almost_equal, assert_allclose
 import numpy as np
 import copy
 
@@ -90,5 +96,131 @@ class TestDatapoints(unittest.TestCase):
         r2 = myspline.r2(nostab=True)
         print(r2)
 
+    def test_bandedlsq(self):
+        np.random.seed(1)  # DataPoints jitters the jds
+        spline = spl_func.fit(copy.deepcopy(self.lcs), bokmethod='BF')
+        np.random.seed(1)
+        bspline = spl_func.fit(copy.deepcopy(self.lcs), bokmethod='BF', bandedlsq=True)
+        assert_allclose(bspline.t, spline.t, atol=1e-6)
+        assert_allclose(bspline.c, spline.c, rtol=1e-6, atol=1e-8)
+        assert_almost_equal(bspline.r2(), spline.r2(), decimal=5)
+        assert_almost_equal(bspline.r2(nostab=False), spline.r2(nostab=False), decimal=5)
+
+        # After a change of the datapoints, the engine has to follow :
+        for s in [spline, bspline]:
+            s.datapoints.magerrs[100:110] *= 2.0
+            s.datapoints.mags[200:300] += 0.1
+        assert_almost_equal(bspline.optc(), spline.optc(), decimal=5)
+        assert_allclose(bspline.c, spline.c, rtol=1e-6, atol=1e-8)
+
+        # Benchmark on a larger synthetic curve
+        rng = np.random.RandomState(1)
+        jds = np.sort(rng.uniform(0.0, 8000.0, 4000))
+        mags = np.sin(jds / 50.0) + 0.01 * rng.randn(len(jds))
+        for bandedlsq in [False, True]:
+            dp = DataPoints(jds.copy(), mags.copy(), 0.01 * np.ones(len(jds)), splitup=True, sort=True, stab=False)
+            s = Spline(dp, bandedlsq=bandedlsq)
+            s.uniknots(20, n=False)
+            s.optc()
+            s.datapoints.mags[:10] += 0.01
+            t0 = time.time()
+            for i in range(20):
+                s.optc()
+            print("bandedlsq = %s : %.2e s per optc" % (bandedlsq, (time.time() - t0) / 20.0))
+
+
+    def test_basiscache(self):
+        lcs, spline = pycs3.gen.util.readpickle(os.path.join(self.path, "data", "optcurves.pkl"))
+        s = spline.copy()
+
+        def splev(nostab=True):
+            jds = s.datapoints.jds[s.datapoints.mask] if nostab else s.datapoints.jds
+            return si.splev(jds, (s.t, s.c, s.k))
+
+        for nostab in [True, False]:
+            assert_allclose(s.eval(nostab=nostab), splev(nostab), rtol=1e-12, atol=1e-12)
+        assert s.basiscache is not None
+        x = np.linspace(s.t[0], s.t[-1], int((s.t[-1] - s.t[0]) * 5))
+        assert_allclose(s.tv(), np.sum(np.fabs(np.diff(si.splev(x, (s.t, s.c, s.k))))), rtol=1e-12)
+
+        # The cache follows the changes of coeffs, knots and datapoints :
+        s.c[10] += 0.1
+        assert_allclose(s.eval(), splev(), rtol=1e-12, atol=1e-12)
+        s.shifttime(10.0)
+        assert_allclose(s.eval(nostab=False), splev(False), rtol=1e-12, atol=1e-12)
+        s.setintt(s.getintt()[::2])
+        s.optc()
+        assert_allclose(s.eval(), splev(), rtol=1e-12, atol=1e-12)
+        assert_allclose(s.r2(), np.sum(((s.datapoints.mags - splev(False)) / s.datapoints.magerrs)[s.datapoints.mask] ** 2))
+        s.updatedp(spl_func.merge(lcs, olddp=s.datapoints), dpmethod="extadj")
+        assert_allclose(s.eval(), splev(), rtol=1e-12, atol=1e-12)
+        assert s.copy().basiscache is None
+
+        # Benchmark on the merged curves and on a spline ML :
+        pycs3.gen.splml.addtolc(lcs[1], n=5)
+        lcs[1].ml.spline.c[:5] = 0.1
+        for (name, sp) in [("source", spline), ("ML", lcs[1].ml.spline)]:
+            t0 = time.time()
+            for i in range(1000):
+                si.splev(sp.datapoints.jds[sp.datapoints.mask], (sp.t, sp.c, sp.k))
+            t1 = time.time()
+            for i in range(1000):
+                sp.eval()
+            print("%s spline, %i points : splev %.2e s, cached basis %.2e s" % (name, len(sp.datapoints.jds),
+                                                                               (t1 - t0) / 1000, (time.time() - t1) / 1000))
+        assert_allclose(lcs[1].ml.calcmlmags(lcs[1]), si.splev(lcs[1].ml.spline.datapoints.jds[lcs[1].ml.spline.datapoints.mask],
+                                                              (lcs[1].ml.spline.t, lcs[1].ml.spline.c, 3)), atol=1e-12)
+
+    def test_optcflat(self):
+        lcs, spline = pycs3.gen.util.readpickle(os.path.join(self.path, "data", "optcurves.pkl"))
+        r2s = {}
+        for method in ["powell", "exact"]:
+            s = spline.copy()
+            if method == "powell":
+                s.optc()
+            t0 = time.time()
+            r2s[method] = s.optcflat(method=method)
+            print("optcflat %s : %.3f s, r2 = %.6f" % (method, time.time() - t0, r2s[method]))
+            c = s.getc(m=0)
+            assert_allclose(c[[0, -1]], c[[1, -2]])
+            assert_allclose(r2s[method], s.r2(nostab=False))
+        assert r2s["exact"] <= r2s["powell"] * (1 + 1e-9)
+
+        # Same on a spline microlensing, as in opt_ml :
+        pycs3.gen.splml.addtolc(lcs[1], n=5)
+        lcs[1].ml.settargetmags(lcs[1], spline)
+        ml = lcs[1].ml.spline
+        t0 = time.time()
+        for i in range(20):
+            mle = ml.copy()
+            r2exact = mle.optcflat(method="exact")
+        t1 = time.time()
+        for i in range(20):
+            mlp = ml.copy()
+            mlp.optc()
+            r2powell = mlp.optcflat(method="powell")
+        print("ML spline : optcflat exact %.2e s, optc + optcflat powell %.2e s" % ((t1 - t0) / 20, (time.time() - t1) / 20))
+        assert r2exact <= r2powell * (1 + 1e-9)
+        assert_allclose(mle.c[0], mle.c[1])
+
+        pycs3.spl.multiopt.opt_ml(lcs, spline, splflat="exact", verbose=False)
+        assert_allclose(lcs[1].ml.spline.c, mle.c)
+
+    def test_bokbatch(self):
+        lcs, spline = pycs3.gen.util.readpickle(os.path.join(self.path, "data", "optcurves.pkl"))
+        for (bokmethod, batchmethod) in [("BF", "BFbatch"), ("MCBF", "MCBFbatch")]:
+            results = []
+            for method in [bokmethod, batchmethod]:
+                np.random.seed(1)
+                s = spl_func.fit(copy.deepcopy(lcs), bokit=0, boktests=10, verbose=False)
+                s.buildbounds(verbose=False)
+                t0 = time.time()
+                r2 = s.bok(bokmethod=method, verbose=False)
+                print("BOK-%s : %.3f s" % (method, time.time() - t0))
+                results.append((s.t, r2))
+            assert_allclose(results[1][0], results[0][0])
+            assert_almost_equal(results[1][1], results[0][1], decimal=5)
+
+
 if __name__ == '__main__':
     pytest.main()
@@ -12,7 +12,8 @@ import pycs3.gen.lc_func as lc_func
 import pycs3.gen.polyml
 import pycs3.gen.splml
 from tests import utils
-from numpy.testing import assert_almost_equal
+import numpy as np
+from numpy.testing import assert_almost_equal, assert_allclose, assert_array_equal
 
 class TestStat(unittest.TestCase):
     def setUp(self):
@@ -48,11 +49,58 @@ class TestStat(unittest.TestCase):
         stat.sf(self.lcs_WFI[0])
         stat.sf(self.lcs_WFI[0],ssf=True)
 
+        # The binned version against the brute force pairs :
+        l = self.lcs_WFI[0]
+        out = stat.sfbinned(l, bins=20, quantiles=[0.1, 0.5, 0.9], chunksize=30, plot=True,
+                            filename=os.path.join(self.outpath, 'sfbinned.png'))
+        jds, mags = l.getjds(), l.getmags()
+        dt = (jds[np.newaxis, :] - jds[:, np.newaxis]).ravel()
+        dm = (mags[np.newaxis, :] - mags[:, np.newaxis]).ravel()
+        dt, dm = dt[dt > 0], dm[dt > 0]
+        ibin = np.searchsorted(out["edges"], dt, side='right') - 1
+        assert_array_equal(out["counts"], np.bincount(ibin, minlength=20))
+        full = out["counts"] > 0
+        assert_allclose(out["dt"][full], [np.mean(dt[ibin == i]) for i in np.flatnonzero(full)], rtol=1e-10)
+        assert_allclose(out["sf"][full], [np.sqrt(np.mean(dm[ibin == i] ** 2)) for i in np.flatnonzero(full)], rtol=1e-8)
+        assert np.all(np.diff(out["quantiles"][:, full], axis=0) >= 0)
+
+        # Quantiles, precise to the width of the magnitude bins for well populated bins :
+        rng = np.random.default_rng(0)
+        lc = lc_func.factory(np.sort(rng.uniform(0, 5500, 1000)), np.cumsum(rng.normal(0, 0.01, 1000)))
+        out = stat.sfbinned(lc, bins=10, quantiles=[0.1, 0.5, 0.9], magbins=500, chunksize=100)
+        jds, mags = lc.getjds(), lc.getmags()
+        dt = (jds[np.newaxis, :] - jds[:, np.newaxis]).ravel()
+        dm = (mags[np.newaxis, :] - mags[:, np.newaxis]).ravel()
+        dt, dm = dt[dt > 0], dm[dt > 0]
+        ibin = np.searchsorted(out["edges"], dt, side='right') - 1
+        ref = np.array([np.quantile(np.abs(dm[ibin == i]), [0.1, 0.5, 0.9]) for i in range(10)]).T
+        assert_allclose(out["quantiles"], ref, atol=np.ptp(mags) / 500.)
+
+        outs = stat.sfbinned_multi([self.lcs_WFI[0], lc], ncpu=2, bins=10)
+        assert_allclose(outs[1]["sf"], out["sf"])
+        outs = stat.sfbinned_multi(self.lcs_WFI, ncpu=1, bins=20)
+        assert_allclose(outs[0]["sf"], stat.sfbinned(l, bins=20)["sf"])
+
     def test_mad(self):
         mags = self.lcs_WFI[0].mags
         mad1 = stat.mad(mags)
         assert_almost_equal(mad1,0.11140650000000107)
 
+    def test_weightedmedian(self):
+        mags = self.lcs_WFI[0].mags
+        assert_almost_equal(stat.weightedmedian(mags, np.ones(len(mags))), np.median(mags))
+        assert_almost_equal(stat.weightedmedian(mags[:-1], np.ones(len(mags) - 1)), np.median(mags[:-1]))
+        assert stat.weightedmedian([1.0, 2.0, 3.0], [1.0, 1.0, 5.0]) == 3.0
+
+        # Several groups at once, and the l1 optimality :
+        weights = 1.0 / self.lcs_WFI[0].magerrs
+        groups = np.arange(len(mags)) % 3
+        wmeds = stat.weightedmedian(mags, weights, groups)
+        for i in range(3):
+            assert wmeds[i] == stat.weightedmedian(mags[groups == i], weights[groups == i])
+            cost = lambda x: np.sum(weights[groups == i] * np.abs(mags[groups == i] - x))
+            assert cost(wmeds[i]) <= min(cost(wmeds[i] - 1e-4), cost(wmeds[i] + 1e-4))
+
 
     def test_residuals(self):
         wfi_copy = [lc.copy() for lc in self.lcs_WFI]
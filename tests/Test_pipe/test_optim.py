@@ -4,6 +4,8 @@ import matplotlib.pyplot as plt
 import os
 import pytest
 import unittest
+import numpy as np
+from numpy.testing import assert_array_equal
 
 from tests import TEST_PATH
 import pycs3.gen.polyml
@@ -65,6 +67,59 @@ class TestOptim(unittest.TestCase):
 
         assert chi2 < 13
 
+    def testoptim_pool(self):
+        pycs3.sim.draw.saveresiduals(self.lcs, self.spline)
+        fit_vector = pycs3.pipe.optimiser.get_fit_vector(self.lcs, self.spline)
+        dic_opt = pycs3.pipe.optimiser.DicOptimiser(self.lcs, fit_vector, self.spline, attachml, 200,
+                                                    knotstep=20, savedirectory=self.outpath,
+                                                    recompute_spline=False, max_core=2, n_curve_stat=4,
+                                                    tweakml_type='PS_from_residuals', display=False,
+                                                    correction_PS_residuals=False, max_iter=1,
+                                                    theta_init=[[0.2], [0.2], [0.2], [0.2]], debug=False)
+        theta = [[0.2], [0.2], [0.2], [0.2]]
+        _, _, _, _, zruns, _ = dic_opt.make_mocks_para(theta)
+        pool = dic_opt.pool
+        dic_opt.make_mocks_para(theta)
+        assert dic_opt.pool is pool  # the same pool is reused
+        assert len(set(zruns[:, 0])) == len(zruns)  # each job draws different mocks
+        dic_opt.close_pool()
+        assert dic_opt.pool is None
+
+    def testoptim_mock_bank(self):
+        for l in self.lcs:
+            pycs3.gen.splml.addtolc(l, n=2)
+        pycs3.sim.draw.saveresiduals(self.lcs, self.spline)
+        fit_vector = pycs3.pipe.optimiser.get_fit_vector(self.lcs, self.spline)
+        dic_opt = pycs3.pipe.optimiser.DicOptimiser(self.lcs, fit_vector, self.spline, attachml, 200,
+                                                    knotstep=20, savedirectory=self.outpath,
+                                                    recompute_spline=False, n_curve_stat=3,
+                                                    correction_PS_residuals=False, debug=True, mock_bank_seed=1)
+        zruns = dic_opt.make_mocks([[0.3], [0.3], [0.3], [0.3]])[4]
+        zruns2 = dic_opt.make_mocks([[0.3], [0.3], [0.3], [0.3]])[4]
+        zruns3 = dic_opt.make_mocks([[0.4], [0.4], [0.4], [0.4]])[4]
+        assert_array_equal(zruns, zruns2)  # same mocks for the same parameters
+        assert not np.array_equal(zruns, zruns3)
+
+    def testoptim_sequential(self):
+        for l in self.lcs:
+            pycs3.gen.splml.addtolc(l, n=2)
+        pycs3.sim.draw.saveresiduals(self.lcs, self.spline)
+        fit_vector = pycs3.pipe.optimiser.get_fit_vector(self.lcs, self.spline)
+        dic_opt = pycs3.pipe.optimiser.DicOptimiser(self.lcs, fit_vector, self.spline, attachml, 200,
+                                                    knotstep=20, savedirectory=self.outpath,
+                                                    recompute_spline=False, n_curve_stat=12,
+                                                    correction_PS_residuals=False, debug=True, mock_bank_seed=1,
+                                                    sequential=True, sequential_batch=3)
+        dic_opt.compute_chi2([[0.5], [0.5], [0.5], [0.5]])  # far from the target zruns
+        assert dic_opt.nmocks_last < 12
+
+        zruns = np.array([[-1., 0.], [1., 0.2], [0., 0.1]])
+        sigmas = np.ones((3, 2))
+        dic_opt.fit_vector = np.array([[5., 1.], [0.1, 1.]])
+        assert not dic_opt.is_settled(zruns, sigmas)  # the side of the second curve is unknown
+        dic_opt.fit_vector = np.array([[5., 1.], [1., 1.]])
+        assert dic_opt.is_settled(zruns, sigmas)
+
 
 if __name__ == '__main__':
     pytest.main()
@@ -7,6 +7,15 @@ import time
 from tests import TEST_PATH
 import pycs3.gen.mrg as mrg
 import pycs3.gen.lc_func as lc_func
+import pycs3.regdiff.rslc
+import pycs3.regdiff.multiopt
+import pycs3.regdiff.kalmangp as kalmangp
+import pycs3.regdiff.scikitgp as scikitgp
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import ConstantKernel, Matern, WhiteKernel
+import shutil
+import numpy as np
+import scipy.optimize as spopt
 from tests import utils
 from numpy.testing import assert_allclose
 
@@ -75,6 +84,122 @@ class TestRegdiff(unittest.TestCase):
         exec_time = time.time() - start
         print("Took %2.6f seconds for pd = %2.1f"%(exec_time, regdiff_param['pd'])) #takes 2.07 seconds on my laptop
 
+    def test_vectorised(self):
+        lc_copy = [lc.copy() for lc in self.lcs]
+        lc_func.settimeshifts(lc_copy, shifts=[0, -5, -20, -60], includefirst=True)  # intial guess
+        rss = [pycs3.regdiff.rslc.factory(l, pd=1) for l in lc_copy]
+
+        # The vectorised wtvdiffs against the Rslc subtraction, including the edges of the overlap :
+        for method in ["weights", "simple"]:
+            shifts = np.array([-300.3, -5.0, 0.0, 0.37, 13.25])
+            wtvs = []
+            for shift in shifts:
+                rs1 = rss[0].copy()
+                rs1.timeshift = shift
+                wtvs.append(pycs3.regdiff.rslc.wtvdiff(rs1, rss[1], method))
+            assert_allclose(pycs3.regdiff.rslc.wtvdiffs(rss[0], rss[1], shifts, np.full(len(shifts), rss[1].timeshift),
+                                                        method), wtvs, rtol=1e-10)
+
+        # Each brute force stage of opt_rslcs gives the same shifts :
+        def errorfct(timeshifts):
+            for (rs, timeshift) in zip(rss[1:], timeshifts):
+                rs.timeshift = timeshift
+            return np.sum([pycs3.regdiff.rslc.wtvdiff(rs1, rs2, "weights") for (i, rs1) in enumerate(rss)
+                           for rs2 in rss[i + 1:]])
+        res = np.array([rs.timeshift for rs in rss[1:]])
+        for step in [5, 2.5, 1.25, 0.5]:
+            ranges = pycs3.regdiff.rslc.bruteranges(step, 3, res)
+            start = time.time()
+            res = pycs3.regdiff.rslc.brute_rslcs(rss, ranges, "weights")
+            vectime = time.time() - start
+            start = time.time()
+            assert np.array_equal(res, spopt.brute(errorfct, ranges, finish=None))
+            print("Brute step %.2f : %.3f s vectorised, %.3f s with brute" % (step, vectime, time.time() - start))
+
+        # And the full optimisation, with the final Powell step :
+        rss2 = [rs.copy() for rs in rss]
+        error_fct = pycs3.regdiff.rslc.opt_rslcs(rss, verbose=False)
+        error_fct2 = pycs3.regdiff.rslc.opt_rslcs(rss2, verbose=False, vectorised=False)
+        assert_allclose(error_fct, error_fct2, rtol=1e-6)
+        assert_allclose([rs.timeshift for rs in rss], [rs.timeshift for rs in rss2], atol=0.01)
+
+    def test_regressioncache(self):
+        cachedir = os.path.join(self.outpath, "regressioncache")
+        shutil.rmtree(cachedir, ignore_errors=True)
+        cache = pycs3.regdiff.rslc.RegressionCache(maxsize=4, cachedir=cachedir)
+
+        lc_copy = [lc.copy() for lc in self.lcs]
+        start = time.time()
+        rss = [pycs3.regdiff.rslc.factory(l, pd=1, cache=cache) for l in lc_copy]
+        fittime = time.time() - start
+
+        # A copy with another time shift reuses the regressions :
+        lc_func.settimeshifts(lc_copy, shifts=[0, -5, -20, -60], includefirst=True)
+        start = time.time()
+        rss2 = [pycs3.regdiff.rslc.factory(l, pd=1, cache=cache) for l in lc_copy]
+        print("Regressions : %.3f s, from the cache : %.5f s" % (fittime, time.time() - start))
+        assert (cache.hits, cache.misses) == (4, 4)
+        for (rs, rs2, l) in zip(rss, rss2, lc_copy):
+            assert_allclose(rs2.mags, rs.mags)
+            assert rs2.timeshift == l.timeshift
+        rss2[0].mask(maxmagerr=0.0)  # modifies the magerrs in place, but not the cache
+        assert_allclose(pycs3.regdiff.rslc.factory(lc_copy[0], pd=1.0, cache=cache).magerrs, rss[0].magerrs)
+        assert cache.hits == 5
+
+        # Other data or other parameters give new regressions :
+        rs = pycs3.regdiff.rslc.factory(lc_copy[0], pd=1, scale=100.0, cache=cache)
+        lc_copy[0].shiftmag(0.1)
+        rs = pycs3.regdiff.rslc.factory(lc_copy[0], pd=1, cache=cache)
+        assert cache.misses == 6
+        assert len(cache.entries) == 4  # LRU eviction
+
+        # Another process can use the regressions saved on disk :
+        othercache = pycs3.regdiff.rslc.RegressionCache(cachedir=cachedir)
+        rss3 = [pycs3.regdiff.rslc.factory(l, pd=1, cache=othercache) for l in lc_copy[1:]]
+        assert (othercache.hits, othercache.misses) == (3, 0)
+        for (rs, rs3) in zip(rss[1:], rss3):
+            assert_allclose(rs3.mags, rs.mags)
+            assert_allclose(rs3.magerrs, rs.magerrs)
+
+        pycs3.regdiff.multiopt.opt_ts(lc_copy, pd=1, verbose=False, cache=othercache)
+        assert (othercache.hits, othercache.misses) == (7, 0)
+        shutil.rmtree(cachedir)
+
+    def test_kalman(self):
+        l = self.lcs[1]
+        (x, y, yerr) = (l.jds, l.getmags(), l.magerrs)
+        jds = np.linspace(x[0] - 300., x[-1] + 300., 2000)
+        ny = (y - np.mean(y)) / np.std(y)
+        for pow in [1.5, 2.5]:
+            # Same likelihood and same posterior as the dense GP for fixed hyperparameters :
+            kernel = ConstantKernel(0.7) + 1.3 * Matern(length_scale=150.0, nu=pow) + WhiteKernel(0.01)
+            gp = GaussianProcessRegressor(kernel=kernel, alpha=yerr ** 2, normalize_y=True, optimizer=None)
+            gp.fit(x.reshape(-1, 1), y)
+            lam, N, P0 = kalmangp.statespace(pow, 150.0, 1.3, 0.7)
+            loglik, filtered = kalmangp.kalmanfilter(x, ny, yerr ** 2 + 0.01, lam, N, P0, store=True)
+            assert_allclose(loglik, gp.log_marginal_likelihood_value_, rtol=1e-10)
+            ms, Ps = kalmangp.rtssmoother(*filtered)
+            mean, var = kalmangp.predict(jds, x, filtered, ms, Ps, lam, N, P0)
+            (gpmean, gpstd) = gp.predict(jds.reshape(-1, 1), return_std=True)
+            assert_allclose(mean * np.std(y) + np.mean(y), gpmean, atol=1e-10)
+            assert_allclose(np.sqrt(var + 0.01) * np.std(y), gpstd, atol=1e-10)
+
+            # And the same regression, including the fit of the hyperparameters :
+            start = time.time()
+            (newy, newyerr) = scikitgp.regression(x, y, yerr, pow=pow)(jds)
+            sktime = time.time() - start
+            start = time.time()
+            (newy2, newyerr2) = kalmangp.regression(x, y, yerr, pow=pow)(jds)
+            print("Regression with pow=%.1f, sklearn : %.3f s, kalman : %.3f s" % (pow, sktime, time.time() - start))
+            assert_allclose(newy2, newy, atol=1e-4)
+            assert_allclose(newyerr2, newyerr, atol=1e-4)
+
+        lc_copy = [lc.copy() for lc in self.lcs]
+        lc_func.settimeshifts(lc_copy, shifts=[0, -5, -20, -60], includefirst=True)  # intial guess
+        myrslcs, error_fct = pycs3.regdiff.multiopt.opt_ts(lc_copy, pd=2, verbose=False, backend="kalman")
+        delays_th = [-4.39, -20.79, -70.52, -16.40, -66.13, -49.72]  # same as in test_regdiff_optim
+        assert_allclose(lc_func.getdelays(lc_copy, to_be_sorted=True), delays_th, atol=1.5)
+
 
 if __name__ == '__main__':
     pytest.main()
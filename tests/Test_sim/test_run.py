@@ -0,0 +1,94 @@
+import matplotlib
+matplotlib.use('Agg')
+import glob
+import os
+import shutil
+import unittest
+from unittest import mock
+
+import multiprocess
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+import pycs3.gen.lc_func as lc_func
+import pycs3.gen.splml
+import pycs3.gen.util
+import pycs3.sim.draw
+import pycs3.sim.run
+from tests import TEST_PATH
+from tests import utils
+
+
+class TestRun(unittest.TestCase):
+    def setUp(self):
+        self.path = TEST_PATH
+        self.outpath = os.path.join(self.path, "output")
+        self.lcs, self.spline = pycs3.gen.util.readpickle(os.path.join(self.path, 'data', "optcurves.pkl"))
+        self.lcslist = []
+        for shifts in ([0., -6., -21., -69.], [0., -4., -19., -71.], [0., -5., -22., -68.]):
+            lcs = [lc.copy() for lc in self.lcs]
+            for lc in lcs:
+                pycs3.gen.splml.addtolc(lc, knotstep=150)
+            lc_func.settimeshifts(lcs, shifts=shifts, includefirst=True)
+            self.lcslist.append(lcs)
+
+    def test_applyopt_parallel(self):
+        serial_lcslist = [[lc.copy() for lc in lcs] for lcs in self.lcslist]
+        parallel_lcslist = [[lc.copy() for lc in lcs] for lcs in self.lcslist]
+
+        serial_outs, serial_dic = pycs3.sim.run.applyopt(utils.spl_ml, serial_lcslist, ncpu=1, seed=42)
+        pool = multiprocess.Pool(2)
+        parallel_outs, parallel_dic = pycs3.sim.run.applyopt(utils.spl_ml, parallel_lcslist, executor=pool, seed=42)
+        pool.close()
+        pool.join()
+
+        assert serial_dic['success'] is True
+        assert parallel_dic['success'] is True
+        assert_allclose([s.lastr2nostab for s in parallel_outs], [s.lastr2nostab for s in serial_outs])
+        for serial_lcs, parallel_lcs in zip(serial_lcslist, parallel_lcslist):
+            assert_allclose(lc_func.getdelays(parallel_lcs), lc_func.getdelays(serial_lcs))
+            for serial_lc, parallel_lc in zip(serial_lcs, parallel_lcs):
+                # the microlensing has been optimised by the workers and copied back into our curves
+                assert np.any(parallel_lc.ml.spline.c != 0.0)
+                assert_allclose(parallel_lc.getmags(), serial_lc.getmags())
+
+    def test_applyopt_failure(self):
+        lcslist = [self.lcslist[0], []]
+        outs, dic = pycs3.sim.run.applyopt(utils.spl_ml, lcslist, ncpu=2, seed=1)
+        assert len(outs) == 1
+        assert dic['success'] is False
+        assert dic['failed_id'] == [1]
+
+    def test_multirun_pool(self):
+        self.clear_multipool()
+        lcs = [lc.copy() for lc in self.lcslist[0]]
+        pycs3.sim.draw.multidraw(lcs, onlycopy=True, n=2, npkl=2, simset="multipool", destpath=self.outpath)
+
+        pycs3.sim.run.multirun("multipool", lcs, utils.spl_ml, {}, optset="serial", shuffle=False,
+                               destpath=self.outpath, use_test_seed=True, ncpu=1)
+        with mock.patch.object(multiprocess, "Pool", wraps=multiprocess.Pool) as pool:
+            success_dic = pycs3.sim.run.multirun("multipool", lcs, utils.spl_ml, {}, optset="pool", shuffle=False,
+                                                 destpath=self.outpath, use_test_seed=True, ncpu=2)
+        # a single pool for the two pkls :
+        assert pool.call_count == 1
+        assert success_dic['success'] is True
+
+        serial_pkls = sorted(glob.glob(os.path.join(self.outpath, "sims_multipool_opt_serial", "*_runresults.pkl")))
+        pool_pkls = sorted(glob.glob(os.path.join(self.outpath, "sims_multipool_opt_pool", "*_runresults.pkl")))
+        assert len(serial_pkls) == 2 and len(pool_pkls) == 2
+        for serial_pkl, pool_pkl in zip(serial_pkls, pool_pkls):
+            serial_rr = pycs3.gen.util.readpickle(serial_pkl)
+            pool_rr = pycs3.gen.util.readpickle(pool_pkl)
+            assert_allclose(pool_rr.tsarray, serial_rr.tsarray)
+            assert_allclose(pool_rr.qs, serial_rr.qs)
+        self.clear_multipool()
+
+    def clear_multipool(self):
+        for dirname in ["sims_multipool", "sims_multipool_opt_serial", "sims_multipool_opt_pool"]:
+            if os.path.exists(os.path.join(self.outpath, dirname)):
+                shutil.rmtree(os.path.join(self.outpath, dirname))
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -14,6 +14,8 @@ import pycs3.sim.plot
 import pycs3.tdcomb.plot
 import pycs3.tdcomb.comb
 import pycs3.gen.stat
+import numpy as np
+from numpy.testing import assert_allclose
 
 from tests import utils
 import shutil
@@ -97,6 +99,27 @@ class TestSims(unittest.TestCase):
         fakelcs = pycs3.sim.draw.draw(self.lcs, self.spline, shotnoise='mcres')
         lc_func.display(fakelcs, [], filename=os.path.join(self.outpath, 'fakelcs4.png'))
 
+    def test_draw_batch(self):
+        pycs3.sim.draw.saveresiduals(self.lcs, self.spline)
+        lcs = [lc.copy() for lc in self.lcs]
+        lcs[1].shiftflux(0.2)
+        magslist, truetimeshifts = pycs3.sim.draw.draw_batch(lcs, self.spline, n=5, truetsr=8.0)
+        assert truetimeshifts.shape == (5, 4)
+        assert [mags.shape for mags in magslist] == [(5, len(l)) for l in lcs]
+
+        for i in range(5):
+            fakelcs = pycs3.sim.draw.draw(lcs, self.spline, keepshifts=False, keeporiginalml=False,
+                                          inprint_fake_shifts=truetimeshifts[i])
+            for j, fakel in enumerate(fakelcs):
+                assert_allclose(magslist[j][i], fakel.mags)
+        simlcslist = pycs3.sim.draw.batch_to_lcs(lcs, magslist, truetimeshifts)
+        assert simlcslist[3][2].truetimeshift == truetimeshifts[3, 2]
+
+        # with identical true shifts, only the shotnoise differs between the simulations
+        magslist, truetimeshifts = pycs3.sim.draw.draw_batch(lcs, self.spline, n=1000, shotnoise="sigma",
+                                                             truetimeshifts=np.zeros((1000, 4)))
+        assert_allclose(np.std(magslist[0], axis=0).mean(), np.std(lcs[0].residuals), rtol=0.1)
+
     def clear_sims(self):
         if os.path.exists(os.path.join(self.outpath, "sims_mocks_opt_spl")):
             shutil.rmtree(os.path.join(self.outpath, "sims_mocks_opt_spl"))
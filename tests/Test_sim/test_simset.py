@@ -0,0 +1,90 @@
+import matplotlib
+matplotlib.use('Agg')
+import glob
+import os
+import shutil
+import time
+import unittest
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+
+import pycs3.gen.lc_func as lc_func
+import pycs3.gen.splml
+import pycs3.gen.util
+import pycs3.sim.draw
+import pycs3.sim.run
+import pycs3.sim.simset
+from tests import TEST_PATH
+from tests import utils
+
+
+class TestSimSet(unittest.TestCase):
+    def setUp(self):
+        self.path = TEST_PATH
+        self.outpath = os.path.join(self.path, "output")
+        self.lcs, self.spline = pycs3.gen.util.readpickle(os.path.join(self.path, 'data', "optcurves.pkl"))
+        self.clear_sims()
+
+    def tearDown(self):
+        self.clear_sims()
+
+    def test_draw_npz(self):
+        pycs3.sim.draw.saveresiduals(self.lcs, self.spline)
+        self.lcs[0].mask[3] = False  # the simulations are not masked, whatever the format
+        for fmt in ["pkl", "npz"]:
+            np.random.seed(1)
+            pycs3.sim.draw.multidraw(self.lcs, self.spline, n=20, npkl=1, simset="simset_%s" % fmt,
+                                     destpath=self.outpath, truetsr=8.0, shotnoise="mcres", fmt=fmt)
+
+        pklfile = glob.glob(os.path.join(self.outpath, "sims_simset_pkl", "*.pkl"))[0]
+        npzfile = glob.glob(os.path.join(self.outpath, "sims_simset_npz", "*.npz"))[0]
+        print("Size pkl : %i, size npz : %i" % (os.path.getsize(pklfile), os.path.getsize(npzfile)))
+        assert os.path.getsize(npzfile) < os.path.getsize(pklfile)
+
+        start = time.time()
+        simlcslist = pycs3.sim.simset.readsims(pklfile)
+        print("Took %2.6f seconds to read the pkl" % (time.time() - start))
+        start = time.time()
+        simset = pycs3.sim.simset.readsims(npzfile)
+        print("Took %2.6f seconds to read the npz" % (time.time() - start))
+
+        assert len(simset) == len(simlcslist)
+        for simlcs, npzlcs in zip(simlcslist, simset):
+            assert [l.object for l in npzlcs] == [l.object for l in simlcs]
+            for l, npzl, refl in zip(simlcs, npzlcs, self.lcs):
+                assert_array_equal(npzl.jds, l.jds)
+                assert_allclose(npzl.mags, l.mags)
+                assert_array_equal(npzl.magerrs, l.magerrs)
+                assert_array_equal(npzl.mask, l.mask)
+                assert np.all(npzl.mask)
+                assert npzl.telescopename == l.telescopename == refl.telescopename + "sim"
+                assert npzl.truetimeshift == l.truetimeshift
+        assert simset.getmags().shape == (20, sum([len(l) for l in self.lcs]))
+        assert not hasattr(simset, "data")  # the npz file is not kept open
+        os.remove(npzfile)
+        assert len(simset[0]) == len(self.lcs)
+
+    def test_multirun_npz(self):
+        lcs = [lc.copy() for lc in self.lcs]
+        pycs3.sim.draw.multidraw(lcs, onlycopy=True, n=2, npkl=1, simset="simset_npz", destpath=self.outpath,
+                                 fmt="npz")
+        lc_func.settimeshifts(lcs, shifts=[0, -5, -20, -60], includefirst=True)
+        for lc in lcs:
+            pycs3.gen.splml.addtolc(lc, knotstep=150)
+        success_dic = pycs3.sim.run.multirun("simset_npz", lcs, utils.spl_ml, {}, optset="spl", tsrand=5.0,
+                                             destpath=self.outpath, use_test_seed=True)
+        assert success_dic['success'] is True
+        results = pycs3.sim.run.collect(directory=os.path.join(self.outpath, "sims_simset_npz_opt_spl"))
+        assert len(results) == 2
+        assert results.labels == [l.object for l in self.lcs]
+
+    def clear_sims(self):
+        for d in ["sims_simset_pkl", "sims_simset_npz", "sims_simset_npz_opt_spl"]:
+            if os.path.exists(os.path.join(self.outpath, d)):
+                shutil.rmtree(os.path.join(self.outpath, d))
+
+
+if __name__ == '__main__':
+    pytest.main()
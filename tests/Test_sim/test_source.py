@@ -47,6 +47,21 @@ class TestSource(unittest.TestCase):
         print(jds)
         sourceplot([source, source_copy], filename=os.path.join(self.outpath,'sourceplot.png'))
 
+    def test_plawnoise(self):
+        source = Source(name='source1', sampling=0.5)
+        noise = source.plawnoise(beta=-2.0, sigma=0.05, fmin=1 / 500., hann=True, n=50, rng=1)
+        assert noise.shape == (50, source.imags.size)
+        refs = []
+        for seed in range(50):
+            source_copy = source.copy()
+            source_copy.addplaw2(beta=-2.0, sigma=0.05, fmin=1 / 500., hann=True, seed=seed)
+            refs.append(source.imags - source_copy.imags)
+        assert abs(np.std(noise) / np.std(refs) - 1.0) < 0.1  # same amplitude as addplaw2
+
+        source_copy = source.copy()
+        source_copy.addplaw2(noise=noise[0])
+        assert_almost_equal(source.imags - source_copy.imags, noise[0])
+
 
 if __name__ == '__main__':
     pytest.main()
\ No newline at end of file
@@ -2,8 +2,16 @@ import matplotlib
 matplotlib.use('Agg')
 import os
 from tests import TEST_PATH
+import pickle
+from functools import partial
+import pycs3.gen.stat
 import pycs3.gen.util
+import pycs3.gen.splml
+import pycs3.sim.draw
+import pycs3.sim.src
 import pycs3.sim.twk
+import numpy as np
+from numpy.testing import assert_allclose
 import unittest
 import pytest
 
@@ -34,10 +42,90 @@ class TestSource(unittest.TestCase):
         spline_copy = self.spline.copy()
         pycs3.sim.twk.tweakml_PS(lc_copy,spline_copy, 1, psplot=True, verbose=True)
 
+    def test_tweakcontext(self):
+        for l in self.lcs:
+            pycs3.gen.splml.addtolc(l, n=2)
+        context = pycs3.sim.twk.TweakContext()
+        lc_ref = [lc.copy() for lc in self.lcs]
+        pycs3.sim.twk.tweakml_PS(lc_ref, self.spline, 1, seed=1)
+        for i in range(2):
+            lc_copy = [lc.copy(light=True) for lc in self.lcs]
+            pycs3.sim.twk.tweakml_PS(lc_copy, self.spline, 1, seed=1, context=context)
+            for l, lref in zip(lc_copy, lc_ref):
+                assert_allclose(l.ml.spline.c, lref.ml.spline.c, atol=1e-10)
+        assert context.misses == len(self.lcs)
+        assert context.hits == len(self.lcs)
+
+    def test_compactml(self):
+        for l in self.lcs:
+            pycs3.gen.splml.addtolc(l, n=2)
+        pycs3.sim.draw.saveresiduals(self.lcs, self.spline)
+        context = pycs3.sim.twk.TweakContext()
+        nmocks = 20
+        stats = []
+        noiserms = []
+        for compactml in [True, False]:
+            stat = []
+            rms = []
+            for k in range(nmocks):
+                # The same seeds for both paths : the mocks only differ by the representation of the tweaked ML.
+                tweakml = [partial(pycs3.sim.twk.tweakml_PS, B=1, seed=[k, j], context=context, compactml=compactml)
+                           for j in range(len(self.lcs))]
+                mocks = pycs3.sim.draw.draw(self.lcs, self.spline, tweakml=tweakml, keeptweakedml=True, keeporiginalml=False,
+                                            keepshifts=True)
+                stat.append([[s['zruns'], s['std']] for s in
+                             pycs3.gen.stat.mapresistats(pycs3.gen.stat.subtract(mocks, self.spline))])
+                rms.append([np.std(m.ml.calcmlmags(m) - l.ml.calcmlmags(l)) for (m, l) in zip(mocks, self.lcs)])
+            stats.append(np.array(stat))
+            noiserms.append(np.array(rms))
+        assert isinstance(mocks[0].ml, pycs3.gen.splml.SplineML)
+
+        # The amplitude of the injected noise, mock by mock :
+        assert_allclose(noiserms[0], noiserms[1], rtol=0.05)
+        # Each statistic of each curve, within its standard error over the mocks :
+        stderr = np.std(stats[1], axis=0) / np.sqrt(nmocks)
+        assert np.all(np.fabs(np.mean(stats[0], axis=0) - np.mean(stats[1], axis=0)) < 2.0 * stderr)
+
+        lc_copy = [lc.copy() for lc in self.lcs]
+        pycs3.sim.twk.tweakml_PS(lc_copy, self.spline, 1)
+        ml = lc_copy[0].ml
+        assert isinstance(ml, pycs3.gen.splml.NoiseSplineML)
+        assert_allclose(pickle.loads(pickle.dumps(ml)).calcmlmags(lc_copy[0]), ml.calcmlmags(lc_copy[0]))
+        assert_allclose(ml.copy().calcmlmags(lc_copy[0]), ml.calcmlmags(lc_copy[0]))
+
     def test_bandnoise(self):
         noise = pycs3.sim.twk.band_limited_noise(1./1000., 1.)
         print(noise)
 
+        freqs = np.linspace(0.01, 0.4, 100)
+        noises = pycs3.sim.twk.band_limited_noise_batch(freqs, np.ones(100), samples=1001, n=20, rng=1)
+        assert noises.shape == (20, 1001)
+        amps, nfft = pycs3.sim.twk.noise_amplitudes(freqs, np.ones(100), 1001)
+        noises = pycs3.sim.twk.fftnoise_batch(amps, nfft, n=3, rng=1)
+        assert_allclose(np.std(noises, axis=1), pycs3.sim.twk.noise_std(amps, nfft))  # exact, whatever the phases
+
+    def test_precomputed_noise(self):
+        for l in self.lcs:
+            pycs3.gen.splml.addtolc(l, n=2)
+        context = pycs3.sim.twk.TweakContext()
+        noise = [context.drawnoise(l, self.spline, 1, n=4, rng=i)[3] for i, l in enumerate(self.lcs)]
+        l = self.lcs[0]
+        resampled = context.drawnoise(l, self.spline, 1, n=4, rng=0, jds=l.getjds())
+        x_sample = context.get(l, self.spline, 1, 1 / 300.0)["x_sample"]
+        assert resampled.shape == (4, len(l))
+        assert_allclose(resampled[3], np.interp(l.getjds(), x_sample, noise[0], left=0., right=0.), atol=1e-12)
+        lc_copy = [lc.copy() for lc in self.lcs]
+        lc_copy2 = [lc.copy() for lc in self.lcs]
+        pycs3.sim.twk.tweakml_PS(lc_copy, self.spline, 1, context=context, noise=noise)
+        pycs3.sim.twk.tweakml_PS(lc_copy2, self.spline, 1, noise=noise)
+        for l, l2 in zip(lc_copy, lc_copy2):
+            assert_allclose(l.ml.spline.c, l2.ml.spline.c, atol=1e-10)
+
+        lc_copy = [lc.copy() for lc in self.lcs]
+        sources = [pycs3.sim.src.Source(l.ml.spline, sampling=0.1) for l in lc_copy]
+        noise = [source.plawnoise(beta=-2.0, sigma=0.05, fmin=1 / 500.0, rng=1)[0] for source in sources]
+        pycs3.sim.twk.tweakml(lc_copy, self.spline, noise=noise)
+
 
 if __name__ == '__main__':
     pytest.main()
\ No newline at end of file
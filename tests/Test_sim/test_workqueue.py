@@ -0,0 +1,137 @@
+import matplotlib
+matplotlib.use('Agg')
+import glob
+import os
+import shutil
+import time
+import unittest
+
+import pytest
+
+import pycs3.gen.lc_func as lc_func
+import pycs3.gen.splml
+import pycs3.gen.util
+import pycs3.sim.draw
+import pycs3.sim.run
+import pycs3.sim.workqueue
+from tests import TEST_PATH
+from tests import utils
+
+
+class TestWorkQueue(unittest.TestCase):
+    def setUp(self):
+        self.path = TEST_PATH
+        self.outpath = os.path.join(self.path, "output")
+        self.lcs, self.spline = pycs3.gen.util.readpickle(os.path.join(self.path, 'data', "optcurves.pkl"))
+        self.clear_queue()
+
+    def tearDown(self):
+        self.clear_queue()
+
+    def test_lease(self):
+        simdir = os.path.join(self.outpath, "sims_queue")
+        pycs3.sim.draw.multidraw(self.lcs, onlycopy=True, n=3, npkl=2, simset="queue", destpath=self.outpath)
+        simpkls = sorted(os.listdir(simdir))
+        queue = pycs3.sim.workqueue.WorkQueue(os.path.join(self.outpath, "queue.sqlite"), lease=0.5)
+        queue.populate([os.path.join(simdir, simpkl) for simpkl in simpkls])
+        queue.populate([os.path.join(simdir, simpkl) for simpkl in simpkls])  # nothing is added twice
+        assert queue.remaining() == 6 + 2  # 6 simulations and 2 pickles to finalise
+
+        tasks_a = queue.claim("a", n=4)
+        tasks_b = queue.claim("b", n=4)
+        assert len(tasks_a) == 4
+        assert len(tasks_b) == 2
+        assert len(set(tasks_a) & set(tasks_b)) == 0
+        assert queue.claim("c", n=4) == []
+
+        # worker b keeps its lease alive, worker a dies : its tasks are handed out again.
+        time.sleep(0.6)
+        queue.heartbeat("b")
+        tasks_c = queue.claim("c", n=10)
+        assert sorted(tasks_c) == sorted(tasks_a)
+
+        simpkl = tasks_c[0][0]
+        assert queue.complete(*tasks_a[0], "a") is False  # a lost its lease, its result is dropped
+        for task in tasks_b:
+            assert queue.complete(*task, "b") is True
+        moved = []
+        for task in tasks_c:
+            assert queue.complete(*task, "c", onsuccess=lambda: moved.append(task)) is True
+        assert moved == tasks_c
+        assert queue.complete(*tasks_c[0], "c") is False  # already done
+        assert queue.remaining() == 2  # the two pickles are not finalised yet
+        assert len(queue.unfinalised()) == 2
+        assert queue.claimfinalise(simpkl, "c") is True
+        assert queue.claimfinalise(simpkl, "b") is False
+
+        # worker c dies while finalising : the finalisation is handed out again.
+        time.sleep(0.6)
+        queue.heartbeat("b")
+        assert queue.claimfinalise(simpkl, "b") is True
+        queue.finalised(simpkl)
+        assert queue.claimfinalise(simpkl, "c") is False
+        assert queue.remaining() == 1
+        assert simpkl not in queue.unfinalised()
+
+    def test_queuerun(self):
+        lcs = [lc.copy() for lc in self.lcs]
+        pycs3.sim.draw.multidraw(lcs, onlycopy=True, n=2, npkl=2, simset="queue", destpath=self.outpath)
+        lc_func.settimeshifts(lcs, shifts=[0, -5, -20, -60], includefirst=True)
+        for lc in lcs:
+            pycs3.gen.splml.addtolc(lc, knotstep=150)
+
+        success_list = pycs3.sim.run.queuerun("queue", lcs, utils.spl_ml, {}, optset="spl", tsrand=5.0, keepopt=True,
+                                              destpath=self.outpath, use_test_seed=True, nworkers=2, trace=True)
+        assert len(success_list) == 2
+        assert all([dic['success'] for dic in success_list])
+        results = pycs3.sim.run.collect(directory=os.path.join(self.outpath, "sims_queue_opt_spl"))
+        assert len(results) == 4
+        assert len(glob.glob(os.path.join("trace_sims_queue_opt_spl", "*", "*.pkl"))) == 4
+
+        # in test seed mode, the initial shifts of the pickles are not the same
+        simpkls = sorted(os.listdir(os.path.join(self.outpath, "sims_queue")))
+        assert pycs3.sim.run._queueseed(simpkls[0], 0) != pycs3.sim.run._queueseed(simpkls[1], 0)
+        assert pycs3.sim.run._queueseed(simpkls[0], 0) == pycs3.sim.run._queueseed(
+            os.path.join(self.outpath, "sims_queue", simpkls[0]), 0)
+
+        # a second call has nothing left to do
+        assert pycs3.sim.run.queuerun("queue", lcs, utils.spl_ml, {}, optset="spl", destpath=self.outpath) == []
+
+    def test_queuerun_finalise_crash(self):
+        lcs = [lc.copy() for lc in self.lcs]
+        pycs3.sim.draw.multidraw(lcs, onlycopy=True, n=1, npkl=1, simset="queue", destpath=self.outpath)
+        for lc in lcs:
+            pycs3.gen.splml.addtolc(lc, knotstep=150)
+
+        # The worker dies after having optimised all the simulations, but before having written the runresults :
+        finalise = pycs3.sim.run._queuefinalise
+
+        def crash(*args):
+            raise RuntimeError("Worker died")
+
+        pycs3.sim.run._queuefinalise = crash
+        try:
+            with pytest.raises(RuntimeError):
+                pycs3.sim.run.queuerun("queue", lcs, utils.spl_ml, {}, optset="spl", destpath=self.outpath, lease=0.5)
+        finally:
+            pycs3.sim.run._queuefinalise = finalise
+
+        # A new call finalises the pickle once the lease has expired :
+        time.sleep(0.6)
+        success_list = pycs3.sim.run.queuerun("queue", lcs, utils.spl_ml, {}, optset="spl", destpath=self.outpath,
+                                              lease=0.5)
+        assert len(success_list) == 1
+        assert len(pycs3.sim.run.collect(directory=os.path.join(self.outpath, "sims_queue_opt_spl"))) == 1
+
+    def clear_queue(self):
+        if os.path.exists("trace_sims_queue_opt_spl"):
+            shutil.rmtree("trace_sims_queue_opt_spl")
+        for d in ["sims_queue", "sims_queue_opt_spl"]:
+            if os.path.exists(os.path.join(self.outpath, d)):
+                shutil.rmtree(os.path.join(self.outpath, d))
+        if os.path.exists(os.path.join(self.outpath, "queue.sqlite")):
+            os.remove(os.path.join(self.outpath, "queue.sqlite"))
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -9,11 +9,13 @@ import pycs3.gen.mrg as mrg
 import pycs3.spl.multiopt
 import pycs3.spl.topopt
 import pycs3.gen.splml
+import pycs3.gen.polyml
 from pycs3.sim.draw import shareflux
 import pytest
 import unittest
 import numpy as np
 from numpy.testing import assert_allclose
+from pycs3.gen.spl_func import r2
 from tests import utils
 
 
@@ -101,6 +103,28 @@ class TestOpt(unittest.TestCase):
         assert_allclose(delays, self.true_delays, atol=3)
         assert_allclose(delays2, self.true_delays, atol=3)
 
+    def test_opt_ts_gn(self):
+        lc_copy = [lc.copy() for lc in self.lcs]
+        for l in lc_copy[1:]:
+            l.timeshift += 1.5
+        lc_copy2 = [lc.copy() for lc in lc_copy]
+
+        pycs3.spl.multiopt.opt_ts_indi(lc_copy, self.spline, method='brute', crit="r2", brutestep=0.2, bruter=10,
+                                       verbose=False, optml=True)
+        pycs3.spl.multiopt.opt_ts_indi(lc_copy, self.spline, method='fmin', crit="r2", verbose=False, optml=True)
+        delays = lc_func.getdelays(lc_copy, to_be_sorted=True)
+
+        nit = pycs3.spl.multiopt.opt_ts_gn(lc_copy2, self.spline, optml=True, verbose=True)
+        delays2 = lc_func.getdelays(lc_copy2, to_be_sorted=True)
+        print(delays, delays2, nit)
+        assert nit < 10
+        assert_allclose(delays2, delays, atol=0.15)  # fmin works with xtol = 0.1
+        assert r2(lc_copy2, self.spline) < r2(lc_copy, self.spline) + 1.0
+
+        lc_copy3 = [lc.copy() for lc in self.lcs]
+        spline = pycs3.spl.topopt.opt_fine(lc_copy3, nit=2, knotstep=30, method="gn", verbose=False)
+        assert_allclose(lc_func.getdelays(lc_copy3, to_be_sorted=True), self.true_delays, atol=3)
+
     def test_opt_source_magshift(self):
         lc_copy = [lc.copy() for lc in self.lcs]
         self.clean_trace()
@@ -110,12 +134,80 @@ class TestOpt(unittest.TestCase):
         lc_func.display(lc_copy, [self.spline], showlegend=False, filename=os.path.join(self.outpath, 'trial_opt_magshift_source.png'))
         assert_allclose(magshift, magshift_th, atol=0.01)
 
+        # The exact weighted median gives the same magshifts, without iterations :
+        lc_copy2 = [lc.copy() for lc in self.lcs]
+        pycs3.spl.multiopt.opt_magshift(lc_copy2, sourcespline=self.spline, method="wmedian", verbose=True)
+        assert_allclose([lc.magshift for lc in lc_copy2], magshift, atol=2e-3)
+        for (l, l2) in zip(lc_copy, lc_copy2):
+            assert r2([l2], self.spline, nosquare=True) <= r2([l], self.spline, nosquare=True) * (1.0 + 1e-6)  # jds jitter
+
     def test_opt_source(self):
         lc_copy = [lc.copy() for lc in self.lcs]
         self.clean_trace()
         r2 = pycs3.spl.multiopt.opt_source(lc_copy, sourcespline=self.spline, dpmethod="extadj", bokmethod="BF", verbose=True,trace=True,tracedir=self.outpath)
         assert r2 < 3000
 
+    def test_opt_ml_source(self):
+        lc_copy = [lc.copy() for lc in self.lcs]
+        pycs3.gen.splml.addtolc(lc_copy[1], n=3)
+        pycs3.gen.polyml.addtolc(lc_copy[2], nparams=2)
+        pycs3.gen.splml.addtolc(lc_copy[3], n=4)
+        # A tweaked ML, whose noise stays fixed :
+        mldp = lc_copy[3].ml.spline.datapoints
+        noisejds = np.linspace(mldp.jds[0], mldp.jds[-1], 300)
+        noisemags = 0.02 * np.random.RandomState(3).randn(len(noisejds))
+        lc_copy[3].ml = pycs3.gen.splml.NoiseSplineML(lc_copy[3].ml.spline, noisejds, noisemags)
+        lc_copy2 = [lc.copy() for lc in lc_copy]
+        spline = self.spline.copy()
+        spline2 = self.spline.copy()
+
+        # The alternating scheme converges towards the joint solution :
+        for i in range(100):
+            pycs3.spl.multiopt.opt_source(lc_copy, spline, dpmethod="extadj", bokit=0, verbose=False)
+            pycs3.spl.multiopt.opt_ml(lc_copy, spline, bokit=0, splflat=False, verbose=False)
+        r2_alt = pycs3.spl.multiopt.opt_source(lc_copy, spline, dpmethod="extadj", bokit=0, verbose=False)
+        r2_joint = pycs3.spl.multiopt.opt_ml_source(lc_copy2, spline2, verbose=True)
+        assert_allclose(r2_joint, r2_alt, rtol=1e-6)
+        assert_allclose(spline2.c, spline.c, atol=1e-5)
+        for (l, l2) in zip(lc_copy, lc_copy2):
+            assert_allclose(l2.getmags(), l.getmags(), atol=1e-5)
+        assert_allclose(lc_copy2[3].ml.spline.datapoints.mags, lc_copy[3].ml.spline.datapoints.mags, atol=1e-5)
+
+        # With flat ML extremas, the exact constrained solution is at least as good as optc + optcflat :
+        for i in range(10):
+            pycs3.spl.multiopt.opt_source(lc_copy, spline, dpmethod="extadj", bokit=0, verbose=False)
+            pycs3.spl.multiopt.opt_ml(lc_copy, spline, bokit=0, splflat=True, verbose=False)
+        r2_alt = pycs3.spl.multiopt.opt_source(lc_copy, spline, dpmethod="extadj", bokit=0, verbose=False)
+        r2_joint = pycs3.spl.multiopt.opt_ml_source(lc_copy2, spline2, splflat=True, verbose=False)
+        assert r2_joint < r2_alt + 1.0
+        c = lc_copy2[1].ml.spline.c
+        assert c[0] == c[1] and c[-5] == c[-6]
+
+        lc_copy3 = [lc.copy() for lc in self.lcs]
+        spline = pycs3.spl.topopt.opt_fine(lc_copy3, nit=2, knotstep=30, jointsolve=True, verbose=False)
+        assert_allclose(lc_func.getdelays(lc_copy3, to_be_sorted=True), self.true_delays, atol=3)
+
+    def test_opt_ml_poly(self):
+        lc_copy = [lc.copy() for lc in self.lcs]
+        pycs3.gen.polyml.addtolc(lc_copy[1], nparams=2)
+        pycs3.gen.polyml.addtolc(lc_copy[2], nparams=3)
+        pycs3.spl.multiopt.opt_ml(lc_copy, self.spline, verbose=False)
+
+        for l in lc_copy[1:3]:
+            residuals = self.spline.eval(l.getjds()) - l.getmags(noml=True)
+            for m in l.ml.mllist:
+                jds = l.jds[m.season.indices]
+                ref = pycs3.gen.polyml.polyfit(jds - np.mean(jds), residuals[m.season.indices],
+                                               l.magerrs[m.season.indices], len(m.params))
+                assert_allclose(m.params, ref, rtol=1e-8, atol=1e-12)
+            # All the seasons at once, as the sum of the seasons :
+            assert_allclose(l.ml.calcmlmags(l), np.sum([m.calcmlmags(l) for m in l.ml.mllist], axis=0), atol=1e-12)
+
+        # The fit matrices are kept from one call to the next :
+        fitmats = [m.fitcache[2] for m in lc_copy[2].ml.mllist]
+        pycs3.spl.multiopt.opt_ml(lc_copy, self.spline, verbose=False)
+        assert all(m.fitcache[2] is f for (m, f) in zip(lc_copy[2].ml.mllist, fitmats))
+
     def test_distrib_flux(self):
         lc_copy = [lc.copy() for lc in self.lcs[:2]] #we take only 2 curves to test flux sharing
         shareflux(lc_copy[0], lc_copy[1], frac=0.1)
@@ -1,3 +1,4 @@
+import pycs3.spl.multiopt
 import pycs3.spl.topopt
 import pycs3.regdiff.multiopt as multiopt
 import pycs3.sim.twk
@@ -30,3 +31,9 @@ def Ctweakml(lcs,spline):
 
 def Dtweakml(lcs,spline):
     return pycs3.sim.twk.tweakml(lcs,spline, beta=-0.0, sigma=4.5, fmin=1 / 500.0, fmax=None, psplot=False)
+
+
+def spl_ml(lcs):
+    spline = pycs3.spl.topopt.opt_rough(lcs, nit=1, knotstep=30)
+    pycs3.spl.multiopt.opt_ml(lcs, spline, bokit=1, bokmethod="MCBF", splflat=False, verbose=False)
+    return spline